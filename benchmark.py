@@ -0,0 +1,194 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import tempfile
+import time
+
+import pygame
+from maplepy.base.constants import GAME_STATE
+from maplepy.game.game import Game
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Set up logging module
+logging.basicConfig(format='%(asctime)s %(levelname)s %(module)s %(message)s',
+                    datefmt='%H:%M:%S',
+                    level=logging.INFO)
+
+# Camera movement per frame
+CAMERA_PATHS = {
+    'still': lambda frame: (0, 0),
+    'horizontal': lambda frame: (8 if frame // 240 % 2 == 0 else -8, 0),
+    'vertical': lambda frame: (0, 6 if frame // 120 % 2 == 0 else -6),
+    'diagonal': lambda frame: (6, 4) if frame // 180 % 2 == 0 else (-6, -4),
+}
+
+# Arguments
+parser = argparse.ArgumentParser(description='Measure map loading and frame times headless')
+parser.add_argument('maps', nargs='*', help='map ids to measure, defaults to the map in the config')
+parser.add_argument('--config', default='config.json', help='config file')
+parser.add_argument('--assets', help='directory with the nx files, eg. assets/nx or test')
+parser.add_argument('--paths', nargs='*', default=list(CAMERA_PATHS.keys()),
+                    choices=list(CAMERA_PATHS.keys()), help='camera paths')
+parser.add_argument('--frames', type=int, default=600, help='frames measured per camera path')
+parser.add_argument('--warmup', type=int, default=60, help='frames drawn before measuring')
+parser.add_argument('--output', default='benchmark.json', help='json result file')
+parser.add_argument('--trace', action='store_true', help='include the span tree of each load')
+args = parser.parse_args()
+
+
+def get_rss():
+    """ Returns the current resident memory of this process in bytes, or None if unknown """
+
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def get_peak_rss():
+    """ Returns the peak resident memory of this process so far in bytes, or None if unknown """
+
+    if not resource:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system() == 'Darwin' else peak * 1024
+
+
+def get_percentiles(values):
+    """ Returns p50, p95, p99 and mean of frame times in milliseconds """
+
+    if not values:
+        return None
+
+    values = sorted(values)
+
+    def percentile(p):
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] * 1000
+
+    return {
+        'p50': percentile(50),
+        'p95': percentile(95),
+        'p99': percentile(99),
+        'mean': sum(values) / len(values) * 1000,
+    }
+
+
+def get_load_times(trace):
+    """ Returns the seconds of each load phase, spans by name and counters of a load trace """
+
+    # Spans with the same name are summed, eg. every decode
+    spans = {}
+    for span in trace.walk():
+        count, seconds = spans.get(span.name, (0, 0.0))
+        spans[span.name] = (count + 1, seconds + span.duration)
+
+    return {
+        'phases': {span.name: span.duration for span in trace.children},
+        'total': trace.duration,
+        'spans': {name: {'count': count, 'seconds': seconds} for name, (count, seconds) in spans.items()},
+        'counters': trace.get_counters(),
+        'slowest': [{'name': span.name, 'key': span.args['key'], 'seconds': span.duration}
+                    for span in trace.get_slowest(10)],
+    }
+
+
+def measure_path(game, display, path):
+    """ Move the camera along a path, returns update and blit times per frame """
+
+    # Start from the center of the map
+    if display.view_limit:
+        display.view.center = display.view_limit.center
+    move = CAMERA_PATHS[path]
+
+    update_times = []
+    blit_times = []
+    for frame in range(args.warmup + args.frames):
+        display.move_view(*move(frame))
+
+        start = time.perf_counter()
+        display.update()
+        updated = time.perf_counter()
+        game.render(GAME_STATE.DEFAULT)
+        rendered = time.perf_counter()
+
+        if frame >= args.warmup:
+            update_times.append(updated - start)
+            blit_times.append(rendered - updated)
+
+    return {
+        'frames': len(blit_times),
+        'update': get_percentiles(update_times),
+        'blit': get_percentiles(blit_times),
+    }
+
+
+# Config, prefetching would compete with the measurements
+with open(args.config) as file:
+    config = json.load(file)
+if args.assets:
+    config['asset_path'] = args.assets
+config['prefetch_maps'] = 0
+with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as file:
+    json.dump(config, file)
+    config_file = file.name
+
+# Headless game, the map display is driven directly
+try:
+    game = Game(config_file, headless=True)
+finally:
+    os.remove(config_file)
+display = game.displays[GAME_STATE.DEFAULT]
+
+# Measure
+results = {}
+for map_id in args.maps or [config['map']]:
+
+    # Load, the trace is kept until the next load
+    rss = get_rss()
+    display.trace = None
+    display.load_map(map_id)
+    trace = display.get_trace()
+    if not trace or not trace.children:
+        logging.warning(f'{map_id} was not loaded')
+        continue
+    logging.info(f'Loaded {map_id} in {trace.duration:.3f}s')
+
+    # Frames
+    paths = {path: measure_path(game, display, path) for path in args.paths}
+
+    # Memory added by this map, peak memory is process-wide and includes earlier maps
+    rss_after = get_rss()
+    results[map_id] = {
+        'load': get_load_times(trace),
+        'paths': paths,
+        'rss_delta': rss_after - rss if rss and rss_after else None,
+        'cumulative_peak_rss': get_peak_rss(),
+    }
+    if args.trace:
+        results[map_id]['trace'] = trace.to_dict()
+    for path, result in paths.items():
+        logging.info(f'{map_id} {path}: update p50 {result["update"]["p50"]:.2f}ms, '
+                     f'blit p50 {result["blit"]["p50"]:.2f}ms p99 {result["blit"]["p99"]:.2f}ms')
+
+# Save
+report = {
+    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'python': platform.python_version(),
+    'pygame': pygame.version.ver,
+    'platform': platform.platform(),
+    'size': [game.width, game.height],
+    'config': {key: value for key, value in config.items() if not isinstance(value, list)},
+    'maps': results,
+    'peak_rss': get_peak_rss(),
+}
+with open(args.output, 'w') as file:
+    json.dump(report, file, indent=2)
+logging.info(f'Saved results to {args.output}')
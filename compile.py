@@ -0,0 +1,65 @@
+import argparse
+import logging
+import os
+
+from maplepy.helper.config import Config
+from maplepy.nx.displaynx import map_file_names
+from maplepy.nx.parser.catalognx import MapCatalog
+from maplepy.nx.parser.compiledmapnx import CompiledMap
+from maplepy.nx.parser.mapnx import MapNx
+
+# Set up logging module
+logging.basicConfig(format='%(asctime)s %(levelname)s %(module)s %(message)s',
+                    datefmt='%H:%M:%S',
+                    level=logging.INFO)
+
+# Arguments
+parser = argparse.ArgumentParser(description='Compile maps into compact binary map files')
+parser.add_argument('maps', nargs='*', help='map ids to compile')
+parser.add_argument('--all', action='store_true', help='compile every map')
+parser.add_argument('--catalog', action='store_true', help='build the map catalog')
+parser.add_argument('--config', default='config.json', help='config file')
+parser.add_argument('--output', help='output directory, defaults to compiled_map_path')
+args = parser.parse_args()
+
+# Config
+config = Config.instance()
+config.init(args.config)
+output = args.output or config['compiled_map_path'] or './cache/maps'
+os.makedirs(output, exist_ok=True)
+
+# Open map files
+map_nx = MapNx()
+for file in map_file_names:
+    map_nx.open(f'{config["asset_path"]}/{file}')
+identity = map_nx.get_identity()
+
+# Catalog
+if args.catalog:
+    catalog_path = config['catalog_path'] or './cache/catalog.json'
+    MapCatalog.build(map_nx).save(catalog_path)
+    logging.info(f'Saved map catalog to {catalog_path}')
+
+# Get map ids
+map_ids = list(args.maps)
+if args.all:
+    map_ids += [name[:9] for name in map_nx.get_map_nodes().keys()]
+if not map_ids and not args.catalog:
+    parser.error('no maps to compile, pass map ids, --all or --catalog')
+
+# Compile
+count = 0
+for map_id in map_ids:
+    try:
+        bundle = map_nx.load_bundle(map_id)
+        if not bundle:
+            logging.warning(f'{map_id} not found')
+            continue
+        compiled = CompiledMap.from_bundle(bundle, identity)
+        compiled.save(f'{output}/{map_id}.map')
+        count += 1
+    except:
+        logging.exception(f'Failed to compile {map_id}')
+
+if map_ids:
+    logging.info(f'Compiled {count}/{len(map_ids)} maps to {output}')
@@ -1,3 +1,4 @@
+import argparse
 import logging
 
 from maplepy.game.game import Game
@@ -7,6 +8,13 @@ logging.basicConfig(format='%(asctime)s %(levelname)s %(module)s %(message)s',
                     datefmt='%H:%M:%S',
                     level=logging.INFO)
 
+# Arguments
+parser = argparse.ArgumentParser(description='MaplePie')
+parser.add_argument('--config', default='config.json', help='config file')
+parser.add_argument('--headless', action='store_true', help='render offscreen without a window or audio device')
+parser.add_argument('--frames', type=int, help='stop after rendering this many frames of the map')
+args = parser.parse_args()
+
 # Run
-game = Game('config.json')
-game.run()
+game = Game(args.config, headless=args.headless)
+game.run(args.frames)
@@ -0,0 +1,104 @@
+import pygame
+
+
+class Atlas():
+    """
+    Class that packs many small images into a few large surfaces (pages).
+
+    Images are placed on shelves: rows filled left to right, tallest images first.
+    Each packed image is available as a subsurface of its page,
+    so drawing it only references the shared page pixels.
+    """
+
+    def __init__(self, width=1024, height=2048, padding=1):
+
+        # Page limits
+        self.width = width
+        self.height = height
+        self.padding = padding
+
+        # Packed pages
+        self.pages = []
+
+        # key: (page index, rect)
+        self.regions = {}
+
+    def __contains__(self, key):
+        return key in self.regions
+
+    def __len__(self):
+        return len(self.regions)
+
+    def get_size(self):
+        """ Returns the memory used by all pages in bytes """
+
+        size = 0
+        for page in self.pages:
+            w, h = page.get_size()
+            size += w * h * page.get_bytesize()
+        return size
+
+    def pack(self, images):
+        """
+        Packs images into new pages
+
+        Args:
+            images (dict): key: surface
+        """
+
+        # Tallest first keeps shelves tight
+        order = sorted(images.items(), key=lambda item: -item[1].get_height())
+
+        # Layout: [page][(key, rect)]
+        layout = []
+        page_sizes = []
+        x = y = shelf = 0
+        for key, image in order:
+            w, h = image.get_size()
+            pw, ph = w + self.padding, h + self.padding
+
+            # Next shelf
+            if x + pw > self.width:
+                x, y, shelf = 0, y + shelf, 0
+
+            # Next page
+            if not layout or y + ph > self.height:
+                layout.append([])
+                page_sizes.append([0, 0])
+                x = y = shelf = 0
+
+            # Place
+            layout[-1].append((key, pygame.Rect(x, y, w, h)))
+            page_sizes[-1][0] = max(page_sizes[-1][0], x + w)
+            page_sizes[-1][1] = max(page_sizes[-1][1], y + h)
+            x += pw
+            shelf = max(shelf, ph)
+
+        # Copy images onto pages, an exact copy of every pixel including alpha
+        for placed, size in zip(layout, page_sizes):
+            page = pygame.Surface(size, pygame.SRCALPHA).convert_alpha()
+            page.fill((0, 0, 0, 0))
+            for key, rect in placed:
+                page.blit(images[key], rect, special_flags=pygame.BLEND_RGBA_MAX)
+                self.regions[key] = (len(self.pages), rect)
+            self.pages.append(page)
+
+    def get_region(self, key):
+        """ Returns (page, rect) of a packed image, or None if it is not packed """
+
+        region = self.regions.get(key)
+        if not region:
+            return None
+
+        index, rect = region
+        return self.pages[index], rect
+
+    def get(self, key):
+        """ Returns a packed image as a subsurface of its page, or None if it is not packed """
+
+        region = self.get_region(key)
+        if not region:
+            return None
+
+        page, rect = region
+        return page.subsurface(rect)
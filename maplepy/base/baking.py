@@ -0,0 +1,207 @@
+import pygame
+from maplepy.base.grid import SpatialGrid
+from maplepy.base.sprite import blit_sequence
+from maplepy.helper.profiler import profiler
+
+# Chunks are composited with premultiplied alpha, premul_alpha was added in pygame 2.1.4
+PREMULTIPLIED = hasattr(pygame.Surface, 'premul_alpha')
+
+
+def is_static(sprite):
+    """ Returns True if the sprite never changes its image """
+    return len(sprite.canvas_list) == 1
+
+
+def is_translucent(image):
+    """ Returns True if the image has pixels that are neither opaque nor fully transparent """
+
+    if not image.get_flags() & pygame.SRCALPHA:
+        return False
+    visible = pygame.mask.from_surface(image, 0).count()
+    opaque = pygame.mask.from_surface(image, 254).count()
+    return visible != opaque
+
+
+def premultiply(image):
+    """ Returns the image with premultiplied alpha, images without per pixel alpha are opaque """
+
+    if not image.get_flags() & pygame.SRCALPHA:
+        return image
+
+    # premul_alpha reads the wrong pixels of atlas regions, so regions are copied first
+    if image.get_parent():
+        image = image.copy()
+    return image.premul_alpha()
+
+
+def get_bounds(sprite):
+    """ Returns a rect containing every frame of the sprite """
+
+    rects = [canvas.rect.move(sprite.x, sprite.y) for canvas in sprite.canvas_list]
+    return rects[0].unionall(rects[1:]) if rects else sprite.rect
+
+
+def sizeof_chunk(chunk):
+    """ Returns the memory used by a chunk surface in bytes """
+    image, _ = chunk
+    w, h = image.get_size()
+    return w * h * image.get_bytesize()
+
+
+class BakedLayer():
+    """
+    Class that draws a layer with its static sprites baked into chunk surfaces.
+
+    Sprites are split into levels, drawn in order:
+        static sprites of level 0, baked into chunks
+        animated sprites of level 0, drawn one at a time
+        static sprites of level 1, ...
+
+    Each sprite is placed in the lowest level that still draws it after
+    every earlier sprite it overlaps, so the result matches drawing
+    the sprites one at a time in layer order.
+
+    Chunks are square regions of one level, rendered the first time
+    they are visible and kept in a shared cache.
+    A chunk surface only covers the sprites inside it, empty space is not stored.
+
+    Blending ignores the alpha of the target, so translucent sprites composited
+    into a transparent chunk would not match drawing them onto the screen.
+    Chunks are rendered and drawn with premultiplied alpha instead, which gives
+    the same colours up to rounding. Without premultiplied alpha, translucent sprites
+    are not baked.
+    """
+
+    def __init__(self, sprites, cache, key, chunk_size=512):
+        """
+        Args:
+            sprites (list): sprites in draw order
+            cache (LRUCache): shared chunk cache
+            key: identifies this layer in the cache
+            chunk_size (int): width and height of a chunk
+        """
+
+        self.cache = cache
+        self.key = key
+        self.chunk_size = chunk_size
+
+        # Per level
+        self.static = []      # SpatialGrid of static sprites, one cell per chunk
+        self.animated = []    # Animated sprites in draw order
+
+        self.sprites = list(sprites)
+        self.build()
+
+    def build(self):
+        """ Assign every sprite to a level """
+
+        # Earlier sprites, used to find overlaps
+        grid = SpatialGrid()
+        bounds = []
+        static = []
+        levels = []
+
+        for index, sprite in enumerate(self.sprites):
+
+            rect = get_bounds(sprite)
+            still = is_static(sprite) and (PREMULTIPLIED or not is_translucent(sprite.image))
+
+            # Draw after every earlier sprite this one overlaps
+            level = 0
+            for other in grid.query(rect):
+                if not rect.colliderect(bounds[other]):
+                    continue
+                if still and not static[other]:
+                    level = max(level, levels[other] + 1)
+                else:
+                    level = max(level, levels[other])
+
+            grid.insert(index, rect)
+            bounds.append(rect)
+            static.append(still)
+            levels.append(level)
+
+            # Add level
+            while len(self.static) <= level:
+                self.static.append(SpatialGrid(self.chunk_size))
+                self.animated.append([])
+
+            # Static sprites are baked, animated sprites are drawn as they are
+            if still:
+                self.static[level].insert(index, sprite.rect)
+            else:
+                self.animated[level].append(sprite)
+
+    def get_chunk(self, level, column, row):
+        """ Returns (surface, world position) of a chunk, rendered if it is not cached """
+
+        key = (self.key, level, column, row)
+        chunk = self.cache.get(key)
+        if chunk is not None:
+            return chunk
+
+        # Sprites of the chunk in draw order
+        size = self.chunk_size
+        sprites = [self.sprites[index] for index in sorted(self.static[level].cells[(column, row)])]
+
+        # Only the region covered by sprites
+        area = pygame.Rect(column * size, row * size, size, size)
+        area = area.clip(sprites[0].rect.unionall([sprite.rect for sprite in sprites[1:]]))
+
+        # Render, images shared by several sprites are premultiplied once
+        image = pygame.Surface(area.size, pygame.SRCALPHA).convert_alpha()
+        image.fill((0, 0, 0, 0))
+        if PREMULTIPLIED:
+            images = {}
+            for sprite in sprites:
+                if sprite.image not in images:
+                    images[sprite.image] = premultiply(sprite.image)
+                image.blit(images[sprite.image], sprite.rect.move(-area.x, -area.y),
+                           special_flags=pygame.BLEND_PREMULTIPLIED)
+        else:
+            for sprite in sprites:
+                image.blit(sprite.image, sprite.rect.move(-area.x, -area.y))
+
+        chunk = (image, area.topleft)
+        self.cache.put(key, chunk)
+        return chunk
+
+    def blit(self, surface, offset):
+        """ Draw visible chunks and animated sprites """
+
+        # Chunks overlapping the view
+        size = self.chunk_size
+        left, top = offset.left // size, offset.top // size
+        right, bottom = (offset.right - 1) // size, (offset.bottom - 1) // size
+
+        # Chunks are drawn with premultiplied alpha, so each level takes two draws
+        flags = pygame.BLEND_PREMULTIPLIED if PREMULTIPLIED else 0
+        chunks = 0
+        drawn = 0
+        colliderect = offset.colliderect
+        for level, grid in enumerate(self.static):
+
+            # Static sprites
+            sequence = []
+            for column in range(left, right + 1):
+                for row in range(top, bottom + 1):
+                    if (column, row) not in grid.cells:
+                        continue
+                    image, (x, y) = self.get_chunk(level, column, row)
+                    sequence.append((image, (x - offset.x, y - offset.y)))
+            if sequence:
+                blit_sequence(surface, sequence, flags)
+                chunks += len(sequence)
+
+            # Animated sprites
+            sequence = [(sprite.image, sprite.rect.move(-offset.x, -offset.y))
+                        for sprite in self.animated[level] if colliderect(sprite.rect)]
+            if sequence:
+                blit_sequence(surface, sequence)
+                drawn += len(sequence)
+
+        # Chunks and animated instances drawn, animated instances skipped outside the view
+        if profiler.enabled:
+            profiler.count('chunks', chunks)
+            profiler.count('drawn', drawn)
+            profiler.count('culled', sum(len(sprites) for sprites in self.animated) - drawn)
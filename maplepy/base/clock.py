@@ -0,0 +1,144 @@
+import numpy as np
+
+# Canvas delays are in milliseconds, each tick advances this many (ticks run at TICK_RATE)
+FRAME_FACTOR = 15
+
+# Scroll speed of backgrounds per tick
+SCROLL_FACTOR = 0.5
+
+
+class AnimationClock():
+    """
+    Class that advances the frames and scrolling of many instances in one vectorized step.
+
+    Each animated instance (more than one canvas) is tracked in arrays:
+        frame index, ticks elapsed on the frame, number of frames
+    Delays and alpha endpoints of every canvas are kept in flat arrays,
+    the current canvas of an instance is its first canvas plus its frame index.
+
+    Each scrolling background (types 4 to 7) is tracked in arrays:
+        offset, speed and period on each axis
+
+    Only instances whose visible frame, alpha or offset changed are written back.
+    """
+
+    def __init__(self, sprites):
+        """
+        Args:
+            sprites (list): instances, positions in this list identify changed instances
+        """
+
+        # Animated instances
+        animated = [(position, sprite) for position, sprite in enumerate(sprites)
+                    if len(sprite.canvas_list) > 1]
+        self.positions = [position for position, _ in animated]
+        self.sprites = [sprite for _, sprite in animated]
+
+        self.index = np.array([sprite.canvas_list_index for sprite in self.sprites], dtype=np.int64)
+        self.elapsed = np.array([sprite.frame_count for sprite in self.sprites], dtype=np.int64)
+        self.length = np.array([len(sprite.canvas_list) for sprite in self.sprites], dtype=np.int64)
+        self.start = np.zeros(len(self.sprites), dtype=np.int64)
+        if len(self.sprites) > 1:
+            self.start[1:] = np.cumsum(self.length)[:-1]
+
+        # Every canvas
+        canvases = [canvas for sprite in self.sprites for canvas in sprite.canvas_list]
+        self.delay = np.array([canvas.delay for canvas in canvases], dtype=np.int64)
+        self.a0 = np.array([canvas.a0 for canvas in canvases], dtype=np.int64)
+        self.a1 = np.array([canvas.a1 for canvas in canvases], dtype=np.int64)
+
+        # Last alpha set on each instance, -1 if not set
+        self.alpha = np.full(len(self.sprites), -1, dtype=np.int64)
+
+        # Scrolling instances
+        scrolling = [(position, sprite) for position, sprite in enumerate(sprites)
+                     if sprite.type in [4, 5, 6, 7]]
+        self.scroll_positions = [position for position, _ in scrolling]
+        self.scroll_sprites = [sprite for _, sprite in scrolling]
+
+        self.offset = np.array([[sprite.dx, sprite.dy] for sprite in self.scroll_sprites],
+                               dtype=np.float64).reshape(-1, 2)
+        self.speed = np.array([[sprite.rx or 0, sprite.ry or 0] for sprite in self.scroll_sprites],
+                              dtype=np.float64).reshape(-1, 2)
+        self.period = np.array([[2 * (sprite.cx or 0), 2 * (sprite.cy or 0)] for sprite in self.scroll_sprites],
+                               dtype=np.float64).reshape(-1, 2)
+
+        # Horizontal: 4, 6  Vertical: 5, 7
+        self.scrolls = np.array([[sprite.type in [4, 6] and (sprite.cx or 0) > 0,
+                                  sprite.type in [5, 7] and (sprite.cy or 0) > 0]
+                                 for sprite in self.scroll_sprites], dtype=bool).reshape(-1, 2)
+
+    def sync(self):
+        """ Write the elapsed ticks back to every instance """
+
+        for sprite, elapsed in zip(self.sprites, self.elapsed.tolist()):
+            sprite.frame_count = elapsed
+
+    def tick(self):
+        """
+        Advance every instance by one tick
+
+        Returns:
+            list of (position, rect before the tick) of instances that changed
+        """
+
+        changed = []
+        if self.sprites:
+            changed.extend(self.step_frames())
+        if self.scroll_sprites:
+            changed.extend(self.step_scrolls())
+        return changed
+
+    def step_frames(self):
+
+        # Count ticks on the current canvas
+        self.elapsed += 1
+        count = self.elapsed * FRAME_FACTOR
+        current = self.start + self.index
+        delay = self.delay[current]
+        a0 = self.a0[current]
+        a1 = self.a1[current]
+
+        # Alpha between endpoints, only for canvases with a delay
+        timed = delay > 0
+        alpha = a0 + (count / np.where(timed, delay, 1)) * (a1 - a0)
+
+        # Reached the delay, advance to the next canvas
+        advanced = count >= delay
+        self.index[advanced] = (self.index[advanced] + 1) % self.length[advanced]
+        self.elapsed[advanced] = 0
+        self.alpha[advanced] = self.a0[self.start[advanced] + self.index[advanced]]
+
+        # Alpha changed on the same canvas
+        faded = timed & ~advanced & (alpha.astype(np.int64) != self.alpha)
+        self.alpha[faded] = alpha[faded].astype(np.int64)
+
+        # Write back
+        changed = []
+        for i in np.flatnonzero(advanced).tolist():
+            sprite = self.sprites[i]
+            changed.append((self.positions[i], sprite.rect))
+            sprite.set_frame(int(self.index[i]))
+        for i in np.flatnonzero(faded).tolist():
+            sprite = self.sprites[i]
+            sprite.image.set_alpha(float(alpha[i]))
+            changed.append((self.positions[i], sprite.rect))
+
+        return changed
+
+    def step_scrolls(self):
+
+        # Move and wrap around twice the tile size
+        previous = self.offset.copy()
+        moved = self.scrolls & (self.speed != 0)
+        step = np.where(moved, self.offset + self.speed * SCROLL_FACTOR, self.offset)
+        self.offset = np.where(moved, np.remainder(step, np.where(moved, self.period, 1)), self.offset)
+
+        # Write back
+        changed = []
+        for i in np.flatnonzero((self.offset != previous).any(axis=1)).tolist():
+            sprite = self.scroll_sprites[i]
+            sprite.dx, sprite.dy = self.offset[i].tolist()
+            changed.append((self.scroll_positions[i], sprite.rect))
+
+        return changed
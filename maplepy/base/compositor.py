@@ -0,0 +1,122 @@
+import logging
+
+import pygame
+from maplepy.helper.profiler import profiler
+
+SCALING_MODES = ['smooth', 'nearest', 'integer']
+
+
+class BackgroundCompositor():
+    """
+    Class that draws background sprites onto a fixed size surface,
+    then scales it into a preallocated frame of the target size.
+
+    The frame is kept until a background sprite changes, the view moves
+    or the target size changes, so a still background costs one blit.
+
+    Scaling modes:
+        smooth      filtered scaling to the target size
+        nearest     unfiltered scaling to the target size
+        integer     unfiltered scaling by a whole factor, centered in the target
+    """
+
+    def __init__(self, width, height, scaling='smooth'):
+
+        # Fixed size background
+        self.surface = pygame.Surface((width, height))
+        self.scaling = 'smooth'
+        self.set_scaling(scaling)
+
+        # Scaled frame and where the background is placed in it
+        self.frame = None
+        self.area = None
+
+        # State of the current frame
+        self.valid = False
+        self.sprites = None
+        self.view = None
+
+    def get_size(self):
+        return self.surface.get_size()
+
+    def set_scaling(self, scaling):
+        """ Sets the scaling mode, smooth, nearest or integer """
+
+        if scaling not in SCALING_MODES:
+            logging.warning(f'{scaling} is not a valid scaling mode')
+            scaling = 'smooth'
+
+        self.scaling = scaling
+        self.invalidate()
+
+    def invalidate(self):
+        """ Draw and scale the background again in the next render """
+        self.valid = False
+
+    def get_screen_rect(self, rect):
+        """ Returns the frame region covering a background rect, including filtered neighbours """
+
+        if not self.area:
+            return pygame.Rect(rect)
+
+        w, h = self.surface.get_size()
+        scale_x = self.area.width / w
+        scale_y = self.area.height / h
+        return pygame.Rect(self.area.x + int(rect.x * scale_x) - 1,
+                           self.area.y + int(rect.y * scale_y) - 1,
+                           int(rect.width * scale_x) + 3,
+                           int(rect.height * scale_y) + 3)
+
+    def scale(self, size):
+        """ Scale the background into the frame """
+
+        # Preallocate frame, same format as the background
+        if not self.frame or self.frame.get_size() != size:
+            self.frame = pygame.Surface(size, 0, self.surface)
+
+        w, h = self.surface.get_size()
+        factor = min(size[0] // w, size[1] // h)
+
+        # Whole factor, centered, falls back to smooth if the target is smaller
+        if self.scaling == 'integer' and factor > 0:
+            self.area = pygame.Rect(0, 0, w * factor, h * factor)
+            self.area.center = self.frame.get_rect().center
+            self.frame.fill((0, 0, 0))
+            pygame.transform.scale(self.surface, self.area.size, self.frame.subsurface(self.area))
+            return
+
+        self.area = self.frame.get_rect()
+        if self.scaling == 'nearest':
+            pygame.transform.scale(self.surface, size, self.frame)
+        else:
+            pygame.transform.smoothscale(self.surface, size, self.frame)
+
+    def render(self, sprites, view, size, changed=False):
+        """
+        Returns the background frame for a view
+
+        Args:
+            sprites (BackgroundSprites): background sprites
+            view (pygame.Rect): user view
+            size (tuple): target size
+            changed (bool): a background sprite moved or animated since the last render
+        """
+
+        size = tuple(size)
+
+        # Reuse the current frame
+        if (self.valid and not changed and sprites is self.sprites
+                and view == self.view and self.frame.get_size() == size):
+            return self.frame
+
+        # Draw and scale
+        self.surface.fill((0, 0, 0))
+        sprites.blit(self.surface, view)
+        start = profiler.start()
+        self.scale(size)
+        profiler.stop('blit.scale', start)
+
+        self.valid = True
+        self.sprites = sprites
+        self.view = view.copy()
+        return self.frame
@@ -6,6 +6,16 @@ import pygame
 PYGAME_FLAGS: Final = pygame.HWSURFACE | pygame.HWACCEL | pygame.SRCALPHA | pygame.RESIZABLE
 CAMERA_SPEED = 4
 
+# Simulation ticks per second, animation and camera speed are per tick
+TICK_RATE = 60
+
+# Most ticks simulated before rendering, a slower game drops the remaining time
+MAX_CATCHUP_TICKS = 5
+
+# Frames between refreshes of the profiler overlay
+PROFILER_REFRESH = 30
+
+
 class GAME_STATE(Enum):
     LOADING = 0
     DEFAULT = 1
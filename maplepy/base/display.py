@@ -2,6 +2,31 @@ import logging
 import os
 
 import pygame
+from maplepy.base.compositor import BackgroundCompositor
+from maplepy.helper.profiler import profiler
+
+# Dirty rect rendering falls back to a full redraw above these limits
+MAX_DIRTY_RECTS = 32
+MAX_DIRTY_AREA = 0.5
+
+
+def merge_rects(rects):
+    """ Merge overlapping rects until no two rects overlap """
+
+    merged = []
+    for rect in rects:
+        rect = pygame.Rect(rect)
+        if rect.width <= 0 or rect.height <= 0:
+            continue
+
+        # Absorb every rect it overlaps, the union can overlap more
+        index = rect.collidelist(merged)
+        while index != -1:
+            rect.union_ip(merged.pop(index))
+            index = rect.collidelist(merged)
+        merged.append(rect)
+
+    return merged
 
 
 class SpriteDisplay():
@@ -14,7 +39,7 @@ class SpriteDisplay():
 
     def __init__(self, w, h):
         """
-        Contains a separate background surface to draw explicit background images
+        Contains a separate background compositor to draw explicit background images
         Contains background and layered sprites that have to be loaded with some data
         """
 
@@ -36,6 +61,29 @@ class SpriteDisplay():
         # Items are always on top
         self.overlayed_sprites = None
 
+        # Dirty rect rendering, only changed regions are drawn again
+        self.dirty_rects = False
+        self.dirty = []
+        self.redraw = True
+        self.last_view = None
+        self.last_size = None
+        self.background_changed = False
+
+    def set_dirty_rects(self, enabled):
+        """ Sets whether blit only draws the regions that changed """
+        self.dirty_rects = bool(enabled)
+        self.invalidate()
+
+    def invalidate(self, rect=None):
+        """ Draw a screen rect again in the next blit, None to draw everything """
+
+        if rect is None:
+            self.redraw = True
+            if self.background:
+                self.background.invalidate()
+        else:
+            self.dirty.append(pygame.Rect(rect))
+
     def resize(self, w, h):
         """ Resizes the display """
 
@@ -47,6 +95,7 @@ class SpriteDisplay():
         x = self.view.x if self.view else 0
         y = self.view.y if self.view else 0
         self.view = pygame.Rect(x, y, w, h)
+        self.invalidate()
 
     def move_view(self, x, y):
         """ Moves the view rect """
@@ -56,9 +105,16 @@ class SpriteDisplay():
         """ Updates the view limit rect """
         self.view_limit = pygame.Rect(x, y, width, height)
 
-    def set_fixed_background(self, width, height):
-        """ Sets the background to fixed size """
-        self.background = pygame.Surface((width, height))
+    def set_fixed_background(self, width, height, scaling='smooth'):
+        """ Sets the background to fixed size, scaled to the target with a scaling mode """
+        self.background = BackgroundCompositor(width, height, scaling)
+        self.invalidate()
+
+    def set_background_scaling(self, scaling):
+        """ Sets the scaling mode of the fixed background, smooth, nearest or integer """
+        if self.background:
+            self.background.set_scaling(scaling)
+            self.invalidate()
 
     def update(self):
         """
@@ -73,46 +129,173 @@ class SpriteDisplay():
         if self.view and self.view_limit:
             self.view = self.view.clamp(self.view_limit)
 
-        # Background
+        # Record changes for dirty rect rendering
+        tracked = [self.overlayed_sprites] + self.layered_sprites
+        for sprites in tracked:
+            if sprites:
+                sprites.track_changes(self.dirty_rects)
+
+        # Background, the fixed background is only drawn again if it changed
         if self.background_sprites:
+            start = profiler.start()
+            self.background_sprites.track_changes(self.dirty_rects or bool(self.background))
             self.background_sprites.update()
+            if self.background_sprites.changed:
+                self.background_changed = True
+                if not self.dirty_rects:
+                    self.background_sprites.changed.clear()
+            profiler.stop('update.background', start)
 
         # Tiles / Objs / Others
-        for sprites in self.layered_sprites:
+        for index, sprites in enumerate(self.layered_sprites):
+            start = profiler.start()
             sprites.update()
+            profiler.stop(f'update.layer{index}', start)
 
-        # UI
+        # Mini map overlay
         if self.overlayed_sprites:
+            start = profiler.start()
             self.overlayed_sprites.update()
+            profiler.stop('update.minimap', start)
+
+    def get_dirty_rects(self, surface):
+        """ Collect the screen rects changed since the last blit, clears the recorded changes """
+
+        screen = surface.get_rect()
+        rects = self.dirty
+        self.dirty = []
+
+        # Background, only sprites that moved or animated
+        if self.background_sprites and self.background_sprites.changed:
+            size = (self.background or surface).get_size()
+            for sprite, rect in self.background_sprites.changed:
+                for region in [self.background_sprites.get_region(sprite, rect, size, self.view),
+                               self.background_sprites.get_region(sprite, sprite.rect, size, self.view)]:
+
+                    # Scaled background
+                    if self.background:
+                        region = self.background.get_screen_rect(region)
+                    rects.append(region)
+            self.background_sprites.changed.clear()
+
+        # Tiles / Objs / Others, world to screen
+        for sprites in self.layered_sprites:
+            if sprites.changed:
+                rects.extend(rect.move(-self.view.x, -self.view.y) for rect in sprites.changed)
+                sprites.changed.clear()
+
+        # UI, already in screen space
+        if self.overlayed_sprites and self.overlayed_sprites.changed:
+            rects.extend(self.overlayed_sprites.changed)
+            self.overlayed_sprites.changed.clear()
+
+        # Visible parts only
+        rects = [rect.clip(screen) for rect in rects]
+        return merge_rects(rects)
 
     def blit(self, surface: pygame.Surface):
         """
         Draw background sprites onto a separate surface, then scale it to the target surface
         Draw layered sprites together, ordered by layer index
         Draw overlayed sprites last, always on top
+
+        Returns:
+            list of screen rects that were drawn, or None if everything was drawn
         """
 
+        # Draw everything
+        size = surface.get_size()
+        if not self.dirty_rects or self.redraw or self.view != self.last_view or size != self.last_size:
+            self.redraw = False
+            self.last_view = self.view.copy()
+            self.last_size = size
+            if self.dirty_rects:
+                self.get_dirty_rects(surface)
+                surface.fill((0, 0, 0))
+            self.blit_all(surface)
+            return None
+
+        # Draw changed regions, unless most of the screen changed
+        rects = self.get_dirty_rects(surface)
+        area = sum(rect.width * rect.height for rect in rects)
+        if len(rects) > MAX_DIRTY_RECTS or area > MAX_DIRTY_AREA * size[0] * size[1]:
+            surface.fill((0, 0, 0))
+            self.blit_all(surface)
+            return None
+
+        # Background changed, draw it again once
+        if self.background and self.background_changed:
+            self.render_background(surface)
+
+        if profiler.enabled:
+            profiler.count('dirty_rects', len(rects))
+
+        for rect in rects:
+            self.blit_region(surface, rect)
+
+        return rects
+
+    def render_background(self, surface):
+        """ Returns the fixed background scaled to the target size, drawn again only if it changed """
+
+        frame = self.background.render(self.background_sprites, self.view,
+                                       surface.get_size(), self.background_changed)
+        self.background_changed = False
+        return frame
+
+    def blit_all(self, surface):
+        """ Draw every sprite """
+
         # Background
         if self.background_sprites:
+            start = profiler.start()
             if not self.background:
                 self.background_sprites.blit(surface, self.view)
             else:
-                # Blit onto background surface
-                self.background.fill((0, 0, 0))
-                self.background_sprites.blit(self.background, self.view)
-
-                # Scale background surface and blit to target surface
-                background = pygame.transform.smoothscale(self.background, surface.get_size())
-                surface.blit(background, surface.get_rect())
+                # Blit onto background surface, scale background surface and blit to target surface
+                frame = self.render_background(surface)
+                surface.blit(frame, surface.get_rect())
+            profiler.stop('blit.background', start)
 
         # Tiles / Objs / Others
-        for sprites in self.layered_sprites:
+        for index, sprites in enumerate(self.layered_sprites):
+            start = profiler.start()
             sprites.blit(surface, self.view)
+            profiler.stop(f'blit.layer{index}', start)
+
+        # Mini map overlay
+        if self.overlayed_sprites:
+            start = profiler.start()
+            self.overlayed_sprites.blit(surface)
+            profiler.stop('blit.minimap', start)
+
+    def blit_region(self, surface, rect):
+        """ Draw every sprite inside a screen rect """
+
+        start = profiler.start()
+        surface.set_clip(rect)
+        surface.fill((0, 0, 0), rect)
+
+        # Background
+        if self.background_sprites:
+            if not self.background:
+                self.background_sprites.blit(surface, self.view)
+            elif self.background.frame:
+                surface.blit(self.background.frame, rect, area=rect)
+
+        # Tiles / Objs / Others, only sprites inside the rect
+        region = surface.subsurface(rect)
+        view = pygame.Rect(self.view.x + rect.x, self.view.y + rect.y, rect.width, rect.height)
+        for sprites in self.layered_sprites:
+            sprites.blit(region, view)
 
         # UI
         if self.overlayed_sprites:
             self.overlayed_sprites.blit(surface)
 
+        surface.set_clip(None)
+        profiler.stop('blit.regions', start)
+
 
 class ImageDisplay():
     """ Class that handles display for looping a set of images. """
@@ -127,6 +310,10 @@ class ImageDisplay():
         self.timer = 0
         self.delay = 10
 
+    def invalidate(self, rect=None):
+        """ The whole image is drawn every blit """
+        pass
+
     def resize(self, w, h):
         """ Resizes the display """
 
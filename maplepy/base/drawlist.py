@@ -0,0 +1,64 @@
+class DrawList():
+    """
+    Class that holds sprites in draw order, a flat replacement for a layered sprite group.
+
+    Sprites are added in bulk and sorted once by layer when the order is next needed.
+    Sprites in the same layer keep the order they were added in.
+    """
+
+    def __init__(self, *sprites):
+
+        self.items = []
+        self.ordered = True
+
+        # Changes whenever sprites are added or removed
+        self.version = 0
+
+        self.add(*sprites)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        self.sort()
+        return iter(self.items)
+
+    def __contains__(self, sprite):
+        return sprite in self.items
+
+    def add(self, *sprites):
+        """ Add sprites, they are sorted by layer when the order is needed """
+
+        if not sprites:
+            return
+
+        self.items.extend(sprites)
+        self.ordered = False
+        self.version += 1
+
+    def remove(self, *sprites):
+        """ Remove sprites """
+
+        removed = {id(sprite) for sprite in sprites}
+        self.items = [sprite for sprite in self.items if id(sprite) not in removed]
+        self.version += 1
+
+    def empty(self):
+        """ Remove all sprites """
+
+        self.items = []
+        self.ordered = True
+        self.version += 1
+
+    def sort(self):
+        """ Sort by layer, stable so insertion order is kept within a layer """
+
+        if not self.ordered:
+            self.items.sort(key=lambda sprite: sprite._layer)
+            self.ordered = True
+
+    def sprites(self):
+        """ Returns a list of all sprites in draw order """
+
+        self.sort()
+        return list(self.items)
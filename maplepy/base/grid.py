@@ -0,0 +1,98 @@
+class SpatialGrid():
+    """
+    Class that indexes rects in a uniform grid of square cells.
+
+    Each item is stored in every cell its rect overlaps,
+    so a query only visits the cells that overlap the query rect.
+    Items are identified by a key, eg. their draw order.
+    """
+
+    def __init__(self, cell_size=256):
+
+        self.cell_size = cell_size
+
+        # (column, row): set of keys
+        self.cells = {}
+
+        # key: (left, top, right, bottom) cell range
+        self.items = {}
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def get_range(self, rect):
+        """ Returns the (left, top, right, bottom) cells overlapped by a rect, inclusive """
+
+        size = self.cell_size
+        return (rect.left // size,
+                rect.top // size,
+                (rect.right - 1) // size,
+                (rect.bottom - 1) // size)
+
+    def insert(self, key, rect):
+        """ Adds an item """
+
+        cell_range = self.get_range(rect)
+        self.items[key] = cell_range
+
+        left, top, right, bottom = cell_range
+        for column in range(left, right + 1):
+            for row in range(top, bottom + 1):
+                self.cells.setdefault((column, row), set()).add(key)
+
+    def remove(self, key):
+        """ Removes an item if it exists """
+
+        cell_range = self.items.pop(key, None)
+        if not cell_range:
+            return
+
+        left, top, right, bottom = cell_range
+        for column in range(left, right + 1):
+            for row in range(top, bottom + 1):
+                cell = self.cells.get((column, row))
+                if cell is None:
+                    continue
+                cell.discard(key)
+                if not cell:
+                    del self.cells[(column, row)]
+
+    def move(self, key, rect):
+        """ Updates the rect of an item, only touches cells when its cell range changed """
+
+        if self.items.get(key) == self.get_range(rect):
+            return
+
+        self.remove(key)
+        self.insert(key, rect)
+
+    def clear(self):
+        """ Removes all items """
+
+        self.cells.clear()
+        self.items.clear()
+
+    def query(self, rect):
+        """ Returns the keys of items in cells overlapping the rect, may include items outside it """
+
+        found = set()
+        left, top, right, bottom = self.get_range(rect)
+
+        # Few cells, visit each one
+        if (right - left + 1) * (bottom - top + 1) <= len(self.cells):
+            for column in range(left, right + 1):
+                for row in range(top, bottom + 1):
+                    cell = self.cells.get((column, row))
+                    if cell:
+                        found.update(cell)
+
+        # Rect is larger than the map, visit occupied cells only
+        else:
+            for (column, row), cell in self.cells.items():
+                if left <= column <= right and top <= row <= bottom:
+                    found.update(cell)
+
+        return found
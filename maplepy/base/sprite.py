@@ -2,15 +2,53 @@ import logging
 import math
 
 import pygame
+from maplepy.base.clock import AnimationClock
+from maplepy.base.drawlist import DrawList
+from maplepy.base.grid import SpatialGrid
+from maplepy.helper.profiler import profiler
+
+
+def blit_sequence(surface, sequence, special_flags=0):
+    """ Draw a sequence of (image, position) in one call """
+
+    if profiler.enabled:
+        profiler.count('blits', len(sequence))
+
+    if hasattr(surface, 'fblits'):
+        surface.fblits(sequence, special_flags)
+    elif special_flags:
+        surface.blits([(image, position, None, special_flags) for image, position in sequence],
+                      doreturn=False)
+    else:
+        surface.blits(sequence, doreturn=False)
 
 
 class BackgroundSprites():
     """ Class that draws from a list of background sprites """
 
     def __init__(self):
-        """ Contains a layered sprite group. This has to be loaded with some data """
+        """ Contains a draw list of sprites. This has to be loaded with some data """
+
+        self.sprites = DrawList()
+
+        # (sprite, rect before update) of sprites that changed, None when not tracked
+        self.changed = None
 
-        self.sprites = pygame.sprite.LayeredUpdates()
+        # Repeated images copied once across a surface, sprite: (surface size, strip)
+        self.strips = {}
+
+        # Frames and scrolling of all sprites
+        self.clock = None
+        self.order = None
+        self.version = None
+
+    def track_changes(self, enabled):
+        """ Record the sprites that change in each update, changes are kept until they are cleared """
+
+        if not enabled:
+            self.changed = None
+        elif self.changed is None:
+            self.changed = []
 
     def calculate_cam_offset(self, rx, dx, z):
         """ Calculate the camera x or y offset """
@@ -23,14 +61,94 @@ class BackgroundSprites():
         return math.ceil((-w - x) / cx) * cx
 
     def update(self):
-        """ Update all sprites """
+        """ Advance frames and scrolling of all sprites in one step """
 
-        for sprite in self.sprites:
-            try:
-                sprite.update()
-            except:
-                logging.exception('Failed to update background')
-                continue
+        try:
+
+            # Rebuild clock if sprites were added or removed
+            if self.clock is None or self.version != self.sprites.version:
+                if self.clock:
+                    self.clock.sync()
+                self.order = self.sprites.sprites()
+                self.version = self.sprites.version
+                self.clock = AnimationClock(self.order)
+
+            # Record changed sprites
+            for position, rect in self.clock.tick():
+                if self.changed is not None:
+                    self.changed.append((self.order[position], rect))
+
+        except:
+            logging.exception('Failed to update background')
+
+    def get_strip(self, sprite, w, h):
+        """
+        Returns the image of a repeated background copied across at least w x h,
+        or None if the copies have to be drawn one at a time
+
+        Only single frame images that do not overlap their copies are expanded,
+        the strip is then an exact copy of drawing each image.
+        """
+
+        # Check if already expanded for this size
+        entry = self.strips.get(sprite)
+        if entry and entry[0] == (w, h):
+            return entry[1]
+
+        strip = None
+        iw, ih = sprite.image.get_size()
+        horizontal = sprite.type in [1, 3, 4, 6, 7]
+        vertical = sprite.type in [2, 3, 5, 6, 7]
+        if (len(sprite.canvas_list) == 1
+                and (not horizontal or sprite.cx >= iw)
+                and (not vertical or sprite.cy >= ih)):
+
+            # Enough copies to cover the surface from any starting offset
+            columns = math.ceil(w / sprite.cx) + 1 if horizontal else 1
+            rows = math.ceil(h / sprite.cy) + 1 if vertical else 1
+            width = (columns - 1) * sprite.cx + iw if horizontal else iw
+            height = (rows - 1) * sprite.cy + ih if vertical else ih
+
+            # Copy every pixel including alpha
+            strip = pygame.Surface((width, height), pygame.SRCALPHA).convert_alpha()
+            strip.fill((0, 0, 0, 0))
+            for column in range(columns):
+                for row in range(rows):
+                    x = column * sprite.cx if horizontal else 0
+                    y = row * sprite.cy if vertical else 0
+                    strip.blit(sprite.image, (x, y), special_flags=pygame.BLEND_RGBA_MAX)
+
+        self.strips[sprite] = ((w, h), strip)
+        return strip
+
+    def get_strip_blit(self, sprite, strip, rect):
+        """ Returns (strip, rect) to draw, with the alpha of the sprite image """
+
+        strip.set_alpha(sprite.image.get_alpha())
+        return strip, rect
+
+    def get_region(self, sprite, rect, size, offset=None):
+        """ Returns the region of a surface covered by a background sprite drawn at rect """
+
+        # Get surface properties
+        w, h = size
+        cx = offset.centerx - w // 2 if offset else 0
+        cy = offset.centery - h // 2 if offset else 0
+
+        # Same position as blit
+        rect = rect.move(sprite.dx, sprite.dy)
+        x = self.calculate_cam_offset(sprite.rx, cx, 0.5 * w)
+        y = self.calculate_cam_offset(sprite.ry, cy, 0.5 * h)
+        rect = rect.move(x, y)
+
+        # Copies cover a band or the whole surface
+        if sprite.type == 0:
+            return rect
+        if sprite.type in [1, 4]:
+            return pygame.Rect(0, rect.y, w, rect.height)
+        if sprite.type in [2, 5]:
+            return pygame.Rect(rect.x, 0, rect.width, h)
+        return pygame.Rect(0, 0, w, h)
 
     def blit(self, surface, offset=None):
         """ Draw all sprites """
@@ -40,6 +158,9 @@ class BackgroundSprites():
         cx = offset.centerx - surface.get_rect().centerx if offset else 0
         cy = offset.centery - surface.get_rect().centery if offset else 0
 
+        # Images and positions, drawn together at the end
+        sequence = []
+
         # For all sprites
         for sprite in self.sprites:
             try:
@@ -54,7 +175,7 @@ class BackgroundSprites():
 
                 # 0 - Simple image (eg. the hill with the tree in the background of Henesys)
                 if sprite.type == 0:
-                    surface.blit(sprite.image, rect)
+                    sequence.append((sprite.image, rect))
 
                 # 1 - Image is copied horizontally (eg. the sea in Lith Harbor)
                 # 4 - Image scrolls and is copied horizontally (eg. clouds)
@@ -63,8 +184,12 @@ class BackgroundSprites():
                     dx = self.calculate_tile_offset(
                         sprite.rect.width, rect.x, sprite.cx)
                     htile = rect.move(dx, 0)
+                    strip = self.get_strip(sprite, w, h)
+                    if strip:
+                        sequence.append(self.get_strip_blit(sprite, strip, htile))
+                        continue
                     while htile.x < w:
-                        surface.blit(sprite.image, htile)
+                        sequence.append((sprite.image, htile))
                         htile = htile.move(sprite.cx, 0)
 
                 # 2 - Image is copied vertically (eg. trees in maps near Ellinia)
@@ -74,8 +199,12 @@ class BackgroundSprites():
                     dy = self.calculate_tile_offset(
                         sprite.rect.height, rect.y, sprite.cy)
                     vtile = rect.move(0, dy)
+                    strip = self.get_strip(sprite, w, h)
+                    if strip:
+                        sequence.append(self.get_strip_blit(sprite, strip, vtile))
+                        continue
                     while vtile.y < h:
-                        surface.blit(sprite.image, vtile)
+                        sequence.append((sprite.image, vtile))
                         vtile = vtile.move(0, sprite.cy)
 
                 # 3 - Image is copied in both directions (eg. the background sky color square in many maps)
@@ -88,10 +217,14 @@ class BackgroundSprites():
                     dy = self.calculate_tile_offset(
                         sprite.rect.height, rect.y, sprite.cy)
                     vtile = rect.move(dx, dy)
+                    strip = self.get_strip(sprite, w, h)
+                    if strip:
+                        sequence.append(self.get_strip_blit(sprite, strip, vtile))
+                        continue
                     while vtile.y < h:
                         htile = vtile.copy()
                         while htile.x < w:
-                            surface.blit(sprite.image, htile)
+                            sequence.append((sprite.image, htile))
                             htile = htile.move(sprite.cx, 0)
                         vtile = vtile.move(0, sprite.cy)
 
@@ -99,50 +232,133 @@ class BackgroundSprites():
                 logging.exception('Failed to blit background')
                 continue
 
+        # Draw
+        try:
+            blit_sequence(surface, sequence)
+        except:
+            logging.exception('Failed to blit background')
+
 
 class LayeredSprites():
     """ Class that draws from a list of layered sprites """
 
     def __init__(self):
-        """ Contains a layered sprite group. This has to be loaded with some data """
+        """ Contains a draw list of sprites. This has to be loaded with some data """
+
+        self.sprites = DrawList()
+
+        # Spatial index of sprite rects, keyed by draw order
+        self.grid = SpatialGrid()
+        self.order = None
+        self.version = None
+
+        # Frames of all sprites
+        self.clock = None
+
+        # Static sprites baked into chunks, optional
+        self.baked = None
+
+        # Rects of sprites that changed, None when not tracked
+        self.changed = None
+
+    def track_changes(self, enabled):
+        """ Record the rects of sprites that change in each update, changes are kept until they are cleared """
+
+        if not enabled:
+            self.changed = None
+        elif self.changed is None:
+            self.changed = []
+
+    def set_baked(self, baked):
+        """ Draw through a baked layer, None to draw every sprite """
+        self.baked = baked
+
+    def invalidate_index(self):
+        """ Rebuild the spatial index before the next update or blit """
+        self.order = None
+
+    def build_index(self):
+        """ Index every sprite rect by its position in the draw order """
+
+        # Keep animation state of the previous order
+        if self.clock:
+            self.clock.sync()
+
+        self.order = self.sprites.sprites()
+        self.clock = AnimationClock(self.order)
+        self.version = self.sprites.version
+        self.grid.clear()
+        for index, sprite in enumerate(self.order):
+            if sprite.rect:
+                self.grid.insert(index, sprite.rect)
+
+    def check_index(self):
+        """ Rebuild the spatial index if sprites were added, removed or reordered """
 
-        self.sprites = pygame.sprite.LayeredUpdates()
+        if self.order is None or self.version != self.sprites.version:
+            self.build_index()
 
     def update(self):
-        """ Update all sprites """
+        """ Advance frames of all sprites in one step """
 
-        for sprite in self.sprites:
-            try:
-                sprite.update()
-            except:
-                logging.exception('Failed to update layer')
-                continue
+        self.check_index()
+
+        try:
+            for position, rect in self.clock.tick():
+                sprite = self.order[position]
+
+                # Frame bounds changed
+                if sprite.rect != rect:
+                    self.grid.move(position, sprite.rect)
+
+                # Old and new bounds need to be drawn again
+                if self.changed is not None:
+                    self.changed.append(rect)
+                    if sprite.rect != rect:
+                        self.changed.append(sprite.rect)
+
+        except:
+            logging.exception('Failed to update layer')
 
     def blit(self, surface, offset=None):
         """ Draw all sprites """
 
-        # For all sprites
-        for sprite in self.sprites:
+        # Baked chunks and animated sprites
+        if self.baked and offset:
             try:
+                self.baked.blit(surface, offset)
+            except:
+                logging.exception('Failed to blit baked layer')
+            return
 
-                # Get rect
-                rect = sprite.rect
-
-                # Camera offset
-                if offset:
-
-                    # If the sprite is outside the surface
-                    if not sprite.rect.colliderect(offset):
-                        continue
+        self.check_index()
 
-                    rect = sprite.rect.move(-offset.x, -offset.y)
+        # Only sprites in cells overlapping the view, in draw order
+        if offset:
+            sprites = [self.order[index] for index in sorted(self.grid.query(offset))]
+        else:
+            sprites = self.order
 
-                # Draw
-                surface.blit(sprite.image, rect)
+        # Cull and apply camera offset together
+        try:
+            if offset:
+                x, y = -offset.x, -offset.y
+                colliderect = offset.colliderect
+                sequence = [(sprite.image, sprite.rect.move(x, y))
+                            for sprite in sprites if colliderect(sprite.rect)]
+            else:
+                sequence = [(sprite.image, sprite.rect) for sprite in sprites]
+
+            # Instances drawn and skipped outside the view
+            if profiler.enabled:
+                profiler.count('drawn', len(sequence))
+                profiler.count('culled', len(self.order) - len(sequence))
+
+            # Draw
+            blit_sequence(surface, sequence)
 
-            except:
-                logging.exception('Failed to blit layer')
-                continue
+        except:
+            logging.exception('Failed to blit layer')
 
 
 class ConsoleSprite(pygame.sprite.Sprite):
@@ -214,22 +430,71 @@ class ConsoleSprite(pygame.sprite.Sprite):
         self.draw_wrapped(surface, text, (255, 255, 255), self.rect, self.font)
 
 
+class ProfilerSprite(pygame.sprite.Sprite):
+    """ Class that handles display for lines of profiler results. """
+
+    def __init__(self, w, h):
+
+        # pygame.sprite.Sprite
+        super().__init__()
+        self.image = pygame.surface.Surface((w, h))
+        self.image.fill((20, 20, 20))
+        self.image.set_alpha(160)  # transparent
+        self.rect = self.image.get_rect()
+
+        # pygame.font.Font
+        self.font = pygame.font.Font(None, 18)
+
+        # Rendered lines
+        self.lines = []
+
+    def update(self, lines):
+        """ Render new lines of text """
+        self.lines = [self.font.render(line, True, (255, 255, 255)) for line in lines]
+
+    def blit(self, surface):
+
+        # Blit the background
+        surface.blit(self.image, self.rect)
+
+        # Blit lines until the bottom is reached
+        x, y = self.rect.x + 4, self.rect.y + 4
+        for image in self.lines:
+            if y + image.get_height() > self.rect.bottom:
+                break
+            surface.blit(image, (x, y))
+            y += image.get_height()
+
+
 class DataSprite(pygame.sprite.Sprite):
     """ Helper class to load byte array images as pygame sprites """
 
+    # Collision masks are created on first use, disable to never create them
+    use_masks = True
+
     def __init__(self):
 
         # pygame.sprite.Sprite
         super().__init__()
         self.image = None
         self.rect = None
-        self.mask = None
+        self._mask = None
 
         # byte data
         self.width = 0
         self.height = 0
         self.data = []
 
+    @property
+    def mask(self):
+        """ Collision mask of the image, created once when first requested """
+
+        if not DataSprite.use_masks or not self.image:
+            return None
+        if self._mask is None:
+            self._mask = pygame.mask.from_surface(self.image)
+        return self._mask
+
     def load(self, w, h, data):
         """
         Load image from byte array
@@ -283,7 +548,7 @@ class DataSprite(pygame.sprite.Sprite):
             # Update current sprite
             self.image = image.convert_alpha()
             self.rect = image.get_rect()
-            self.mask = pygame.mask.from_surface(image)
+            self._mask = None
             self.width = w
             self.height = h
             self.data = data
@@ -1,17 +1,28 @@
 import logging
+import os
 import threading
+import time
 
 import pygame
-from maplepy.base.constants import CAMERA_SPEED, GAME_STATE, PYGAME_FLAGS
+from maplepy.base.constants import (CAMERA_SPEED, GAME_STATE, MAX_CATCHUP_TICKS,
+                                    PROFILER_REFRESH, PYGAME_FLAGS, TICK_RATE)
 from maplepy.base.display import ImageDisplay
-from maplepy.base.sprite import ConsoleSprite
+from maplepy.base.sprite import ConsoleSprite, ProfilerSprite
 from maplepy.helper.config import Config
+from maplepy.helper.profiler import profiler
 from maplepy.nx.displaynx import DisplayNx
+from maplepy.nx.spritenx import resource_manager
 
 
 class Game():
 
-    def __init__(self, config_file):
+    def __init__(self, config_file, headless=False):
+
+        # Without a window, draw to an offscreen surface and run as fast as possible
+        self.headless = headless
+        if headless:
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+            os.environ['SDL_AUDIODRIVER'] = 'dummy'
 
         # Config
         self.config = Config.instance()
@@ -23,20 +34,49 @@ class Game():
         self.asset_type = self.config['asset_type']
         self.map = self.config['map']
         self.loading_display = self.config['loading_display_loop']
+        self.sprite_cache_budget = self.config['sprite_cache_budget']
+        self.data_cache_budget = self.config['data_cache_budget']
+        self.sprite_cache_path = self.config['sprite_cache_path']
+        self.sprite_cache_max_size = self.config['sprite_cache_max_size']
+        self.compiled_map_path = self.config['compiled_map_path']
+        self.catalog_path = self.config['catalog_path']
+        self.loader_workers = self.config['loader_workers']
+        self.atlas_tiles = self.config['atlas_tiles']
+        self.atlas_objects = self.config['atlas_objects']
+        self.collision_masks = self.config['collision_masks']
+        self.bake_layers = self.config['bake_layers']
+        self.chunk_size = self.config['chunk_size']
+        self.chunk_cache_budget = self.config['chunk_cache_budget']
+        self.dirty_rects = self.config['dirty_rects']
+        self.background_scaling = self.config['background_scaling']
+        self.prefetch_maps = self.config['prefetch_maps']
+        self.prefetch_cpu_budget = self.config['prefetch_cpu_budget']
+        self.prefetch_memory_budget = self.config['prefetch_memory_budget']
+        self.log_load_traces = self.config['log_load_traces']
 
         # Start pygame
         pygame.init()
-        pygame.mixer.init(frequency=44100,
-                          size=-16,
-                          channels=2,
-                          allowedchanges=0)
-        pygame.display.set_caption(self.config['caption'])
-        icon = pygame.image.load(self.config['icon'])
-        pygame.display.set_icon(icon)
+        try:
+            pygame.mixer.init(frequency=44100,
+                              size=-16,
+                              channels=2,
+                              allowedchanges=0)
+        except pygame.error:
+            if not headless:
+                raise
+            logging.warning('No audio device, sounds are disabled')
 
         # Create pygame objects
         size = self.width, self.height
-        self.screen = pygame.display.set_mode(size, PYGAME_FLAGS)
+        if headless:
+            # Images are converted to the display format, so a display is still required
+            pygame.display.set_mode((1, 1))
+            self.screen = pygame.Surface(size, pygame.SRCALPHA)
+        else:
+            pygame.display.set_caption(self.config['caption'])
+            icon = pygame.image.load(self.config['icon'])
+            pygame.display.set_icon(icon)
+            self.screen = pygame.display.set_mode(size, PYGAME_FLAGS)
         self.clock = pygame.time.Clock()
 
         # Set sprite display
@@ -50,18 +90,47 @@ class Game():
         }
 
         # Additional config
-        self.displays[GAME_STATE.DEFAULT].set_fixed_background(1280, 720)
+        self.displays[GAME_STATE.DEFAULT].set_fixed_background(
+            1280, 720, self.background_scaling or 'smooth')
+        self.displays[GAME_STATE.DEFAULT].set_cache_budget(
+            self.sprite_cache_budget, self.data_cache_budget)
+        self.displays[GAME_STATE.DEFAULT].set_disk_cache(
+            self.sprite_cache_path, self.sprite_cache_max_size)
+        self.displays[GAME_STATE.DEFAULT].set_compiled_map_path(self.compiled_map_path)
+        self.displays[GAME_STATE.DEFAULT].set_catalog_path(self.catalog_path)
+        self.displays[GAME_STATE.DEFAULT].set_loader_workers(self.loader_workers)
+        self.displays[GAME_STATE.DEFAULT].set_atlas(self.atlas_tiles, self.atlas_objects)
+        self.displays[GAME_STATE.DEFAULT].set_collision_masks(self.collision_masks)
+        self.displays[GAME_STATE.DEFAULT].set_baking(
+            self.bake_layers, self.chunk_size, self.chunk_cache_budget)
+        self.displays[GAME_STATE.DEFAULT].set_dirty_rects(self.dirty_rects)
+        self.displays[GAME_STATE.DEFAULT].set_prefetch(
+            self.prefetch_maps, self.prefetch_cpu_budget, self.prefetch_memory_budget)
+        self.displays[GAME_STATE.DEFAULT].set_trace_logging(self.log_load_traces)
 
         # Game state
         self.threads = []
         self.running = False
         self.state = GAME_STATE.DEFAULT
+        self.last_state = None
         self.pressed = {}
 
         # Console
         self.typing = False
         self.text = ''
         self.console = ConsoleSprite(200, 100)
+        self.console_visible = False
+
+        # Profiler overlay, top right
+        self.overlay = ProfilerSprite(260, 480)
+        self.overlay.rect.topright = (self.width, 0)
+        self.overlay_visible = False
+
+        # Profiler cache hit rates
+        profiler.add_cache('sprites', resource_manager.sprites)
+        profiler.add_cache('data', resource_manager.data)
+        profiler.add_cache('animations', resource_manager.animations)
+        profiler.add_cache('chunks', self.displays[GAME_STATE.DEFAULT].chunks)
 
     def get_state(self):
 
@@ -97,6 +166,13 @@ class Game():
                 thread = threading.Thread(target=fn)
                 thread.start()
                 self.threads.append(thread)
+            if cmd == 'cache':
+                logging.info(f'Cache: {resource_manager.stats()}')
+            if cmd == 'profile':
+                if len(command) > 1 and command[1].lower() == 'save':
+                    profiler.save(command[2] if len(command) > 2 else 'trace.json')
+                else:
+                    logging.info(f'Profiler: {"on" if profiler.toggle() else "off"}')
         except:
             logging.exception('Command failed')
 
@@ -127,6 +203,7 @@ class Game():
                 self.width, self.height = event.w, event.h
                 for _, display in self.displays.items():
                     display.resize(event.w, event.h)
+                self.overlay.rect.topright = (self.width, 0)
 
             # Console input
             if state != GAME_STATE.LOADING and event.type == pygame.KEYDOWN:
@@ -177,7 +254,110 @@ class Game():
         if state == GAME_STATE.DEFAULT and key_input[pygame.K_RIGHT]:
             self.displays[state].move_view(CAMERA_SPEED, 0)
 
-    def run(self):
+    def tick(self, state):
+        """ Advance the simulation by one fixed timestep """
+
+        start = profiler.start()
+
+        # Handle inputs
+        self.handle_inputs()
+
+        # Update environment
+        self.displays[state].update()
+
+        profiler.stop('tick', start)
+
+    def render(self, state):
+        """ Draw the current state and present it """
+
+        render_start = profiler.start()
+
+        # Draw everything after switching displays
+        display = self.displays[state]
+        if state != self.last_state:
+            display.invalidate()
+            self.last_state = state
+
+        # Clear screen, dirty rect rendering clears what it draws
+        if not self.dirty_rects:
+            self.screen.fill((0, 0, 0))
+
+        # Console is drawn over the display, draw below it again while shown or when hidden
+        if self.typing or self.console_visible:
+            display.invalidate(self.console.rect)
+        self.console_visible = self.typing
+
+        # Same for the profiler overlay
+        if profiler.enabled or self.overlay_visible:
+            display.invalidate(self.overlay.rect)
+        self.overlay_visible = profiler.enabled
+
+        # Render environment
+        rects = display.blit(self.screen)
+
+        # Console
+        if self.typing:
+            start = profiler.start()
+            self.console.update()
+            self.console.blit(self.screen, self.text)
+            profiler.stop('blit.console', start)
+
+        # Profiler overlay, refreshed every few frames
+        if profiler.enabled:
+            start = profiler.start()
+            if profiler.frames % PROFILER_REFRESH == 0:
+                self.overlay.update(profiler.get_lines())
+            self.overlay.blit(self.screen)
+            profiler.stop('blit.overlay', start)
+
+        profiler.stop('render', render_start)
+
+        # Offscreen, nothing to present
+        if self.headless:
+            return
+
+        # Update, only changed regions if known
+        start = profiler.start()
+        if rects is None:
+            pygame.display.update()
+        else:
+            pygame.display.update(rects)
+        profiler.stop('present', start)
+
+    def run_headless(self, frames=None):
+        """ Tick and render once per frame without waiting, until frames of the map are rendered """
+
+        count = 0
+        self.running = True
+        while self.running:
+
+            profiler.begin_frame()
+
+            # Get current state
+            state = self.get_state()
+
+            # Handle threads
+            self.handle_threads()
+
+            # Handle pygame events
+            start = profiler.start()
+            self.handle_events()
+            profiler.stop('events', start)
+
+            # One timestep per frame
+            self.tick(state)
+            self.render(state)
+            profiler.end_frame()
+
+            # Only frames of the map are counted
+            if state == GAME_STATE.DEFAULT:
+                count += 1
+                if frames and count >= frames:
+                    self.running = False
+
+        return count
+
+    def run(self, frames=None):
 
         # Setup loading display
         self.handle_command(f'loading {" ".join(self.loading_display)}')
@@ -185,10 +365,31 @@ class Game():
         # Setup initial map
         self.handle_command(f'map {self.map}')
 
+        # As fast as possible, not limited by fps
+        if self.headless:
+            return self.run_headless(frames)
+
+        # Fixed timestep, independent of fps
+        count = 0
+        step = 1.0 / TICK_RATE
+        lag = 0.0
+        last = time.perf_counter()
+
         # Main loop
         self.running = True
         while self.running:
 
+            # Measure time since the last frame
+            now = time.perf_counter()
+            lag += now - last
+            last = now
+
+            # Too far behind, drop the time that can not be caught up
+            lag = min(lag, MAX_CATCHUP_TICKS * step)
+
+            # Recorded until the next rendered frame
+            profiler.begin_frame()
+
             # Get current state
             state = self.get_state()
 
@@ -196,23 +397,26 @@ class Game():
             self.handle_threads()
 
             # Handle pygame events
+            start = profiler.start()
             self.handle_events()
+            profiler.stop('events', start)
 
-            # Handle inputs
-            self.handle_inputs()
-
-            # Clear screen
-            self.screen.fill((0, 0, 0))
+            # Simulate every timestep that has passed
+            while lag >= step:
+                self.tick(state)
+                lag -= step
 
-            # Render environment
-            self.displays[state].update()
-            self.displays[state].blit(self.screen)
+            # Render every frame, the frame cap does not line up with the tick rate,
+            # so some frames have no new timestep and show the last state again
+            self.render(state)
+            profiler.end_frame()
 
-            # Console
-            if self.typing:
-                self.console.update()
-                self.console.blit(self.screen, self.text)
+            # Only frames of the map are counted
+            if state == GAME_STATE.DEFAULT:
+                count += 1
+                if frames and count >= frames:
+                    self.running = False
 
-            # Update
-            pygame.display.update()
             self.clock.tick(self.fps)
+
+        return count
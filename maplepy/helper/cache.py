@@ -0,0 +1,151 @@
+import logging
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A least recently used cache bounded by a memory budget in bytes.
+
+    The size of each entry is measured by the sizeof function when it is stored.
+    Once the total size goes over budget, the least recently used entries are
+    evicted first. Pinned entries are never evicted, even if the cache stays
+    over budget because of them, which is logged once.
+
+    A budget of 0 (or None) means the cache is unbounded.
+    The optional on_evict function is called with (key, value) of every evicted entry.
+    """
+
+    def __init__(self, budget=0, sizeof=None, on_evict=None):
+
+        # Entries are stored as key: (value, size), oldest first
+        self.entries = OrderedDict()
+        self.pinned = set()
+
+        # Keys that can be evicted, oldest first, so eviction never scans pinned entries
+        self.unpinned = OrderedDict()
+        self.over_budget = False
+        self.budget = budget or 0
+        self.sizeof = sizeof if sizeof else lambda value: 0
+        self.on_evict = on_evict
+        self.size = 0
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, key):
+        return self.entries[key][0]
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def get(self, key, default=None):
+        """ Returns the value for key and marks it as recently used """
+
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        if key in self.unpinned:
+            self.unpinned.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value):
+        """ Stores the value, then evicts old entries if over budget """
+
+        # Replace existing entry
+        self.remove(key)
+
+        # Store as most recently used
+        size = self.sizeof(value)
+        self.entries[key] = (value, size)
+        self.size += size
+        if key not in self.pinned:
+            self.unpinned[key] = None
+
+        # Stay within budget
+        self.evict()
+
+    def remove(self, key):
+        """ Removes the entry if it exists """
+
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+            self.unpinned.pop(key, None)
+
+    def pin(self, key):
+        """ Prevents the key from being evicted """
+        self.pinned.add(key)
+        self.unpinned.pop(key, None)
+
+    def unpin(self, key):
+        """ Allows the key to be evicted again, as the most recently used entry """
+        self.pinned.discard(key)
+        if key in self.entries:
+            self.unpinned[key] = None
+
+    def unpin_all(self):
+        """ Allows every key to be evicted again """
+        self.pinned.clear()
+        self.unpinned = OrderedDict.fromkeys(self.entries)
+        self.evict()
+
+    def set_budget(self, budget):
+        """ Updates the budget in bytes, then evicts old entries if over budget """
+        self.budget = budget or 0
+        self.evict()
+
+    def evict(self):
+        """ Evicts least recently used entries until the cache fits its budget """
+
+        # Unbounded
+        if not self.budget or self.size <= self.budget:
+            self.over_budget = False
+            return
+
+        # Oldest unpinned entries first, stops once only pinned entries remain
+        while self.unpinned and self.size > self.budget:
+            key = next(iter(self.unpinned))
+            value = self.entries[key][0]
+            self.remove(key)
+            self.evictions += 1
+            if self.on_evict:
+                self.on_evict(key, value)
+
+        # Pinned entries alone do not fit
+        over_budget = self.size > self.budget
+        if over_budget and not self.over_budget:
+            logging.warning(f'Pinned entries exceed the cache budget: {self.size} > {self.budget}')
+        self.over_budget = over_budget
+
+    def clear(self):
+        """ Removes all entries and pins """
+        self.entries.clear()
+        self.pinned.clear()
+        self.unpinned.clear()
+        self.over_budget = False
+        self.size = 0
+
+    def stats(self):
+        """ Returns the cache counters as a dictionary """
+
+        return {
+            'count': len(self.entries),
+            'pinned': len(self.pinned),
+            'size': self.size,
+            'budget': self.budget,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
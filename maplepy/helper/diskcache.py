@@ -0,0 +1,190 @@
+import json
+import logging
+import mmap
+import os
+
+VERSION = 1
+
+
+class DiskCache:
+    """
+    A persistent cache of decoded pixel buffers stored in a directory.
+
+    Buffers are appended to a single pack file and read back through a memory map,
+    so a cached image is built straight from mapped pages.
+    An index file maps each key to its offset and size inside the pack file.
+
+    The cache belongs to one identity (eg. the sizes and modified times of the source files).
+    If the identity changes, every stored buffer is discarded.
+
+    The pack file only grows, once it would exceed the max size it is started over empty.
+    """
+
+    def __init__(self, path, identity, max_size=0):
+
+        # Files
+        self.path = path
+        self.pack_file = os.path.join(path, 'sprites.pack')
+        self.index_file = os.path.join(path, 'sprites.index')
+
+        # Source identity
+        self.identity = identity
+
+        # Most bytes in the pack file, 0 is unbounded
+        self.max_size = max_size
+
+        # key: [offset, width, height]
+        self.entries = {}
+        self.dirty = False
+
+        # Pack file handles
+        self.pack = None
+        self.mmap = None
+
+        self.open()
+
+    def open(self):
+        """ Loads the index, resets the pack file if it belongs to another identity """
+
+        os.makedirs(self.path, exist_ok=True)
+
+        # Load index
+        index = None
+        try:
+            with open(self.index_file) as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            pass
+
+        # Check if the pack file is still valid
+        valid = index \
+            and index.get('version') == VERSION \
+            and index.get('identity') == self.identity \
+            and os.path.isfile(self.pack_file)
+
+        if valid:
+            self.entries = index.get('entries', {})
+            self.pack = open(self.pack_file, 'r+b')
+            self.remap()
+        else:
+            self.reset()
+
+    def reset(self):
+        """
+        Discards every stored buffer and starts a new empty pack file
+
+        The new file replaces the old one instead of truncating it,
+        buffers still mapped from the old file stay readable.
+        The old index is removed first and the new empty index written right away,
+        so an index is never read against a pack file it does not describe.
+        """
+
+        logging.info(f'Reset sprite cache: {self.path}')
+
+        # Old index, it would point into the new pack file
+        try:
+            os.remove(self.index_file)
+        except FileNotFoundError:
+            pass
+
+        temp_file = f'{self.pack_file}.tmp'
+        pack = open(temp_file, 'w+b')
+        try:
+            os.replace(temp_file, self.pack_file)
+        except OSError:
+            pack.close()
+            raise
+
+        if self.pack:
+            self.pack.close()
+        self.pack = pack
+
+        self.entries = {}
+        self.dirty = True
+        self.remap()
+        self.flush()
+
+    def remap(self):
+        """
+        Maps the whole pack file into memory
+        Previous maps are released once no buffer references them anymore
+        """
+
+        self.mmap = None
+        if os.fstat(self.pack.fileno()).st_size > 0:
+            self.mmap = mmap.mmap(self.pack.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get(self, key):
+        """ Returns (width, height, buffer) for the key, or None if it is not stored """
+
+        entry = self.entries.get(key)
+        if not entry:
+            return None
+
+        # Pack file might have grown since it was mapped
+        offset, w, h = entry
+        end = offset + w * h * 4
+        if not self.mmap or end > len(self.mmap):
+            self.remap()
+        if not self.mmap or end > len(self.mmap):
+            return None
+
+        return w, h, memoryview(self.mmap)[offset:end]
+
+    def put(self, key, w, h, data):
+        """ Appends a 32-bit pixel buffer to the pack file """
+
+        # Only store complete buffers
+        if key in self.entries or len(data) != w * h * 4:
+            return
+
+        try:
+            self.pack.seek(0, os.SEEK_END)
+            offset = self.pack.tell()
+
+            # Start over once the pack file is full
+            if self.max_size and offset + len(data) > self.max_size:
+                if len(data) > self.max_size:
+                    return
+                self.reset()
+                offset = 0
+
+            self.pack.write(data)
+            self.pack.flush()
+        except OSError:
+            logging.exception(f'Failed to store {key}')
+            return
+
+        self.entries[key] = [offset, w, h]
+        self.dirty = True
+
+    def flush(self):
+        """ Writes the index to disk if it changed """
+
+        if not self.dirty:
+            return
+
+        index = {
+            'version': VERSION,
+            'identity': self.identity,
+            'entries': self.entries,
+        }
+
+        # Replace the index in one step, a partial index is never read
+        try:
+            temp_file = f'{self.index_file}.tmp'
+            with open(temp_file, 'w') as index_file:
+                json.dump(index, index_file)
+            os.replace(temp_file, self.index_file)
+            self.dirty = False
+        except OSError:
+            logging.exception(f'Failed to save {self.index_file}')
+
+    def close(self):
+        """ Flushes the index and closes the pack file """
+
+        self.flush()
+        self.mmap = None
+        if self.pack:
+            self.pack.close()
+            self.pack = None
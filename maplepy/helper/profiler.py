@@ -0,0 +1,187 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+# Frames averaged by the overlay
+HISTORY_FRAMES = 120
+
+# Trace events kept for export, the oldest are dropped first
+MAX_TRACE_EVENTS = 500000
+
+
+class Profiler():
+    """
+    Class that records how long each part of a frame takes.
+
+    Timings are named sections, eg. 'blit.layer3', summed over a frame.
+    Counters are summed over a frame, eg. blits, drawn and culled instances.
+    Registered caches report their hits and misses of each frame.
+
+    Every section is also kept as a Chrome trace event,
+    saved traces can be opened in chrome://tracing or Perfetto.
+
+    Disabled by default, then every method returns immediately.
+    Hot paths check `enabled` before counting anything.
+    """
+
+    def __init__(self):
+
+        self.enabled = False
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+
+        # Current frame, name: seconds and name: count
+        self.timings = {}
+        self.counters = {}
+
+        # Last frames, (timings, counters)
+        self.history = deque(maxlen=HISTORY_FRAMES)
+        self.frames = 0
+
+        # Chrome trace events
+        self.events = deque(maxlen=MAX_TRACE_EVENTS)
+
+        # name: cache, and its (hits, misses) when the frame started
+        self.caches = {}
+        self.cache_counts = {}
+
+    def enable(self):
+        self.enabled = True
+        self.history.clear()
+        self.begin_frame()
+
+    def disable(self):
+        self.enabled = False
+
+    def toggle(self):
+        """ Enables or disables recording, returns True if enabled """
+
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+        return self.enabled
+
+    def add_cache(self, name, cache):
+        """ Reports the hit rate of a cache with hits and misses counters """
+        self.caches[name] = cache
+
+    def start(self):
+        """ Returns the start time of a section, 0 if disabled """
+        return time.perf_counter() if self.enabled else 0.0
+
+    def stop(self, name, start, category='frame'):
+        """ Records a section started with start() """
+
+        if not self.enabled or not start:
+            return
+
+        end = time.perf_counter()
+        self.timings[name] = self.timings.get(name, 0.0) + end - start
+        self.events.append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': (start - self.origin) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': self.pid,
+            'tid': threading.get_ident(),
+        })
+
+    def count(self, name, value=1):
+        """ Adds to a counter of the current frame """
+
+        if not self.enabled:
+            return
+
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def begin_frame(self):
+        """ Starts a new frame, discards what was recorded since the last end_frame """
+
+        if not self.enabled:
+            return
+
+        self.timings = {}
+        self.counters = {}
+        self.cache_counts = {name: (cache.hits, cache.misses)
+                             for name, cache in self.caches.items()}
+
+    def end_frame(self):
+        """ Stores the current frame """
+
+        if not self.enabled:
+            return
+
+        # Cache lookups during the frame
+        for name, cache in self.caches.items():
+            hits, misses = self.cache_counts.get(name, (cache.hits, cache.misses))
+            self.counters[f'{name}.hits'] = cache.hits - hits
+            self.counters[f'{name}.misses'] = cache.misses - misses
+
+        self.history.append((self.timings, self.counters))
+        self.frames += 1
+
+        # Counters as one trace event
+        self.events.append({
+            'name': 'counters',
+            'ph': 'C',
+            'ts': (time.perf_counter() - self.origin) * 1e6,
+            'pid': self.pid,
+            'args': dict(self.counters),
+        })
+
+        self.begin_frame()
+
+    def get_summary(self):
+        """
+        Returns averages over the last frames
+
+        Returns:
+            dict with
+                timings: name: milliseconds per frame
+                counters: name: count per frame
+                hit_rates: cache name: hits / lookups, None without lookups
+        """
+
+        frames = len(self.history)
+        timings = {}
+        counters = {}
+        for frame_timings, frame_counters in self.history:
+            for name, seconds in frame_timings.items():
+                timings[name] = timings.get(name, 0.0) + seconds * 1000 / frames
+            for name, value in frame_counters.items():
+                counters[name] = counters.get(name, 0) + value / frames
+
+        hit_rates = {}
+        for name in self.caches:
+            hits = counters.get(f'{name}.hits', 0)
+            lookups = hits + counters.get(f'{name}.misses', 0)
+            hit_rates[name] = hits / lookups if lookups else None
+
+        return {'timings': timings, 'counters': counters, 'hit_rates': hit_rates}
+
+    def get_lines(self):
+        """ Returns the summary as lines of text """
+
+        summary = self.get_summary()
+        lines = [f'{name}: {ms:.2f} ms' for name, ms in sorted(summary['timings'].items())]
+        lines += [f'{name}: {value:.0f}' for name, value in sorted(summary['counters'].items())
+                  if not name.endswith(('.hits', '.misses'))]
+        lines += [f'{name} hits: {rate:.0%}' for name, rate in summary['hit_rates'].items()
+                  if rate is not None]
+        return lines
+
+    def save(self, path):
+        """ Writes the recorded trace events as Chrome trace-event JSON """
+
+        logging.info(f'Saving trace: {path}')
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}, file)
+
+
+# Module-level profiler shared by the game and displays
+profiler = Profiler()
@@ -0,0 +1,228 @@
+import threading
+import time
+
+# Slowest resources listed in a summary
+SUMMARY_KEYS = 5
+
+
+class Span():
+    """
+    Class that records one timed section of a trace.
+
+    Spans form a tree, each span has its child spans in the order they started.
+    Counters are added to the innermost open span, eg. cache hits or bytes decoded.
+    """
+
+    def __init__(self, name, args=None, stack=None):
+
+        self.name = name
+        self.args = args or {}
+        self.counters = {}
+        self.children = []
+        self.start = time.perf_counter()
+        self.end = None
+
+        # Open spans of the thread recording this span
+        self.stack = stack
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """ Stops the span and every child span still open """
+
+        if self.end is not None:
+            return
+
+        self.end = time.perf_counter()
+
+        # Close child spans left open
+        stack = self.stack
+        if stack and self in stack:
+            while stack:
+                span = stack.pop()
+                if span.end is None:
+                    span.end = self.end
+                if span is self:
+                    break
+
+    @property
+    def duration(self):
+        """ Seconds between start and end, or until now if still open """
+        return (self.end or time.perf_counter()) - self.start
+
+    def walk(self):
+        """ Yields this span and every span below it """
+
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+    def find(self, name):
+        """ Returns every span below this one with a name """
+        return [span for span in self.walk() if span.name == name]
+
+    def get_counters(self):
+        """ Returns the counters summed over this span and every span below it """
+
+        counters = {}
+        for span in self.walk():
+            for name, value in span.counters.items():
+                counters[name] = counters.get(name, 0) + value
+        return counters
+
+    def get_slowest(self, count=SUMMARY_KEYS):
+        """ Returns the slowest spans of a single resource, the ones with a key """
+
+        spans = [span for span in self.walk() if 'key' in span.args]
+        return sorted(spans, key=lambda span: span.duration, reverse=True)[:count]
+
+    def to_dict(self):
+        """ Returns the span tree as a dictionary, times are in milliseconds """
+
+        return {
+            'name': self.name,
+            'args': self.args,
+            'start': self.start * 1000,
+            'duration': self.duration * 1000,
+            'counters': self.counters,
+            'children': [child.to_dict() for child in self.children],
+        }
+
+    def format(self, depth=0):
+        """
+        Returns the span tree as lines of text
+
+        Child spans with the same name are merged into one line,
+        eg. resolve x120, so a line is not printed for every resource.
+        """
+
+        args = ' '.join(str(value) for key, value in self.args.items() if key != 'key')
+        lines = [f'{"  " * depth}{self.name} {args + " " if args else ""}{self.duration * 1000:.1f} ms']
+
+        # Group children by name, in order of appearance
+        groups = {}
+        for child in self.children:
+            groups.setdefault(child.name, []).append(child)
+
+        for name, spans in groups.items():
+            if len(spans) == 1 or not any('key' in span.args for span in spans):
+                for span in spans:
+                    lines.extend(span.format(depth + 1))
+            else:
+                total = sum(span.duration for span in spans) * 1000
+                lines.append(f'{"  " * (depth + 1)}{name} x{len(spans)} {total:.1f} ms')
+
+        return lines
+
+    def summary(self):
+        """ Returns the span tree, counters and slowest resources as text """
+
+        lines = self.format()
+        counters = self.get_counters()
+        if counters:
+            lines.append(', '.join(f'{name}: {value}' for name, value in sorted(counters.items())))
+        for span in self.get_slowest():
+            lines.append(f'{span.name} {span.args["key"]} {span.duration * 1000:.1f} ms')
+        return '\n'.join(lines)
+
+
+class NullSpan():
+    """ Span used while nothing is traced, does nothing """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer():
+    """
+    Class that records loads as trees of spans.
+
+    A trace is started and finished on one thread, spans and counters
+    from that thread are added to it, other threads are not traced.
+    While a thread has no trace, span returns a span that does nothing.
+    Work timed on other threads is added with record once its result is collected.
+    """
+
+    def __init__(self):
+
+        # Open spans of each thread
+        self.local = threading.local()
+
+        # Last finished trace
+        self.last = None
+
+    def get_stack(self):
+        return getattr(self.local, 'stack', None)
+
+    def start(self, name, **args):
+        """ Starts a trace on this thread, returns its root span """
+
+        root = Span(name, args)
+        root.stack = [root]
+        self.local.stack = root.stack
+        return root
+
+    def finish(self):
+        """ Stops the trace of this thread, returns its root span """
+
+        stack = self.get_stack()
+        if not stack:
+            return None
+
+        root = stack[0]
+        root.close()
+        self.local.stack = None
+        self.last = root
+        return root
+
+    def span(self, name, **args):
+        """ Returns a span to use in a with statement, added below the innermost open span """
+
+        stack = self.get_stack()
+        if not stack:
+            return NULL_SPAN
+
+        span = Span(name, args, stack)
+        stack[-1].children.append(span)
+        stack.append(span)
+        return span
+
+    def record(self, name, start, end, **args):
+        """
+        Adds a finished span below the innermost open span, eg. work timed on another thread
+
+        Start and end are perf_counter times, so the span lines up with the rest of the trace.
+        """
+
+        stack = self.get_stack()
+        if not stack:
+            return
+
+        span = Span(name, args)
+        span.start = start
+        span.end = end
+        stack[-1].children.append(span)
+
+    def count(self, name, value=1):
+        """ Adds to a counter of the innermost open span """
+
+        stack = self.get_stack()
+        if not stack:
+            return
+
+        counters = stack[-1].counters
+        counters[name] = counters.get(name, 0) + value
+
+
+# Module-level tracer shared by the loaders
+tracer = Tracer()
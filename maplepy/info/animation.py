@@ -0,0 +1,33 @@
+class Animation():
+    """
+    Class contains the canvases of an animation,
+    shared by every instance that draws the same frames.
+
+    Note:
+            Set the variables in this animation once.
+            Instances only reference it, and keep their own
+            position and timing state.
+
+    """
+
+    def __init__(self, key, canvases, flipped=False):
+
+        # Properties
+        self.key = key
+        self.flipped = flipped
+        self.canvases = tuple(canvases)
+
+    def __len__(self):
+        return len(self.canvases)
+
+    def get_size(self):
+        """ Returns the memory owned by this animation in bytes, flipped images are copies """
+
+        if not self.flipped:
+            return 0
+
+        size = 0
+        for canvas in self.canvases:
+            w, h = canvas.image.get_size()
+            size += w * h * canvas.image.get_bytesize()
+        return size
@@ -15,12 +15,16 @@ class Canvas(pygame.sprite.Sprite):
 
     """
 
+    # Collision masks are created on first use, disable to never create them
+    use_masks = True
+
     def __init__(self, image, w, h, x=0, y=0, z=0):
 
         # pygame.sprite.Sprite
         super().__init__()
         self.image = image
         self.rect = image.get_rect()
+        self._mask = None
 
         # Properties
         self.width = w
@@ -37,6 +41,16 @@ class Canvas(pygame.sprite.Sprite):
         # Update center
         self.rect.topleft = (-self.x, -self.y)
 
+    @property
+    def mask(self):
+        """ Collision mask of the image, created once when first requested """
+
+        if not Canvas.use_masks:
+            return None
+        if self._mask is None:
+            self._mask = pygame.mask.from_surface(self.image)
+        return self._mask
+
     def set_delay(self, delay):
         self.delay = delay
 
@@ -46,6 +60,7 @@ class Canvas(pygame.sprite.Sprite):
 
     def flip(self):
         self.image = pygame.transform.flip(self.image, True, False)
+        self._mask = None
 
     def update(self):
         pass
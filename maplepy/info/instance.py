@@ -15,7 +15,6 @@ class Instance(pygame.sprite.Sprite):
         # pygame.sprite.Sprite
         super().__init__()
         self.image = None       # Current image
-        self.mask = None
         self.rect = None
         self._layer = 0         # Used for layered sprite groups (z-buffer)
 
@@ -72,9 +71,29 @@ class Instance(pygame.sprite.Sprite):
         self.dx = 0
         self.dy = 0
 
+    @property
+    def mask(self):
+        """ Collision mask of the current frame, cached by its canvas """
+
+        if not self.canvas_list:
+            return None
+        return self.canvas_list[self.canvas_list_index].mask
+
     def update_layer(self, layer):
         self._layer = layer
 
+    def set_animation(self, animation):
+
+        # Reference the shared canvas list
+        self.canvas_list = animation.canvases
+        self.canvas_list_index = 0
+        self.frame_count = 0
+
+        # Update current image and rect
+        canvas = self.canvas_list[0]
+        self.image = canvas.image
+        self.rect = canvas.rect.copy().move(self.x, self.y)
+
     def add_canvas(self, canvas):
 
         # Add to canvas list
@@ -83,7 +102,6 @@ class Instance(pygame.sprite.Sprite):
         # Update current image and rect
         if not self.image:
             self.image = canvas.image
-            self.mask = pygame.mask.from_surface(self.image)
         if not self.rect:
             self.rect = canvas.rect.copy().move(self.x, self.y)
 
@@ -109,17 +127,19 @@ class Instance(pygame.sprite.Sprite):
 
             # Check individual canvas delay, update if reached
             if count >= canvas.delay:
+                self.set_frame((self.canvas_list_index + 1) % n)
 
-                # Update canvas index
-                self.canvas_list_index = (self.canvas_list_index + 1) % n
-                self.frame_count = 0
+    def set_frame(self, index):
 
-                # Update current image and rect
-                canvas = self.canvas_list[self.canvas_list_index]
-                self.image = canvas.image
-                self.image.set_alpha(canvas.a0)  # IMPORTANT: Reset alpha
-                self.mask = pygame.mask.from_surface(self.image)
-                self.rect = canvas.rect.copy().move(self.x, self.y)
+        # Update canvas index
+        self.canvas_list_index = index
+        self.frame_count = 0
+
+        # Update current image and rect
+        canvas = self.canvas_list[index]
+        self.image = canvas.image
+        self.image.set_alpha(canvas.a0)  # IMPORTANT: Reset alpha
+        self.rect = canvas.rect.copy().move(self.x, self.y)
 
     def step_scroll(self):
 
@@ -1,14 +1,26 @@
 import logging
 import os
 import random
+import threading
 import time
 
 import pygame
+from maplepy.base.baking import BakedLayer, sizeof_chunk
 from maplepy.base.display import SpriteDisplay
 from maplepy.base.sound import Bgm
+from maplepy.base.sprite import DataSprite
+from maplepy.helper.cache import LRUCache
+from maplepy.helper.diskcache import DiskCache
+from maplepy.helper.tracer import tracer
+from maplepy.info.canvas import Canvas
+from maplepy.nx.parser.catalognx import MapCatalog
+from maplepy.nx.parser.compiledmapnx import CompiledMap
 from maplepy.nx.parser.mapnx import MapNx
 from maplepy.nx.parser.soundnx import SoundNx
-from maplepy.nx.spritenx import BackgroundSpritesNx, LayeredSpritesNx
+from maplepy.nx.prefetchnx import PrefetcherNx
+from maplepy.nx.spritenx import (BackgroundSpritesNx, LayeredSpritesNx,
+                                 collect_atlas_keys, collect_links,
+                                 resource_manager)
 
 map_file_names = ['map.nx', 'map001.nx', 'map002.nx', 'map2.nx']
 sound_file_names = ['sound.nx', 'sound001.nx', 'sound002.nx', 'sound2.nx']
@@ -26,6 +38,28 @@ class DisplayNx(SpriteDisplay):
         self.path = path
         self.bgm = Bgm()
         self.map_nodes = None
+        self.compiled_map_path = None
+        self.catalog_path = None
+        self.catalog = None
+        self.catalog_thread = None
+        self.loader_workers = 1
+        self.atlas_tiles = True
+        self.atlas_objects = False
+        self.bake_layers = False
+        self.chunk_size = 512
+
+        # Spans of the last map load, optionally logged
+        self.trace = None
+        self.log_traces = False
+
+        # Recently used and prefetched map bundles, limited by count
+        # Shared with the prefetch thread
+        self.bundles = LRUCache(16, lambda bundle: 1)
+        self.bundles_lock = threading.Lock()
+
+        # Baked static sprites of the current map
+        self.chunks = LRUCache(0, sizeof_chunk)
+        self.prefetcher = PrefetcherNx(self)
 
         # Objects in the map
         self.map_nx = MapNx()
@@ -36,20 +70,179 @@ class DisplayNx(SpriteDisplay):
         for file in sound_file_names:
             self.sound_nx.open(f'{path}/{file}')
 
-    def load_random_map(self):
+    def set_cache_budget(self, sprite_budget, data_budget):
+        """ Sets the memory budget in bytes of the shared resource caches """
+        resource_manager.set_budget(sprite_budget, data_budget)
+
+    def set_disk_cache(self, path, max_size=0):
+        """ Stores decoded sprites in a persistent cache directory, None to disable, max_size 0 is unbounded """
+
+        # Check if map nx is loaded
+        if not path or not self.map_nx.file:
+            resource_manager.set_disk_cache(None)
+            return
+
+        # Cached sprites are only valid for the opened map files
+        try:
+            identity = self.map_nx.get_identity()
+            resource_manager.set_disk_cache(DiskCache(path, identity, max_size))
+        except:
+            logging.exception(f'Unable to open sprite cache {path}')
+
+    def set_loader_workers(self, workers):
+        """ Sets the number of threads used to decode sprites while loading a map """
+        self.loader_workers = max(1, int(workers or 1))
+
+    def set_atlas(self, tiles, objects):
+        """ Sets whether tile sets and object sets are packed into atlases """
+        self.atlas_tiles = bool(tiles)
+        self.atlas_objects = bool(objects)
+
+    def set_baking(self, enabled, chunk_size, budget):
+        """ Sets whether static sprites of each layer are baked into chunks, and the chunk cache budget in bytes """
+        self.bake_layers = bool(enabled)
+        self.chunk_size = max(64, int(chunk_size or 512))
+        self.chunks.set_budget(budget or 0)
+        self.chunks.clear()
+
+    def set_collision_masks(self, enabled):
+        """ Sets whether collision masks are created when requested, they are never created ahead """
+        DataSprite.use_masks = bool(enabled)
+        Canvas.use_masks = bool(enabled)
+
+    def set_trace_logging(self, enabled):
+        """ Sets whether a summary of the spans of each map load is logged """
+        self.log_traces = bool(enabled)
+
+    def get_trace(self):
+        """ Returns the root span of the last map load, None if no map was loaded """
+        return self.trace
+
+    def set_prefetch(self, max_maps, cpu_budget, memory_budget):
+        """ Sets how many portal targets are prefetched after a map is loaded, and the budgets """
+        self.prefetcher.set_budget(max_maps, cpu_budget, memory_budget)
+
+    def set_compiled_map_path(self, path):
+        """ Loads maps from compiled map files in this directory when available """
+        self.compiled_map_path = path
+
+    def load_compiled_map(self, map_id):
+        """ Return the compiled map if it exists and matches the opened map files """
+
+        # Check for compiled file
+        if not self.compiled_map_path:
+            return None
+        file = f'{self.compiled_map_path}/{map_id}.map'
+        if not os.path.isfile(file):
+            return None
+
+        # Load file
+        compiled = CompiledMap.load(file)
+        if not compiled:
+            return None
+
+        # Check if it was compiled from the same map files
+        if compiled.identity != self.map_nx.get_identity():
+            logging.warning(f'{file} is out of date')
+            return None
+
+        # Get mini map image
+        if compiled.minimap:
+            path = f'{self.map_nx.get_map_path(map_id)}/miniMap/canvas'
+            node = self.map_nx.file.resolve(path)
+            if node:
+                compiled.minimap['canvas_image'] = node.get_image()
+
+        return compiled
+
+    def set_catalog_path(self, path):
+        """ Loads the map catalog from this file if it is up to date """
+
+        self.catalog_path = path
+        self.catalog = None
+        self.catalog_thread = None
+
+        # Check if map nx is loaded
+        if not path or not self.map_nx.file:
+            return
+
+        self.catalog = MapCatalog.load(path, self.map_nx.get_identity())
+
+    def get_catalog(self):
+        """
+        Return the map catalog, or None until it is available
+
+        A missing or out of date catalog is built and saved on a background thread,
+        so callers fall back to the map nodes instead of waiting for it.
+        """
+
+        # Check if catalog is enabled
+        if self.catalog or not self.catalog_path:
+            return self.catalog
 
         # Check if map nx is loaded
         if not self.map_nx.file:
+            return None
+
+        # Build once for these map files
+        if not self.catalog_thread:
+            logging.info(f'Building map catalog: {self.catalog_path}')
+            self.catalog_thread = threading.Thread(target=self.build_catalog,
+                                                   args=(self.catalog_path,), daemon=True)
+            self.catalog_thread.start()
+
+        return None
+
+    def build_catalog(self, path):
+        """ Builds and saves the map catalog, runs on a background thread """
+
+        try:
+            catalog = MapCatalog.build(self.map_nx)
+            catalog.save(path)
+        except:
+            logging.exception('Failed to build map catalog')
             return
 
-        # Load map nodes
-        if not self.map_nodes:
-            self.map_nodes = self.map_nx.get_map_nodes()
+        # Only use it if the catalog path did not change meanwhile
+        if path == self.catalog_path:
+            self.catalog = catalog
+
+    def get_bundle(self, map_id):
+        """ Return the compiled map, or all map data at once, None if the map does not exist """
+
+        # Check if bundle is already loaded
+        with self.bundles_lock:
+            bundle = self.bundles.get(map_id)
+        if bundle:
+            tracer.count('bundle_hits')
+            return bundle
+        tracer.count('bundle_misses')
 
-        # Pick random node
-        if self.map_nodes:
-            choices = list(self.map_nodes.keys())
-            map_id = random.choice(choices)[:9]
+        # Load and store, the lock is not held while loading
+        bundle = self.load_compiled_map(map_id) or self.map_nx.load_bundle(map_id)
+        if bundle:
+            with self.bundles_lock:
+                self.bundles.put(map_id, bundle)
+        return bundle
+
+    def load_random_map(self):
+
+        # Check if map nx is loaded
+        if not self.map_nx.file:
+            return
+
+        # Load map ids from the catalog, otherwise from map nodes
+        catalog = self.get_catalog()
+        if catalog:
+            choices = catalog.ids()
+        else:
+            if not self.map_nodes:
+                self.map_nodes = self.map_nx.get_map_nodes()
+            choices = [name[:9] for name in self.map_nodes.keys()] if self.map_nodes else []
+
+        # Pick random map
+        if choices:
+            map_id = random.choice(choices)
             logging.info(f'Load random map: {map_id}')
             self.load_map(map_id)
 
@@ -65,9 +258,35 @@ class DisplayNx(SpriteDisplay):
             return
 
         # Check if map exists
-        if not self.map_nx.get_map_node(map_id):
+        if self.catalog and map_id not in self.catalog:
+            logging.warning(f'{map_id} does not exist')
             return
 
+        # Foreground loading always comes first
+        self.prefetcher.cancel()
+
+        # Record the load as a tree of spans
+        tracer.start('load_map', map_id=map_id)
+        try:
+            bundle = self.setup_map(map_id)
+        finally:
+            self.trace = tracer.finish()
+            if self.log_traces:
+                logging.info(f'Trace:\n{self.trace.summary()}')
+
+        # Warm the caches with neighbouring maps
+        if bundle:
+            self.prefetcher.start(bundle)
+
+    def setup_map(self, map_id):
+        """ Loads the map, returns its bundle or None if the map does not exist """
+
+        # Load compiled map, or all map data at once, check if map exists
+        with tracer.span('bundle'):
+            bundle = self.get_bundle(map_id)
+        if not bundle:
+            return None
+
         # Unload all old data
         self.bgm.unload()
         self.view.topleft = (0, 0)
@@ -75,28 +294,60 @@ class DisplayNx(SpriteDisplay):
         self.background_sprites = None
         self.layered_sprites.clear()
         self.overlayed_sprites = None
-
-        # Setup and load
-        self.setup_info(map_id)
-        self.setup_background_sprites(map_id)
-        self.setup_layered_sprites(map_id)
-        self.setup_portal_sprites(map_id)
+        self.chunks.clear()
+
+        # Setup and load, resources of this map are pinned in the cache
+        resource_manager.start_pinning()
+        try:
+            with tracer.span('sprites'):
+                self.setup_sprites(bundle)
+            with tracer.span('info'):
+                self.setup_info(bundle)
+            with tracer.span('background'):
+                self.setup_background_sprites(bundle)
+            with tracer.span('layers'):
+                self.setup_layered_sprites(bundle)
+            with tracer.span('portals'):
+                self.setup_portal_sprites(bundle)
+        finally:
+            resource_manager.stop_pinning()
+            resource_manager.flush()
+
+        # Draw the new map everywhere
+        self.invalidate()
 
         # Play bgm
         self.bgm.play()
 
-    def setup_info(self, map_id):
+        return bundle
+
+    def setup_sprites(self, bundle):
+
+        # Check if map nx is loaded
+        if not self.map_nx.file:
+            return
+
+        # Collect every sprite of the map, then decode them all at once
+        # Otherwise sprites are decoded one at a time while building each group
+        if self.loader_workers > 1:
+            with tracer.span('collect'):
+                links = collect_links(self.map_nx, bundle)
+            resource_manager.load_sprites(self.map_nx.file, links, self.loader_workers)
+
+        # Pack tile sets and object sets into atlases
+        for key in collect_atlas_keys(bundle, self.atlas_tiles, self.atlas_objects):
+            resource_manager.get_atlas(self.map_nx.file, key, self.loader_workers)
+
+    def setup_info(self, bundle):
 
         # Check if map nx is loaded
         if not self.map_nx.file:
             return
 
         # Get info, minimap, foothold
-        info = self.map_nx.get_info(map_id)
-        seat = self.map_nx.get_seat(map_id)
-        minimap = self.map_nx.get_minimap(map_id)
-        foothold = self.map_nx.get_foothold(map_id)
-        ladder = self.map_nx.get_ladder(map_id)
+        info = bundle.info
+        minimap = bundle.minimap
+        foothold = bundle.foothold
 
         # Check for required data
         if not info or not minimap:
@@ -144,7 +395,7 @@ class DisplayNx(SpriteDisplay):
             except:
                 pass
 
-    def setup_background_sprites(self, map_id):
+    def setup_background_sprites(self, bundle):
 
         # Check if map nx is loaded
         if not self.map_nx.file:
@@ -152,10 +403,10 @@ class DisplayNx(SpriteDisplay):
 
         # Load background
         background_sprites = BackgroundSpritesNx()
-        background_sprites.load_background(self.map_nx, map_id)
+        background_sprites.load_background(self.map_nx, bundle)
         self.background_sprites = background_sprites
 
-    def setup_layered_sprites(self, map_id):
+    def setup_layered_sprites(self, bundle):
 
         # Check if map nx is loaded
         if not self.map_nx.file:
@@ -163,11 +414,19 @@ class DisplayNx(SpriteDisplay):
 
         # Load layers
         for i in range(0, 8):
-            layered_sprites = LayeredSpritesNx()
-            layered_sprites.load_layer(self.map_nx, map_id, i)
-            self.layered_sprites.append(layered_sprites)
+            with tracer.span('layer', index=i):
+                layered_sprites = LayeredSpritesNx()
+                layered_sprites.load_layer(self.map_nx, bundle, i)
+                self.layered_sprites.append(layered_sprites)
+
+                # Bake static sprites, portals are always drawn as they are
+                if self.bake_layers and layered_sprites.sprites:
+                    with tracer.span('bake'):
+                        baked = BakedLayer(layered_sprites.sprites.sprites(),
+                                           self.chunks, i, self.chunk_size)
+                        layered_sprites.set_baked(baked)
 
-    def setup_portal_sprites(self, map_id):
+    def setup_portal_sprites(self, bundle):
 
         # Check if map nx is loaded
         if not self.map_nx.file:
@@ -175,5 +434,5 @@ class DisplayNx(SpriteDisplay):
 
         # Load portals
         portal_sprites = LayeredSpritesNx()
-        portal_sprites.load_portal(self.map_nx, map_id)
+        portal_sprites.load_portal(self.map_nx, bundle)
         self.layered_sprites.append(portal_sprites)
@@ -0,0 +1,166 @@
+import logging
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping
+
+from maplepy.info.instance import Instance
+
+
+def freeze(values):
+    """ Return a read-only copy of parsed values, dicts become mappings and lists become tuples """
+
+    if isinstance(values, dict):
+        return MappingProxyType({k: freeze(v) for k, v in values.items()})
+    if isinstance(values, list):
+        return tuple(freeze(v) for v in values)
+    return values
+
+
+@dataclass(frozen=True)
+class MapBundle:
+    """
+    Immutable data of a single map
+
+    Sections that are missing from the map are None.
+    Layers always has 8 entries, one for each layer index.
+
+    The sprite loaders only use the get methods, a compiled map has the same ones.
+    """
+
+    map_id: str
+    info: Mapping = None
+    back: tuple = None
+    layers: tuple = (None,) * 8
+    foothold: Mapping = None
+    ladder: Mapping = None
+    seat: Mapping = None
+    portal: tuple = None
+    life: tuple = None
+    minimap: Mapping = None
+
+    def get_backgrounds(self):
+        """ Return an instance for each background """
+
+        instances = []
+        for val in self.back or []:
+
+            # Extract properties
+            inst = Instance()
+            for k, v in val.items():
+                setattr(inst, k, v)
+
+            # Explicit special case
+            if inst.name and inst.name.isdigit():
+                inst.update_layer(int(inst.name))
+
+            instances.append(inst)
+
+        return instances
+
+    def get_tiles(self, layer):
+        """ Return an instance for each tile of a layer """
+
+        # Check layer data
+        values = self.layers[layer]
+        if not values:
+            logging.warning('Layer data not found')
+            return []
+
+        # Make sure there's tile information
+        info = values['info']
+        if values['tile'] and 'tS' not in info:
+            logging.warning('Tile data not found')
+            return []
+
+        instances = []
+        for val in values['tile']:
+
+            # Extract properties
+            inst = Instance()
+            inst.tS = info['tS']
+            for k, v in val.items():
+                setattr(inst, k, v)
+
+            # Explicit special case
+            if inst.name and inst.name.isdigit():
+                inst.update_layer(int(inst.name))
+
+            instances.append(inst)
+
+        return instances
+
+    def get_objects(self, layer):
+        """ Return an instance for each object of a layer """
+
+        values = self.layers[layer]
+        if not values:
+            return []
+
+        instances = []
+        for val in values['obj']:
+
+            # Extract properties
+            inst = Instance()
+            for k, v in val.items():
+                setattr(inst, k, v)
+
+            # Explicit special case
+            if 'z' in val:
+                inst.update_layer(int(val['z']))
+            else:
+                inst.update_layer(inst.zM)
+
+            instances.append(inst)
+
+        return instances
+
+    def get_portals(self):
+        """ Return an instance for each portal """
+
+        instances = []
+        for val in self.portal or []:
+
+            # Special case
+            val = dict(val)
+            val['pS'] = val.pop('image') if 'image' in val else 'default'
+
+            # Extract properties
+            inst = Instance()
+            for k, v in val.items():
+                setattr(inst, k, v)
+
+            instances.append(inst)
+
+        return instances
+
+    def get_background_keys(self):
+        """ Return (bS, no, ani) of each background """
+        return [(val.get('bS'), val.get('no'), val.get('ani')) for val in self.back or []]
+
+    def get_tile_keys(self):
+        """ Return (tS, u, no) of each tile, in layer order """
+
+        keys = []
+        for values in self.layers:
+            if values and 'tS' in values['info']:
+                tS = values['info']['tS']
+                keys += [(tS, val.get('u'), val.get('no')) for val in values['tile']]
+        return keys
+
+    def get_object_keys(self):
+        """ Return (oS, l0, l1, l2) of each object, in layer order """
+
+        keys = []
+        for values in self.layers:
+            if values:
+                keys += [(val.get('oS'), val.get('l0'), val.get('l1'), val.get('l2'))
+                         for val in values['obj']]
+        return keys
+
+    def get_portal_keys(self):
+        """ Return (pt, pS) of each portal """
+        return [(val.get('pt'), val.get('image', 'default')) for val in self.portal or []]
+
+    def get_portal_targets(self):
+        """ Return the target map of each portal, None if it has none """
+        return [val.get('tm') for val in self.portal or []]
@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+
+VERSION = 1
+
+
+class MapCatalog:
+    """
+    Persistent index of every map id with lightweight metadata.
+
+    The catalog is built once for a set of map files, then saved as json.
+    Later runs load the saved catalog as long as the map files are unchanged,
+    so lookups and queries never have to open the map trees.
+
+    Metadata for each map:
+        file        owning nx file
+        bgm         background music path
+        vr          [left, top, right, bottom] view bounds, or None
+        minimap     [width, height], or None
+        layers      number of layers with tiles or objects
+        tiles       number of tiles
+        objects     number of objects
+        tilesets    tile sets used by the map
+        objectsets  object sets used by the map
+        portals     target map ids of the portals
+    """
+
+    def __init__(self, identity=None):
+        self.identity = identity
+        self.maps = {}
+
+    def __contains__(self, map_id):
+        return map_id in self.maps
+
+    def __len__(self):
+        return len(self.maps)
+
+    def ids(self):
+        """ Return all map ids """
+        return list(self.maps.keys())
+
+    def get(self, map_id):
+        """ Return the metadata of a map, or None if it does not exist """
+        return self.maps.get(map_id)
+
+    def query(self, tileset=None, objectset=None, bgm=None, file=None,
+              min_tiles=None, min_objects=None, portal=None, predicate=None):
+        """
+        Return the ids of maps matching all given filters
+
+        Args:
+            tileset (str): uses this tile set
+            objectset (str): uses this object set
+            bgm (str): plays this background music
+            file (str): belongs to this nx file
+            min_tiles (int): has more than this many tiles
+            min_objects (int): has more than this many objects
+            portal (str): has a portal to this map id
+            predicate (function): called with (map_id, metadata), returns True to keep the map
+        """
+
+        result = []
+        for map_id, meta in self.maps.items():
+            if tileset is not None and tileset not in meta['tilesets']:
+                continue
+            if objectset is not None and objectset not in meta['objectsets']:
+                continue
+            if bgm is not None and meta['bgm'] != bgm:
+                continue
+            if file is not None and meta['file'] != file:
+                continue
+            if min_tiles is not None and meta['tiles'] <= min_tiles:
+                continue
+            if min_objects is not None and meta['objects'] <= min_objects:
+                continue
+            if portal is not None and portal not in meta['portals']:
+                continue
+            if predicate and not predicate(map_id, meta):
+                continue
+            result.append(map_id)
+
+        return result
+
+    @classmethod
+    def build(cls, map_nx):
+        """ Build the catalog by reading every map from the opened map files """
+
+        catalog = cls(map_nx.get_identity())
+
+        # Owning file of each map, found when the files were opened
+        owners = map_nx.owners
+
+        # Read every map
+        for map_id in sorted(owners.keys()):
+            try:
+                bundle = map_nx.load_bundle(map_id)
+                if bundle:
+                    catalog.maps[map_id] = catalog.describe(bundle, owners[map_id])
+            except:
+                logging.exception(f'Failed to catalog {map_id}')
+
+        logging.info(f'Cataloged {len(catalog.maps)} maps')
+        return catalog
+
+    def describe(self, bundle, file):
+        """ Return the metadata of a map bundle """
+
+        info = bundle.info or {}
+        minimap = bundle.minimap or {}
+
+        # View bounds
+        vr = None
+        view_keys = ['VRLeft', 'VRTop', 'VRRight', 'VRBottom']
+        if all(key in info for key in view_keys):
+            vr = [int(info[key]) for key in view_keys]
+
+        # Mini map size
+        size = None
+        if 'width' in minimap and 'height' in minimap:
+            size = [int(minimap['width']), int(minimap['height'])]
+
+        # Layers
+        layers = 0
+        tiles = 0
+        objects = 0
+        tilesets = set()
+        objectsets = set()
+        for layer in bundle.layers:
+            if not layer or not (layer['tile'] or layer['obj']):
+                continue
+            layers += 1
+            tiles += len(layer['tile'])
+            objects += len(layer['obj'])
+            if layer['tile'] and 'tS' in layer['info']:
+                tilesets.add(str(layer['info']['tS']))
+            objectsets.update(str(obj['oS']) for obj in layer['obj'] if 'oS' in obj)
+
+        # Portal targets, 999999999 is no target
+        portals = set()
+        for portal in bundle.portal or []:
+            tm = str(portal.get('tm', ''))
+            if tm.isdigit() and tm != '999999999':
+                portals.add(tm.zfill(9))
+
+        return {
+            'file': file,
+            'bgm': info.get('bgm'),
+            'vr': vr,
+            'minimap': size,
+            'layers': layers,
+            'tiles': tiles,
+            'objects': objects,
+            'tilesets': sorted(tilesets),
+            'objectsets': sorted(objectsets),
+            'portals': sorted(portals),
+        }
+
+    def save(self, path):
+        """ Write the catalog to a json file """
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Replace in one step, a partial file is never read
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({'version': VERSION, 'identity': self.identity, 'maps': self.maps}, file)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path, identity):
+        """ Read the catalog from a json file, returns None if it is missing or out of date """
+
+        try:
+            with open(path) as file:
+                values = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        # Check if it was built from the same map files
+        if values.get('version') != VERSION or values.get('identity') != identity:
+            logging.info(f'{path} is out of date')
+            return None
+
+        catalog = cls(identity)
+        catalog.maps = values.get('maps', {})
+        return catalog
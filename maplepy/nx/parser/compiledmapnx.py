@@ -0,0 +1,407 @@
+import json
+import logging
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+
+from maplepy.info.instance import Instance
+
+MAGIC = b'MPMC'
+VERSION = 1
+
+# Column name: array type code
+# String columns store indexes into the string table
+TILE_COLUMNS = (
+    ('layer', 'b'), ('x', 'i'), ('y', 'i'), ('zM', 'i'), ('order', 'i'),
+    ('tS', 'H'), ('u', 'H'), ('no', 'H'),
+)
+OBJ_COLUMNS = (
+    ('layer', 'b'), ('x', 'i'), ('y', 'i'), ('z', 'i'), ('zM', 'i'), ('f', 'b'),
+    ('oS', 'H'), ('l0', 'H'), ('l1', 'H'), ('l2', 'H'),
+)
+BACK_COLUMNS = (
+    ('x', 'i'), ('y', 'i'), ('rx', 'i'), ('ry', 'i'), ('cx', 'i'), ('cy', 'i'),
+    ('a', 'h'), ('type', 'b'), ('front', 'b'), ('ani', 'b'), ('f', 'b'), ('order', 'i'),
+    ('bS', 'H'), ('no', 'H'),
+)
+PORTAL_COLUMNS = (
+    ('x', 'i'), ('y', 'i'), ('pt', 'b'), ('tm', 'i'),
+    ('pS', 'H'), ('pn', 'H'), ('tn', 'H'),
+)
+STRING_COLUMNS = ('tS', 'u', 'no', 'oS', 'l0', 'l1', 'l2', 'bS', 'pS', 'pn', 'tn')
+
+# Section name: columns, in file order
+SECTIONS = (
+    ('tile', TILE_COLUMNS),
+    ('obj', OBJ_COLUMNS),
+    ('back', BACK_COLUMNS),
+    ('portal', PORTAL_COLUMNS),
+)
+
+
+def to_int(value, default=0):
+    """ Return the value as an integer, or default if it is not a number """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def to_order(name):
+    """ Return the explicit draw order from a node name """
+    return int(name) if name and name.isdigit() else 0
+
+
+class CompiledMap:
+    """
+    Compact binary map file, flattened from a map bundle.
+
+    Tiles, objects, backgrounds and portals are stored as typed arrays, one per column.
+    Keys such as tS/u/no, oS/l0/l1/l2 and bS/no are interned into a single string table.
+    Info, minimap and foothold bounds are stored as a small json header.
+
+    It has the same get methods as a map bundle, instances are built
+    straight from the typed arrays and the string table.
+
+    File layout (little-endian):
+        magic, version
+        header length, header json
+        string count, [string length, string]
+        for each section: row count, [column array]
+    """
+
+    def __init__(self, map_id=None):
+
+        self.map_id = map_id
+        self.identity = None
+
+        # Header values
+        self.info = None
+        self.minimap = None
+        self.foothold = None
+
+        # Interned strings
+        self.strings = []
+        self.string_index = {}
+
+        # Section name: {column name: array}
+        self.tile = self.create_columns(TILE_COLUMNS)
+        self.obj = self.create_columns(OBJ_COLUMNS)
+        self.back = self.create_columns(BACK_COLUMNS)
+        self.portal = self.create_columns(PORTAL_COLUMNS)
+
+    def create_columns(self, columns):
+        """ Return empty typed arrays for each column """
+        return {name: array(code) for name, code in columns}
+
+    def intern(self, value):
+        """ Return the string table index of the value """
+
+        value = str(value)
+        index = self.string_index.get(value)
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(value)
+            self.string_index[value] = index
+        return index
+
+    def append(self, section, row):
+        """ Append a row of values to a section """
+
+        for name, values in section.items():
+            value = row.get(name)
+            values.append(self.intern(value) if name in STRING_COLUMNS else to_int(value))
+
+    def get_layer_range(self, section, layer):
+        """ Return the (start, end) rows of a layer, rows are sorted by layer """
+
+        layers = section['layer']
+        return bisect_left(layers, layer), bisect_right(layers, layer)
+
+    @classmethod
+    def from_bundle(cls, bundle, identity=None):
+        """ Flatten a map bundle into columns """
+
+        compiled = cls(bundle.map_id)
+        compiled.identity = identity
+
+        # Header values, images are resolved from the nx file when loading
+        compiled.info = dict(bundle.info) if bundle.info else None
+        if bundle.minimap:
+            compiled.minimap = {k: v for k, v in bundle.minimap.items()
+                                if isinstance(v, (int, float, str))}
+
+        # Only keep the foothold bounds used by the view limit
+        if bundle.foothold:
+            groups = bundle.foothold.values()
+            bounds = {k: min([min([x[k] for x in v]) for v in groups])
+                      for k in ['x1', 'y1', 'x2', 'y2']}
+            compiled.foothold = {'bounds': [bounds]}
+
+        # Tiles and objects, sorted by layer
+        for layer, values in enumerate(bundle.layers):
+            if not values:
+                continue
+
+            info = values['info']
+            if 'tS' in info:
+                for val in values['tile']:
+                    row = dict(val)
+                    row['layer'] = layer
+                    row['tS'] = info['tS']
+                    row['order'] = to_order(val.get('name'))
+                    compiled.append(compiled.tile, row)
+
+            for val in values['obj']:
+                row = dict(val)
+                row['layer'] = layer
+                row['z'] = to_int(val['z']) if 'z' in val else to_int(val.get('zM'))
+                compiled.append(compiled.obj, row)
+
+        # Backgrounds
+        for val in bundle.back or []:
+            row = dict(val)
+            row['order'] = to_order(val.get('name'))
+            compiled.append(compiled.back, row)
+
+        # Portals
+        for val in bundle.portal or []:
+            row = dict(val)
+            row['pS'] = val['image'] if 'image' in val else 'default'
+            row['tm'] = to_int(val.get('tm'), -1)
+            compiled.append(compiled.portal, row)
+
+        return compiled
+
+    def get_backgrounds(self):
+        """ Return an instance for each background, built straight from the columns """
+
+        back = self.back
+        strings = self.strings
+
+        instances = []
+        for i in range(len(back['x'])):
+            inst = Instance()
+            inst.x = back['x'][i]
+            inst.y = back['y'][i]
+            inst.rx = back['rx'][i]
+            inst.ry = back['ry'][i]
+            inst.cx = back['cx'][i]
+            inst.cy = back['cy'][i]
+            inst.a = back['a'][i]
+            inst.type = back['type'][i]
+            inst.front = back['front'][i]
+            inst.ani = back['ani'][i]
+            inst.f = back['f'][i]
+            inst.bS = strings[back['bS'][i]]
+            inst.no = strings[back['no'][i]]
+            inst.update_layer(back['order'][i])
+            instances.append(inst)
+
+        return instances
+
+    def get_tiles(self, layer):
+        """ Return an instance for each tile of a layer, built straight from the columns """
+
+        tile = self.tile
+        strings = self.strings
+
+        instances = []
+        start, end = self.get_layer_range(tile, layer)
+        for i in range(start, end):
+            inst = Instance()
+            inst.x = tile['x'][i]
+            inst.y = tile['y'][i]
+            inst.zM = tile['zM'][i]
+            inst.tS = strings[tile['tS'][i]]
+            inst.u = strings[tile['u'][i]]
+            inst.no = strings[tile['no'][i]]
+            inst.update_layer(tile['order'][i])
+            instances.append(inst)
+
+        return instances
+
+    def get_objects(self, layer):
+        """ Return an instance for each object of a layer, built straight from the columns """
+
+        obj = self.obj
+        strings = self.strings
+
+        instances = []
+        start, end = self.get_layer_range(obj, layer)
+        for i in range(start, end):
+            inst = Instance()
+            inst.x = obj['x'][i]
+            inst.y = obj['y'][i]
+            inst.zM = obj['zM'][i]
+            inst.f = obj['f'][i]
+            inst.oS = strings[obj['oS'][i]]
+            inst.l0 = strings[obj['l0'][i]]
+            inst.l1 = strings[obj['l1'][i]]
+            inst.l2 = strings[obj['l2'][i]]
+            inst.update_layer(obj['z'][i])
+            instances.append(inst)
+
+        return instances
+
+    def get_portals(self):
+        """ Return an instance for each portal, built straight from the columns """
+
+        portal = self.portal
+        strings = self.strings
+
+        instances = []
+        for i in range(len(portal['x'])):
+            inst = Instance()
+            inst.x = portal['x'][i]
+            inst.y = portal['y'][i]
+            inst.pt = portal['pt'][i]
+            inst.tm = None if portal['tm'][i] == -1 else portal['tm'][i]
+            inst.pS = strings[portal['pS'][i]]
+            inst.pn = strings[portal['pn'][i]]
+            inst.tn = strings[portal['tn'][i]]
+            instances.append(inst)
+
+        return instances
+
+    def get_keys(self, section, columns):
+        """ Return a tuple of values for each row, string columns are resolved """
+
+        strings = self.strings
+        values = [section[name] for name in columns]
+        values = [[strings[i] for i in column] if name in STRING_COLUMNS else column
+                  for name, column in zip(columns, values)]
+        return list(zip(*values))
+
+    def get_background_keys(self):
+        """ Return (bS, no, ani) of each background """
+        return self.get_keys(self.back, ('bS', 'no', 'ani'))
+
+    def get_tile_keys(self):
+        """ Return (tS, u, no) of each tile, in layer order """
+        return self.get_keys(self.tile, ('tS', 'u', 'no'))
+
+    def get_object_keys(self):
+        """ Return (oS, l0, l1, l2) of each object, in layer order """
+        return self.get_keys(self.obj, ('oS', 'l0', 'l1', 'l2'))
+
+    def get_portal_keys(self):
+        """ Return (pt, pS) of each portal """
+        return self.get_keys(self.portal, ('pt', 'pS'))
+
+    def get_portal_targets(self):
+        """ Return the target map of each portal, None if it has none """
+        return [None if tm == -1 else tm for tm in self.portal['tm']]
+
+    def save(self, path):
+        """ Write the compiled map to a file """
+
+        header = json.dumps({
+            'map_id': self.map_id,
+            'identity': self.identity,
+            'info': self.info,
+            'minimap': self.minimap,
+            'foothold': self.foothold,
+        }, default=str).encode('utf-8')
+
+        chunks = [MAGIC, struct.pack('<H', VERSION)]
+        chunks.append(struct.pack('<I', len(header)))
+        chunks.append(header)
+
+        # String table
+        chunks.append(struct.pack('<I', len(self.strings)))
+        for value in self.strings:
+            encoded = value.encode('utf-8')
+            chunks.append(struct.pack('<H', len(encoded)))
+            chunks.append(encoded)
+
+        # Columns
+        for name, columns in SECTIONS:
+            section = getattr(self, name)
+            chunks.append(struct.pack('<I', len(section[columns[0][0]])))
+            for column, _ in columns:
+                values = section[column]
+                if sys.byteorder != 'little':
+                    values = array(values.typecode, values)
+                    values.byteswap()
+                chunks.append(values.tobytes())
+
+        # Replace in one step, a partial file is never read
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(b''.join(chunks))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """ Read a compiled map from a file, returns None if it is invalid """
+
+        try:
+            with open(path, 'rb') as file:
+                buffer = file.read()
+        except OSError:
+            logging.warning(f'{path} could not be read')
+            return None
+
+        # Truncated or corrupt files are not loaded
+        try:
+            return cls.parse(buffer)
+        except (struct.error, ValueError, KeyError, TypeError, UnicodeDecodeError):
+            logging.warning(f'{path} is not a valid compiled map')
+            return None
+
+    @classmethod
+    def parse(cls, buffer):
+        """ Read a compiled map from bytes, raises ValueError or struct.error if it is invalid """
+
+        def read(offset, size):
+            if offset + size > len(buffer):
+                raise ValueError('Compiled map is truncated')
+            return buffer[offset:offset + size]
+
+        # Check format
+        if read(0, 4) != MAGIC or struct.unpack_from('<H', buffer, 4)[0] != VERSION:
+            raise ValueError('Not a compiled map')
+        offset = 6
+
+        # Header
+        length, = struct.unpack_from('<I', buffer, offset)
+        offset += 4
+        header = json.loads(read(offset, length).decode('utf-8'))
+        offset += length
+
+        compiled = cls(header['map_id'])
+        compiled.identity = header['identity']
+        compiled.info = header['info']
+        compiled.minimap = header['minimap']
+        compiled.foothold = header['foothold']
+
+        # String table
+        count, = struct.unpack_from('<I', buffer, offset)
+        offset += 4
+        for _ in range(count):
+            length, = struct.unpack_from('<H', buffer, offset)
+            offset += 2
+            compiled.strings.append(read(offset, length).decode('utf-8'))
+            offset += length
+
+        # Columns
+        for name, columns in SECTIONS:
+            section = getattr(compiled, name)
+            count, = struct.unpack_from('<I', buffer, offset)
+            offset += 4
+            for column, _ in columns:
+                values = section[column]
+                size = count * values.itemsize
+                values.frombytes(read(offset, size))
+                if sys.byteorder != 'little':
+                    values.byteswap()
+                offset += size
+
+        # Every byte belongs to a column
+        if offset != len(buffer):
+            raise ValueError('Compiled map has trailing data')
+
+        return compiled
@@ -1,6 +1,8 @@
 import logging
 import os
 
+from maplepy.helper.tracer import tracer
+from maplepy.nx.parser.bundlenx import MapBundle, freeze
 from nxpy.nxfile import NXFileSet
 
 
@@ -15,6 +17,10 @@ class MapNx:
 
     def __init__(self):
         self.file = NXFileSet()
+        self.paths = []
+
+        # Map id: name of the first opened file with that map
+        self.owners = {}
 
     def open(self, file):
         """ Load file from path """
@@ -26,9 +32,25 @@ class MapNx:
         try:
             # Open nx file
             self.file.load(file)
+            self.paths.append(file)
+
+            # Maps added by this file, files share the same map tree
+            name = os.path.basename(file)
+            for map_id in self.list_map_ids():
+                self.owners.setdefault(map_id, name)
         except:
             logging.exception(f'Unable to open {file}')
 
+    def get_identity(self):
+        """ Return a string that changes whenever one of the opened files changes """
+
+        identity = []
+        for path in self.paths:
+            stat = os.stat(path)
+            identity.append(f'{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}')
+
+        return ';'.join(identity)
+
     def get_values(self, node):
         """ Return the node's children as a dictionary """
         return {c.name: c.value for c in node.get_children()}
@@ -48,39 +70,83 @@ class MapNx:
         # Return
         return map_nodes
 
+    def list_map_ids(self):
+        """ Return the ids of all available maps, without reading the map nodes """
+
+        map_ids = []
+        for index in range(9):
+            map_digit = self.file.resolve(f'Map/Map{index}')
+            if map_digit:
+                map_ids += [name[:9] for name in map_digit.list_children()]
+        return map_ids
+
+    def get_map_path(self, map_id):
+        """ Return the path to the map node """
+        return f'Map/Map{map_id[0:1]}/{map_id}.img'
+
     def get_map_node(self, map_id):
         """ Return the map node by id """
-        path = f'Map/Map{map_id[0:1]}/{map_id}.img'
-        return self.file.resolve(path)
+        return self.file.resolve(self.get_map_path(map_id))
+
+    def load_bundle(self, map_id):
+        """
+        Return all data for the map as a single immutable bundle
+
+        The map node is resolved once, then its children are parsed in a single pass.
+        """
+
+        # Get map node
+        with tracer.span('resolve', key=self.get_map_path(map_id)):
+            map_node = self.get_map_node(map_id)
+        if not map_node:
+            return None
+
+        # Parse each child once
+        values = {'layers': [None] * 8}
+        for node in map_node.get_children():
+            name = node.name
+            with tracer.span('parse', node=name):
+                if name.isdigit() and int(name) < 8:
+                    values['layers'][int(name)] = freeze(self.parse_layer(node))
+                elif name in bundle_parsers:
+                    key, parse = bundle_parsers[name]
+                    values[key] = freeze(parse(self, node))
+
+        # Return
+        values['layers'] = tuple(values['layers'])
+        return MapBundle(map_id, **values)
 
     def get_info(self, map_id):
         """ Return info data for the map """
 
-        info = {}
-
         # Get info node
-        path = f'Map/Map{map_id[0:1]}/{map_id}.img/info'
-        info_node = self.file.resolve(path)
+        info_node = self.file.resolve(f'{self.get_map_path(map_id)}/info')
         if not info_node:
             return None
 
-        # Get values
-        info = self.get_values(info_node)
-
         # Return
-        return info
+        return self.parse_info(info_node)
+
+    def parse_info(self, info_node):
+        """ Return info data from the info node """
+        return self.get_values(info_node)
 
     def get_back(self, map_id):
         """ Return back data for the map """
 
-        back = []
-
         # Get back node
-        path = f'Map/Map{map_id[0:1]}/{map_id}.img/back'
-        back_node = self.file.resolve(path)
+        back_node = self.file.resolve(f'{self.get_map_path(map_id)}/back')
         if not back_node:
             return None
 
+        # Return
+        return self.parse_back(back_node)
+
+    def parse_back(self, back_node):
+        """ Return back data from the back node """
+
+        back = []
+
         # Get values
         for node in back_node.get_children():
             values = self.get_values(node)
@@ -93,14 +159,19 @@ class MapNx:
     def get_life(self, map_id):
         """ Return life data for the map """
 
-        life = []
-
         # Get life node
-        path = f'Map/Map{map_id[0:1]}/{map_id}.img/life'
-        life_node = self.file.resolve(path)
+        life_node = self.file.resolve(f'{self.get_map_path(map_id)}/life')
         if not life_node:
             return None
 
+        # Return
+        return self.parse_life(life_node)
+
+    def parse_life(self, life_node):
+        """ Return life data from the life node """
+
+        life = []
+
         # Get values
         for node in life_node.get_children():
             values = self.get_values(node)
@@ -113,14 +184,19 @@ class MapNx:
     def get_layer(self, map_id, index):
         """ Return layer data for the map """
 
-        layer = {}
-
         # Get layer node
-        path = f'Map/Map{map_id[0:1]}/{map_id}.img/{index}'
-        layer_node = self.file.resolve(path)
+        layer_node = self.file.resolve(f'{self.get_map_path(map_id)}/{index}')
         if not layer_node:
             return None
 
+        # Return
+        return self.parse_layer(layer_node)
+
+    def parse_layer(self, layer_node):
+        """ Return layer data from the layer node """
+
+        layer = {}
+
         # Get info for this layer
         info_node = layer_node.get_child('info')
         info = self.get_values(info_node)
@@ -148,14 +224,19 @@ class MapNx:
     def get_foothold(self, map_id):
         """ Return foothold data for the map """
 
-        foothold = {}
-
         # Get foothold node
-        path = f'Map/Map{map_id[0:1]}/{map_id}.img/foothold'
-        foothold_node = self.file.resolve(path)
+        foothold_node = self.file.resolve(f'{self.get_map_path(map_id)}/foothold')
         if not foothold_node:
             return None
 
+        # Return
+        return self.parse_foothold(foothold_node)
+
+    def parse_foothold(self, foothold_node):
+        """ Return foothold data from the foothold node """
+
+        foothold = {}
+
         # Get values
         for layer in foothold_node.get_children():
             for array in layer.get_children():
@@ -172,14 +253,19 @@ class MapNx:
     def get_ladder(self, map_id):
         """ Return ladder rope data for the map """
 
-        ladder = {}
-
         # Get ladderRope node
-        path = f'Map/Map{map_id[0:1]}/{map_id}.img/ladderRope'
-        ladder_node = self.file.resolve(path)
+        ladder_node = self.file.resolve(f'{self.get_map_path(map_id)}/ladderRope')
         if not ladder_node:
             return None
 
+        # Return
+        return self.parse_ladder(ladder_node)
+
+    def parse_ladder(self, ladder_node):
+        """ Return ladder rope data from the ladderRope node """
+
+        ladder = {}
+
         # Get values
         for node in ladder_node.get_children():
             values = self.get_values(node)
@@ -192,31 +278,34 @@ class MapNx:
     def get_seat(self, map_id):
         """ Return seat data for the map """
 
-        seat = {}
-
         # Get seat node
-        path = f'Map/Map{map_id[0:1]}/{map_id}.img/seat'
-        seat_node = self.file.resolve(path)
+        seat_node = self.file.resolve(f'{self.get_map_path(map_id)}/seat')
         if not seat_node:
             return None
 
-        # Get values
-        seat = self.get_values(seat_node)
-
         # Return
-        return seat
+        return self.parse_seat(seat_node)
+
+    def parse_seat(self, seat_node):
+        """ Return seat data from the seat node """
+        return self.get_values(seat_node)
 
     def get_minimap(self, map_id):
         """ Return mini map data for the map """
 
-        minimap = {}
-
         # Get miniMap node
-        path = f'Map/Map{map_id[0:1]}/{map_id}.img/miniMap'
-        minimap_node = self.file.resolve(path)
+        minimap_node = self.file.resolve(f'{self.get_map_path(map_id)}/miniMap')
         if not minimap_node:
             return None
 
+        # Return
+        return self.parse_minimap(minimap_node)
+
+    def parse_minimap(self, minimap_node):
+        """ Return mini map data from the miniMap node """
+
+        minimap = {}
+
         # Get values
         minimap = self.get_values(minimap_node)
         minimap['canvas_image'] = minimap_node['canvas'].get_image()
@@ -227,14 +316,19 @@ class MapNx:
     def get_portal(self, map_id):
         """ Return portal data for the map """
 
-        portal = []
-
         # Get portal node
-        path = f'Map/Map{map_id[0:1]}/{map_id}.img/portal'
-        portal_node = self.file.resolve(path)
+        portal_node = self.file.resolve(f'{self.get_map_path(map_id)}/portal')
         if not portal_node:
             return None
 
+        # Return
+        return self.parse_portal(portal_node)
+
+    def parse_portal(self, portal_node):
+        """ Return portal data from the portal node """
+
+        portal = []
+
         # Get values
         for node in portal_node.get_children():
             values = self.get_values(node)
@@ -243,3 +337,16 @@ class MapNx:
 
         # Return
         return portal
+
+
+# Map node child name: (bundle field, parser)
+bundle_parsers = {
+    'info': ('info', MapNx.parse_info),
+    'back': ('back', MapNx.parse_back),
+    'life': ('life', MapNx.parse_life),
+    'foothold': ('foothold', MapNx.parse_foothold),
+    'ladderRope': ('ladder', MapNx.parse_ladder),
+    'seat': ('seat', MapNx.parse_seat),
+    'miniMap': ('minimap', MapNx.parse_minimap),
+    'portal': ('portal', MapNx.parse_portal),
+}
@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+
+from maplepy.nx.resourcenx import sizeof_sprite
+from maplepy.nx.spritenx import collect_links, resource_manager
+
+
+def get_portal_targets(bundle):
+    """ Return the unique target map ids of a map's portals, in portal order """
+
+    # 999999999 is no target
+    targets = []
+    for value in bundle.get_portal_targets():
+        map_id = str(value).zfill(9)
+        if not map_id.isdigit() or map_id == '999999999' or map_id == bundle.map_id:
+            continue
+        if map_id not in targets:
+            targets.append(map_id)
+
+    return targets
+
+
+class PrefetcherNx:
+    """
+    Warms the caches with maps reachable through the portals of the current map.
+
+    Prefetching runs on a background thread after a map is loaded:
+        Load the map bundle of each portal target
+        Decode the sprites of that map into the resource cache
+
+    The work is limited by a cpu budget (fraction of time spent working)
+    and a memory budget (bytes of sprites added to the cache).
+    It is cancelled as soon as another map starts loading.
+    """
+
+    def __init__(self, display):
+
+        # Loads bundles through the display, so they are cached there
+        self.display = display
+
+        # Budgets
+        self.max_maps = 0
+        self.cpu_budget = 0.5
+        self.memory_budget = 0
+
+        # Background thread
+        self.thread = None
+        self.cancelled = threading.Event()
+
+    def set_budget(self, max_maps, cpu_budget, memory_budget):
+        """
+        Sets the prefetch limits
+
+        Args:
+            max_maps (int): maximum number of maps to prefetch, 0 disables prefetching
+            cpu_budget (float): fraction of time the thread may spend working (0, 1]
+            memory_budget (int): maximum bytes of sprites to add to the cache, 0 is unbounded
+        """
+
+        self.max_maps = max(0, int(max_maps or 0))
+        self.cpu_budget = min(1.0, max(0.01, float(cpu_budget or 1.0)))
+        self.memory_budget = max(0, int(memory_budget or 0))
+
+    def start(self, bundle):
+        """ Starts prefetching the portal targets of the map bundle """
+
+        # Stop any previous work
+        self.cancel()
+
+        # Check if prefetching is enabled
+        if not self.max_maps or not bundle:
+            return
+
+        map_ids = get_portal_targets(bundle)[:self.max_maps]
+        if not map_ids:
+            return
+
+        # Start background thread
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(map_ids, self.cancelled),
+                                       daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        """
+        Stops prefetching, does not wait for the thread
+
+        The thread stops after its current bundle, link or sprite,
+        loads it shares with the foreground are safe to run at the same time.
+        """
+
+        if self.thread:
+            self.cancelled.set()
+            self.thread = None
+
+    def run(self, map_ids, cancelled):
+        """ Prefetch maps until done, cancelled, or out of budget """
+
+        added = 0
+        sprites = resource_manager.sprites
+        file = self.display.map_nx.file
+
+        for map_id in map_ids:
+            try:
+
+                # Check if cancelled, between every stage
+                if cancelled.is_set():
+                    return
+
+                # Load bundle
+                bundle = self.display.get_bundle(map_id)
+                if not bundle or cancelled.is_set():
+                    continue
+
+                # Collect links, stops early when cancelled
+                links = collect_links(self.display.map_nx, bundle, cancelled)
+                if cancelled.is_set():
+                    return
+
+                # Decode sprites one at a time, so cancelling is quick
+                for link in links:
+
+                    # Check if cancelled
+                    if cancelled.is_set():
+                        return
+
+                    # Check memory budget, never push other sprites out of the cache
+                    if self.memory_budget and added >= self.memory_budget:
+                        return
+                    if sprites.budget and sprites.size >= sprites.budget:
+                        return
+
+                    # Decode
+                    if link in sprites:
+                        continue
+                    start = time.perf_counter()
+                    sprite = resource_manager.get_sprite(file, link)
+                    resource_manager.get_data(file, link)
+                    added += sizeof_sprite(sprite)
+                    elapsed = time.perf_counter() - start
+
+                    # Check cpu budget, rest in proportion to the work done
+                    if self.cpu_budget < 1.0:
+                        cancelled.wait(elapsed * (1.0 - self.cpu_budget) / self.cpu_budget)
+
+                logging.info(f'Prefetched {map_id}')
+
+            except:
+                logging.exception(f'Failed to prefetch {map_id}')
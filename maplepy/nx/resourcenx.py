@@ -1,15 +1,232 @@
 import logging
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 
+from maplepy.base.atlas import Atlas
 from maplepy.base.sprite import DataSprite
+from maplepy.helper.cache import LRUCache
+from maplepy.helper.tracer import tracer
+from maplepy.info.animation import Animation
+from maplepy.info.canvas import Canvas
+
+
+# Part of each budget given to each cache, together they stay within the budget
+SPRITE_BUDGET_SHARES = {'sprites': 0.5, 'atlases': 0.4, 'animations': 0.1}
+DATA_BUDGET_SHARES = {'data': 0.75, 'frames': 0.25}
+
+
+def split_budget(budget, share):
+    """ Returns the part of a budget in bytes given to one cache, 0 stays unbounded """
+    return max(1, int(budget * share)) if budget else 0
+
+
+def sizeof_sprite(sprite):
+    """ Returns the memory used by a sprite's surface in bytes, atlas regions are charged to their atlas """
+
+    if not sprite or not sprite.image or sprite.image.get_parent():
+        return 0
+
+    w, h = sprite.image.get_size()
+    return w * h * sprite.image.get_bytesize()
+
+
+def create_canvas(sprite, data, delay=None, f=None):
+    """ Create a canvas object from node data """
+
+    # Missing information
+    if not sprite or not data:
+        return None
+
+    # Extract basic information
+    w, h = sprite.image.get_size()
+    x = data['origin'][0] if 'origin' in data else 0
+    y = data['origin'][1] if 'origin' in data else 0
+    z = int(data['z']) if 'z' in data else None
+
+    # Create a canvas object
+    canvas = Canvas(sprite.image, w, h, x, y, z)
+
+    # Set delay
+    if delay:
+        canvas.set_delay(int(data['delay']) if 'delay' in data else delay)
+
+    # Adjustments
+    if f and f > 0:
+        canvas.flip()
+
+    # Set alpha
+    a0 = int(data['a0']) if 'a0' in data else 255
+    a1 = int(data['a1']) if 'a1' in data else 255
+    canvas.set_alpha(a0, a1)
+
+    return canvas
+
+
+def sizeof_animation(animation):
+    """ Returns the memory owned by an animation in bytes """
+    return animation.get_size() if animation else 0
+
+
+def sizeof_atlas(atlas):
+    """ Returns the memory used by an atlas' pages in bytes """
+    return atlas.get_size() if atlas else 0
+
+
+def sizeof_data(data):
+    """ Returns the approximate memory used by a node's values in bytes """
+
+    if not data:
+        return 0
+
+    return sys.getsizeof(data) + sum(sys.getsizeof(v) for v in data.values())
+
+
+def sizeof_frames(frames):
+    """ Returns the approximate memory used by a list of frame names in bytes """
+    return sys.getsizeof(frames) + sum(sys.getsizeof(v) for v in frames)
+
+
+def decode_sprite(file, key, timings=None):
+    """
+    Returns (width, height, data) of the node's image, or None if it is not a sprite
+
+    Runs on worker threads, which are not traced. The (name, start, end) of
+    the resolve and decode steps are appended to timings, to record them later.
+    A sprite that fails to decode is logged and skipped, like a missing sprite.
+    """
+
+    try:
+        start = time.perf_counter()
+        node = file.resolve(key)
+        image = node.get_image() if node else None
+        resolved = time.perf_counter()
+        if timings is not None:
+            timings.append(('resolve', start, resolved))
+        if not image:
+            return None
+
+        data = image.get_data()
+        if timings is not None:
+            timings.append(('decode', resolved, time.perf_counter()))
+
+        return image.width, image.height, data
+
+    except Exception:
+        logging.exception(f'Failed to decode {key}')
+        return None
 
 
 class ResourceNx():
-    """ Helper class to manage nx data. Load once, then store as cache """
+    """
+    Helper class to manage nx data. Load once, then store as cache
+
+    The caches are bounded by a memory budget and evict least recently used entries.
+    The sprite budget is split between sprites, atlases and animations,
+    the data budget between data and frames, so the total stays within each budget.
+    While pinning is enabled, every key that is accessed is pinned,
+    this keeps the resources of the current map from being evicted.
+
+    Safe to use from several threads. The caches are guarded by one lock,
+    which is only held to check and update them, never while loading.
+    Only one thread loads a key at a time (single-flight), other threads
+    requesting the same key wait for that load and share its result.
+    """
+
+    def __init__(self, sprite_budget=0, data_budget=0):
+
+        self.data = LRUCache(split_budget(data_budget, DATA_BUDGET_SHARES['data']), sizeof_data)
+        self.frames = LRUCache(split_budget(data_budget, DATA_BUDGET_SHARES['frames']), sizeof_frames)
+        self.sprites = LRUCache(split_budget(sprite_budget, SPRITE_BUDGET_SHARES['sprites']),
+                                sizeof_sprite)
+        self.pinning = False
+
+        # Canvases shared by every instance with the same frames
+        self.animations = LRUCache(split_budget(sprite_budget, SPRITE_BUDGET_SHARES['animations']),
+                                   sizeof_animation)
+
+        # Sprite sets packed into atlases, sprites in the set reference atlas regions
+        # Evicting an atlas evicts its sprites, so its pages are freed
+        self.atlases = LRUCache(split_budget(sprite_budget, SPRITE_BUDGET_SHARES['atlases']),
+                                sizeof_atlas, self.evict_atlas)
+
+        # Optional persistent cache of decoded sprites, with its own lock
+        self.disk = None
+        self.disk_lock = threading.Lock()
+
+        # Guards the caches, pins and loads in flight
+        self.lock = threading.Lock()
+
+        # (cache name, key): future of a load in flight
+        self.loading = {}
+
+    def set_budget(self, sprite_budget=None, data_budget=None):
+        """ Updates the cache budgets in bytes, each budget is split between its caches, 0 is unbounded """
+
+        with self.lock:
+            if sprite_budget is not None:
+                for name, share in SPRITE_BUDGET_SHARES.items():
+                    getattr(self, name).set_budget(split_budget(sprite_budget, share))
+            if data_budget is not None:
+                for name, share in DATA_BUDGET_SHARES.items():
+                    getattr(self, name).set_budget(split_budget(data_budget, share))
+
+    def set_disk_cache(self, disk):
+        """ Sets the persistent cache of decoded sprites, None to disable """
+
+        with self.disk_lock:
+            if self.disk:
+                self.disk.close()
+            self.disk = disk
+
+    def flush(self):
+        """ Writes pending changes of the persistent cache to disk """
 
-    def __init__(self):
+        with self.disk_lock:
+            if self.disk:
+                self.disk.flush()
 
-        self.data = {}
-        self.sprites = {}
+    def read_disk(self, key):
+        """ Returns (width, height, data) stored in the persistent cache, or None """
+
+        with self.disk_lock:
+            return self.disk.get(key) if self.disk else None
+
+    def write_disk(self, key, w, h, data):
+        """ Stores decoded pixel data in the persistent cache """
+
+        with self.disk_lock:
+            if self.disk:
+                self.disk.put(key, w, h, data)
+
+    def start_pinning(self):
+        """ Unpins previously pinned keys, then pins every key accessed from now on """
+
+        with self.lock:
+            self.pinning = True
+            self.sprites.unpin_all()
+            self.data.unpin_all()
+            self.frames.unpin_all()
+            self.atlases.unpin_all()
+            self.animations.unpin_all()
+
+    def stop_pinning(self):
+        """ Stops pinning accessed keys, already pinned keys stay pinned """
+        self.pinning = False
+
+    def stats(self):
+        """ Returns the counters of every cache and the number of loads in flight """
+
+        with self.lock:
+            return {
+                'sprites': self.sprites.stats(),
+                'data': self.data.stats(),
+                'frames': self.frames.stats(),
+                'atlases': self.atlases.stats(),
+                'animations': self.animations.stats(),
+                'loading': len(self.loading),
+            }
 
     def build_key(self, category, folder, subtype, name):
         """ Builds key from values """
@@ -19,12 +236,86 @@ class ResourceNx():
         # key = f'{category}/{folder}.img/{subtype}/{name}'
         return key
 
+    def evict_atlas(self, key, atlas):
+        """ Removes the sprites drawn from an evicted atlas, the lock is held while evicting """
+
+        for link in atlas.regions:
+            self.sprites.unpin(link)
+            self.sprites.remove(link)
+
+    def claim(self, name, key):
+        """
+        Registers a load in flight, the lock must be held
+
+        Returns:
+            None if this thread loads the key, otherwise the future of the load in flight
+        """
+
+        future = self.loading.get((name, key))
+        if future is None:
+            self.loading[(name, key)] = Future()
+        return future
+
+    def release(self, cache, name, key, value=None, error=None):
+        """ Stores the value of a claimed key, then wakes the threads waiting for it """
+
+        with self.lock:
+            if value is not None:
+                cache.put(key, value)
+            future = self.loading.pop((name, key))
+
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(value)
+
+    def get_or_load(self, cache, name, key, load):
+        """
+        Returns the cached value of a key, or loads and stores it
+
+        Args:
+            cache (LRUCache): cache of the value
+            name (str): name of the cache, prefix of the trace counters
+            key: key of the value
+            load (function): returns the value, None is returned but not stored
+        """
+
+        with self.lock:
+
+            # Pin for the current map
+            if self.pinning:
+                cache.pin(key)
+
+            # Check if value is already loaded, or being loaded by another thread
+            value = cache.get(key)
+            future = self.claim(name, key) if value is None else None
+
+        # Loaded
+        if value is not None:
+            tracer.count(f'{name}_hits')
+            return value
+
+        # Wait for the other thread
+        if future is not None:
+            tracer.count(f'{name}_waits')
+            return future.result()
+
+        # Load, then store
+        tracer.count(f'{name}_misses')
+        try:
+            value = load()
+        except BaseException as error:
+            self.release(cache, name, key, error=error)
+            raise
+        self.release(cache, name, key, value)
+        return value
+
     def get_data(self, file, key):
         """ Returns the node's values """
+        return self.get_or_load(self.data, 'data', key, lambda: self.load_data(file, key))
 
-        # Check if data is already loaded
-        if key in self.data:
-            return self.data[key]
+    def load_data(self, file, key):
+        """ Reads the node's values from nx """
 
         # Check if nx is loaded yet
         if not file:
@@ -33,27 +324,131 @@ class ResourceNx():
 
         data = {}
 
-        # Load from nx
-        node = file.resolve(key)
-        if not node:
-            logging.warning(f'{key} not found')
-            return None
+        with tracer.span('resolve', key=key):
 
-        # Parse into dictionary
-        for child in node.get_children():
-            if hasattr(child, 'value'):
-                data[child.name] = child.value
+            # Load from nx
+            node = file.resolve(key)
+            if not node:
+                logging.warning(f'{key} not found')
+                return None
+
+            # Parse into dictionary
+            for child in node.get_children():
+                if hasattr(child, 'value'):
+                    data[child.name] = child.value
 
-        # Store and return
-        self.data[key] = data
         return data
 
-    def get_sprite(self, file, key):
-        """ Returns the node's sprite """
+    def get_frames(self, file, key):
+        """ Returns the names of the node's numbered children, None if the node is not found """
+        return self.get_or_load(self.frames, 'frames', key, lambda: self.load_frames(file, key))
+
+    def load_frames(self, file, key):
+        """ Reads the names of the node's numbered children from nx """
+
+        # Check if nx is loaded yet
+        if not file:
+            logging.warning('Nx file is invalid')
+            return None
+
+        # Load from nx
+        with tracer.span('resolve', key=key):
+            node = file.resolve(key)
+            if not node:
+                return None
+            return [c for c in node.list_children() if c.isnumeric()]
+
+    def load_sprites(self, file, keys, workers=4):
+        """
+        Loads sprites that are not cached yet
+
+        Pixel data is decoded on a pool of worker threads,
+        sprite surfaces are created on the calling thread as results arrive.
+        Sprites already being loaded by another thread are waited for.
+        """
+
+        # Check if nx is loaded yet
+        if not file:
+            logging.warning('Nx file is invalid')
+            return
+
+        # Claim sprites that are not cached or loading
+        claimed = []
+        waiting = []
+        with self.lock:
+            for key in keys:
+                if self.pinning:
+                    self.sprites.pin(key)
+                if key in self.sprites:
+                    continue
+                future = self.claim('sprite', key)
+                if future is None:
+                    claimed.append(key)
+                else:
+                    waiting.append(future)
+        tracer.count('sprite_hits', len(keys) - len(claimed) - len(waiting))
+        tracer.count('sprite_waits', len(waiting))
+        tracer.count('sprite_misses', len(claimed))
+
+        # Stored sprites are loaded from disk
+        missing = []
+        remaining = list(claimed)
+        try:
+            for key in claimed:
+                stored = self.read_disk(key)
+                if stored:
+                    tracer.count('disk_hits')
+                    self.release(self.sprites, 'sprite', key, self.create_sprite(key, *stored))
+                    remaining.remove(key)
+                else:
+                    missing.append(key)
+
+            def decode(key):
+                timings = []
+                return decode_sprite(file, key, timings), timings
+
+            # Decode concurrently, worker times are recorded on this thread
+            with tracer.span('decode', sprites=len(missing)):
+                with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                    results = pool.map(decode, missing)
+                    for key, (result, timings) in zip(missing, results):
+                        for name, start, end in timings:
+                            tracer.record(name, start, end, key=key)
+                        sprite = None
+                        if result:
+                            tracer.count('bytes_decoded', len(result[2]))
+                            try:
+                                sprite = self.create_sprite(key, *result)
+                                self.write_disk(key, *result)
+                            except Exception:
+                                logging.exception(f'Failed to load {key}')
+                        self.release(self.sprites, 'sprite', key, sprite)
+                        remaining.remove(key)
 
-        # Check if sprite is already loaded
-        if key in self.sprites:
-            return self.sprites[key]
+        # Wake threads waiting for sprites that were not loaded
+        except BaseException as error:
+            for key in remaining:
+                self.release(self.sprites, 'sprite', key, error=error)
+            raise
+
+        # Sprites loaded by other threads
+        for future in waiting:
+            future.result()
+
+    def get_atlas(self, file, key, workers=1):
+        """
+        Packs every sprite of a set into an atlas,
+        cached sprites of the set are then drawn from the atlas pages.
+
+        A set is a node with groups of numbered frames:
+            Tile/{tS}.img               {u}/{no}
+            Obj/{oS}.img/{l0}/{l1}      {l2}/{index}
+        """
+        return self.get_or_load(self.atlases, 'atlas', key,
+                                lambda: self.load_atlas(file, key, workers))
+
+    def load_atlas(self, file, key, workers=1):
+        """ Decodes every sprite of a set, then packs them into an atlas """
 
         # Check if nx is loaded yet
         if not file:
@@ -66,21 +461,127 @@ class ResourceNx():
             logging.warning(f'{key} not found')
             return None
 
-        # Get image
-        image = node.get_image()
-        if not image:
-            logging.warning(f'{key} is not a sprite')
+        # Get every frame of the set
+        links = []
+        for group in node.get_children():
+            for frame in group.list_children():
+                if frame.isnumeric():
+                    links.append(f'{key}/{group.name}/{frame}')
+
+        # Decode, then pack
+        with tracer.span('atlas', key=key):
+            self.load_sprites(file, links, workers)
+            with self.lock:
+                sprites = {link: self.sprites[link] for link in links
+                           if link in self.sprites and self.sprites[link].image}
+            atlas = Atlas()
+            atlas.pack({link: sprite.image for link, sprite in sprites.items()})
+
+        # Sprites reference atlas regions instead of their own surfaces, stored again to charge them nothing
+        with self.lock:
+            for link, sprite in sprites.items():
+                sprite.image = atlas.get(link)
+                if link in self.sprites:
+                    self.sprites.put(link, sprite)
+
+        return atlas
+
+    def get_animation(self, file, links, delay=None, f=None):
+        """
+        Returns the shared animation of a list of frames
+
+        Canvases are created once for each (frames, delay, flipped),
+        every instance drawing the same frames references the same animation.
+        """
+
+        flipped = bool(f and f > 0)
+        key = (tuple(links), delay, flipped)
+        return self.get_or_load(self.animations, 'animation', key,
+                                lambda: self.load_animation(file, key, delay, f))
+
+    def load_animation(self, file, key, delay=None, f=None):
+        """ Creates the canvases of an animation """
+
+        # Build canvases
+        links, _, flipped = key
+        canvases = []
+        for link in links:
+
+            # Get data
+            sprite = self.get_sprite(file, link)
+            data = self.get_data(file, link)
+            canvas = create_canvas(sprite, data, delay=delay, f=f)
+
+            # Missing frame
+            if not canvas:
+                logging.warning(f'{link} is not a valid frame')
+                return None
+
+            canvases.append(canvas)
+
+        return Animation(key, canvases, flipped)
+
+    def get_sprite(self, file, key):
+        """ Returns the node's sprite """
+        return self.get_or_load(self.sprites, 'sprite', key, lambda: self.load_sprite(file, key))
+
+    def load_sprite(self, file, key):
+        """ Creates the node's sprite, from the persistent cache or decoded from nx """
+
+        # Check if sprite was decoded in a previous run
+        stored = self.read_disk(key)
+        if stored:
+            tracer.count('disk_hits')
+            return self.create_sprite(key, *stored)
+
+        # Check if nx is loaded yet
+        if not file:
+            logging.warning('Nx file is invalid')
             return None
 
-        return self.cache_sprite(key, image)
+        with tracer.span('resolve', key=key):
+
+            # Get node
+            node = file.resolve(key)
+            if not node:
+                logging.warning(f'{key} not found')
+                return None
+
+            # Get image
+            image = node.get_image()
+            if not image:
+                logging.warning(f'{key} is not a sprite')
+                return None
+
+        # Decode and store for the next run
+        with tracer.span('decode', key=key):
+            data = image.get_data()
+            tracer.count('bytes_decoded', len(data))
+        self.write_disk(key, image.width, image.height, data)
+
+        return self.create_sprite(key, image.width, image.height, data)
 
     def cache_sprite(self, key, image):
         """ Loads data into a sprite object, then stores it in the cache """
+        return self.store_sprite(key, image.width, image.height, image.get_data())
+
+    def create_sprite(self, key, w, h, data):
+        """ Loads pixel data into a sprite object """
 
         # Load as nx sprite
-        sprite = DataSprite()
-        sprite.load(image.width, image.height, image.get_data())
+        with tracer.span('convert', key=key):
+            sprite = DataSprite()
+            sprite.load(w, h, data)
+        return sprite
+
+    def store_sprite(self, key, w, h, data):
+        """ Loads pixel data into a sprite object, then stores it in the cache """
+
+        sprite = self.create_sprite(key, w, h, data)
 
         # Store and return
-        self.sprites[key] = sprite
+        with self.lock:
+            if self.pinning:
+                self.sprites.pin(key)
+            self.sprites.put(key, sprite)
         return sprite
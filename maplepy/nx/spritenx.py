@@ -1,45 +1,102 @@
 import logging
 
-import pygame
+from maplepy.base.grid import SpatialGrid
 from maplepy.base.sprite import BackgroundSprites, LayeredSprites
+from maplepy.helper.tracer import tracer
 from maplepy.info.canvas import Canvas
 from maplepy.info.instance import Instance
-from maplepy.nx.resourcenx import ResourceNx
+from maplepy.nx.resourcenx import ResourceNx, create_canvas
 
 # Create a single resource manager
 resource_manager = ResourceNx()
 
+# Hard code some known portal stuff here
+portal_game = {2: 'pv', 7: 'pv', 10: 'ph'}
 
-def create_canvas(sprite, data, delay=None, f=None):
-    """ Create a canvas object from node data """
 
-    # Missing information
-    if not sprite or not data:
-        return None
+def get_tile_links(tS, u, no):
+    """ Return the sprite links of a tile """
+    return [f'Tile/{tS}.img/{u}/{no}']
 
-    # Extract basic information
-    w, h = sprite.image.get_size()
-    x = data['origin'][0] if 'origin' in data else 0
-    y = data['origin'][1] if 'origin' in data else 0
-    z = int(data['z']) if 'z' in data else None
 
-    # Create a canvas object
-    canvas = Canvas(sprite.image, w, h, x, y, z)
+def get_object_links(file, oS, l0, l1, l2):
+    """ Return the sprite links of an object's frames """
 
-    # Set delay
-    if delay:
-        canvas.set_delay(int(data['delay']) if 'delay' in data else delay)
+    key = f'Obj/{oS}.img/{l0}/{l1}/{l2}'
+    frames = resource_manager.get_frames(file, key) or []
+    return [f'{key}/{index}' for index in frames]
 
-    # Adjustments
-    if f and f > 0:
-        canvas.flip()
 
-    # Set alpha
-    a0 = int(data['a0']) if 'a0' in data else 255
-    a1 = int(data['a1']) if 'a1' in data else 255
-    canvas.set_alpha(a0, a1)
+def get_background_links(file, bS, no, ani):
+    """ Return the sprite links of a background, animated backgrounds have multiple frames """
 
-    return canvas
+    subtype = 'ani' if ani else 'back'
+    key = f'Back/{bS}.img/{subtype}/{no}'
+    frames = resource_manager.get_frames(file, key)
+
+    # Node not found
+    if frames is None:
+        return []
+
+    return [f'{key}/{index}' for index in frames] if ani else [key]
+
+
+def get_portal_links(file, pt, pS):
+    """ Return the sprite links of a portal's frames """
+
+    # For now, only deal with in game portals
+    if pt in portal_game.keys():
+        pt = portal_game[pt]
+        pS = pS if pt == 'pv' else 'default/portalContinue'
+    else:
+        return []
+
+    key = f'MapHelper.img/portal/game/{pt}/{pS}'
+    frames = resource_manager.get_frames(file, key) or []
+    return [f'{key}/{index}' for index in frames]
+
+
+def iter_links(file, bundle):
+    """ Yield the sprite links of each background, tile, object and portal of a map bundle or compiled map """
+
+    for bS, no, ani in bundle.get_background_keys():
+        yield get_background_links(file, bS, no, ani)
+    for tS, u, no in bundle.get_tile_keys():
+        yield get_tile_links(tS, u, no)
+    for oS, l0, l1, l2 in bundle.get_object_keys():
+        yield get_object_links(file, oS, l0, l1, l2)
+    for pt, pS in bundle.get_portal_keys():
+        yield get_portal_links(file, pt, pS)
+
+
+def collect_links(map_nx, bundle, cancelled=None):
+    """
+    Return the unique sprite links used by a map bundle or compiled map
+
+    Returns an empty list as soon as the cancelled event is set.
+    """
+
+    links = []
+    for values in iter_links(map_nx.file, bundle):
+        if cancelled and cancelled.is_set():
+            return []
+        links += values
+
+    # Unique, in order of first use
+    return list(dict.fromkeys(links))
+
+
+def collect_atlas_keys(bundle, tiles=True, objects=False):
+    """ Return the unique tile sets and object sets used by a map bundle or compiled map """
+
+    keys = []
+    if tiles:
+        keys += [f'Tile/{tS}.img' for tS, _, _ in bundle.get_tile_keys()]
+    if objects:
+        keys += [f'Obj/{oS}.img/{l0}/{l1}' for oS, l0, l1, _ in bundle.get_object_keys()]
+
+    # Unique, in order of first use
+    return list(dict.fromkeys(keys))
 
 
 class BackgroundSpritesNx(BackgroundSprites):
@@ -50,70 +107,49 @@ class BackgroundSpritesNx(BackgroundSprites):
         # Create sprites
         super().__init__()
 
-    def load_background(self, map_nx, map_id):
+    def load_background(self, map_nx, bundle):
 
-        # Load back sprites
-        values = map_nx.get_back(map_id)
-        if not values:
+        # Check back data
+        instances = bundle.get_backgrounds()
+        if not instances:
             logging.warning('Background data not found')
             return
 
         # Go through instances list and add
-        for val in values:
+        for inst in instances:
             try:
-
-                # Extract properties
-                inst = Instance()
-                for k, v in val.items():
-                    setattr(inst, k, v)
-
-                # Get node
-                subtype = 'ani' if inst.ani else 'back'
-                key = f'Back/{inst.bS}.img/{subtype}/{inst.no}'
-                node = map_nx.file.resolve(key)
-
-                # Node not found
-                if not node:
-                    continue
-
-                # Get children
-                # count = node.child_count if node and inst.ani else 1
-                if inst.ani:
-                    indexes = [c for c in node.list_children()
-                               if c.isnumeric()]
-                else:
-                    indexes = ['0']
-
-                # Build canvases
-                for index in indexes:  # range(count):
-
-                    # Get data
-                    link = f'{key}/{index}' if inst.ani else key
-                    sprite = resource_manager.get_sprite(map_nx.file, link)
-                    data = resource_manager.get_data(map_nx.file, link)
-                    canvas = create_canvas(sprite, data, delay=120, f=inst.f)
-
-                    # Add to object
-                    inst.add_canvas(canvas)
-
-                    # Check cx, cy
-                    if not inst.cx:
-                        inst.cx = canvas.width
-                    if not inst.cy:
-                        inst.cy = canvas.height
-
-                # Explicit special case
-                if inst.name and inst.name.isdigit():
-                    inst.update_layer(int(inst.name))
-
-                # Add to list
-                if inst.canvas_list:
-                    self.sprites.add(inst)
-
+                self.add_background(map_nx, inst)
             except:
                 logging.exception('Failed to load background')
                 continue
 
+    def add_background(self, map_nx, inst):
+        """ Build canvases for a background instance, then add it """
+
+        # Get links, node might not be found
+        links = get_background_links(map_nx.file, inst.bS, inst.no, inst.ani)
+        if not links:
+            return
+
+        # Get shared canvases
+        animation = resource_manager.get_animation(map_nx.file, links, delay=120, f=inst.f)
+        if not animation:
+            return
+
+        # Add to object
+        inst.set_animation(animation)
+
+        # Check cx, cy
+        canvas = animation.canvases[0]
+        if not inst.cx:
+            inst.cx = canvas.width
+        if not inst.cy:
+            inst.cy = canvas.height
+
+        # Add to list
+        if inst.canvas_list:
+            self.sprites.add(inst)
+
 
 class LayeredSpritesNx(LayeredSprites):
     """
@@ -128,6 +164,7 @@ class LayeredSpritesNx(LayeredSprites):
     def load_minimap(self, info, val):
 
         # Translate
+        val = dict(val)
         val['x'] = 0
         val['y'] = 0
 
@@ -152,178 +189,152 @@ class LayeredSpritesNx(LayeredSprites):
         if inst.canvas_list:
             self.sprites.add(inst)
 
-    def load_layer(self, map_nx, map_id, layer):
-
-        # Load current layer
-        values = map_nx.get_layer(map_id, layer)
-        if not values:
-            logging.warning('Layer data not found')
-            return
-
-        # Get info
-        info = values['info']
+    def load_layer(self, map_nx, bundle, layer):
 
         # Go through instances list and add
-        for val in values['tile']:
+        for inst in bundle.get_tiles(layer):
             try:
-
-                # Make sure there's tile information
-                if 'tS' not in info:
-                    logging.warning('Tile data not found')
-                    break
-
-                # Extract properties
-                inst = Instance()
-                inst.tS = info['tS']
-                for k, v in val.items():
-                    setattr(inst, k, v)
-
-                # Get data
-                link = f'Tile/{inst.tS}.img/{inst.u}/{inst.no}'
-                sprite = resource_manager.get_sprite(map_nx.file, link)
-                data = resource_manager.get_data(map_nx.file, link)
-                canvas = create_canvas(sprite, data)
-
-                # Add to object
-                inst.add_canvas(canvas)
-
-                # Explicit special case
-                if inst.name and inst.name.isdigit():
-                    inst.update_layer(int(inst.name))
-
-                # Add to list
-                if inst.canvas_list:
-                    self.sprites.add(inst)
-
+                self.add_tile(map_nx, inst)
             except:
                 logging.exception('Failed to load tile')
                 continue
 
         # Fix overlapping tiles
-        self.fix_overlapping_sprites()
+        with tracer.span('overlap'):
+            self.fix_overlapping_sprites()
 
         # Go through instances list and add
-        for val in values['obj']:
+        for inst in bundle.get_objects(layer):
             try:
+                self.add_object(map_nx, inst)
+            except:
+                logging.exception('Failed to load object')
+                continue
 
-                # Extract properties
-                inst = Instance()
-                for k, v in val.items():
-                    setattr(inst, k, v)
-
-                # Get node
-                key = f'Obj/{inst.oS}.img/{inst.l0}/{inst.l1}/{inst.l2}'
-                node = map_nx.file.resolve(key)
+    def add_tile(self, map_nx, inst):
+        """ Build the canvas for a tile instance, then add it """
 
-                # Node not found
-                if not node:
-                    continue
+        # Get shared canvas
+        links = get_tile_links(inst.tS, inst.u, inst.no)
+        animation = resource_manager.get_animation(map_nx.file, links)
+        if not animation:
+            return
 
-                # Get children
-                indexes = [c for c in node.list_children() if c.isnumeric()]
+        # Add to object
+        inst.set_animation(animation)
 
-                # Build canvases
-                for index in indexes:  # range(node.child_count):
+        # Add to list
+        if inst.canvas_list:
+            self.sprites.add(inst)
 
-                    # Get data
-                    link = f'{key}/{index}'
-                    sprite = resource_manager.get_sprite(map_nx.file, link)
-                    data = resource_manager.get_data(map_nx.file, link)
-                    canvas = create_canvas(sprite, data, delay=120, f=inst.f)
+    def add_object(self, map_nx, inst):
+        """ Build canvases for an object instance, then add it """
 
-                    # Add to object
-                    inst.add_canvas(canvas)
+        # Get links, node might not be found
+        links = get_object_links(map_nx.file, inst.oS, inst.l0, inst.l1, inst.l2)
+        if not links:
+            return
 
-                # Explicit special case
-                if 'z' in val:
-                    inst.update_layer(int(val['z']))
-                else:
-                    inst.update_layer(inst.zM)
+        # Get shared canvases
+        animation = resource_manager.get_animation(map_nx.file, links, delay=120, f=inst.f)
+        if not animation:
+            return
 
-                # Add to list
-                if inst.canvas_list:
-                    self.sprites.add(inst)
+        # Add to object
+        inst.set_animation(animation)
 
-            except:
-                logging.exception('Failed to load object')
-                continue
+        # Add to list
+        if inst.canvas_list:
+            self.sprites.add(inst)
 
-    def load_portal(self, map_nx, map_id):
+    def load_portal(self, map_nx, bundle):
 
-        # Load portal list
-        values = map_nx.get_portal(map_id)
-        if not values:
+        # Check portal data
+        instances = bundle.get_portals()
+        if not instances:
             logging.warning('Portal data not found')
             return
 
-        # Hard code some known portal stuff here
-        portal_game = {2: 'pv', 7: 'pv', 10: 'ph'}
-
         # Go through portal list and add
-        for val in values:
+        for inst in instances:
             try:
+                self.add_portal(map_nx, inst)
+            except:
+                logging.exception('Failed to load portal')
+                continue
 
-                # Special case
-                val['pS'] = val.pop('image') if 'image' in val else 'default'
-
-                # Extract properties
-                inst = Instance()
-                for k, v in val.items():
-                    setattr(inst, k, v)
+    def add_portal(self, map_nx, inst):
+        """ Build canvases for a portal instance, then add it """
 
-                # For now, only deal with in game portals
-                if inst.pt in portal_game.keys():
-                    pt = portal_game[inst.pt]
-                    pS = inst.pS if pt == 'pv' else 'default/portalContinue'
-                else:
-                    continue
+        # Get links, only in game portals have links
+        links = get_portal_links(map_nx.file, inst.pt, inst.pS)
+        if not links:
+            return
 
-                # Get node
-                key = f'MapHelper.img/portal/game/{pt}/{pS}'
-                node = map_nx.file.resolve(key)
+        # Get shared canvases
+        animation = resource_manager.get_animation(map_nx.file, links, delay=100)
+        if not animation:
+            return
 
-                # Node not found
-                if not node:
-                    continue
+        # Add to object
+        inst.set_animation(animation)
 
-                # Get children
-                indexes = [c for c in node.list_children() if c.isnumeric()]
+        # Add to list
+        if inst.canvas_list:
+            self.sprites.add(inst)
 
-                # Build canvases
-                for index in indexes:  # range(node.child_count):
+    def fix_overlapping_sprites(self):
+        """
+        Fix z issues with overlapping tiles and objects
 
-                    # Get data
-                    link = f'{key}/{index}'
-                    sprite = resource_manager.get_sprite(map_nx.file, link)
-                    data = resource_manager.get_data(map_nx.file, link)
-                    canvas = create_canvas(sprite, data, delay=100)
+        Each sprite with a z is moved one layer above the last sprite in draw order
+        that it overlaps and has a lower z. Sprites are visited in their initial order,
+        a moved sprite goes to the end of its new layer.
 
-                    # Add to object
-                    inst.add_canvas(canvas)
+        Draw order is tracked as (layer, sequence) and overlaps are found with a grid,
+        then the draw list is rebuilt once in the final order.
+        """
 
-                # Add to list
-                if inst.canvas_list:
-                    self.sprites.add(inst)
+        sprites = self.sprites.sprites()
+        if not sprites:
+            return
 
-            except:
-                logging.exception('Failed to load portal')
-                continue
+        # Draw order of each sprite
+        keys = [(sprite._layer, index) for index, sprite in enumerate(sprites)]
+        sequence = len(sprites)
 
-    def fix_overlapping_sprites(self):
-        """ Fix z issues with overlapping tiles and objects """
+        # Only sprites with a z take part
+        z = [sprite.canvas_list[0].z for sprite in sprites]
+        grid = SpatialGrid()
+        for index, sprite in enumerate(sprites):
+            if z[index]:
+                grid.insert(index, sprite.rect)
 
-        for sprite in self.sprites:
+        # Visit in initial order
+        for index, sprite in enumerate(sprites):
 
             # Check if z exists
-            if not sprite.canvas_list[0].z:
+            if not z[index]:
                 continue
 
-            # Collision check
-            for collision in pygame.sprite.spritecollide(sprite, self.sprites, False):
-
-                # Check if z exists
-                if not collision.canvas_list[0].z:
-                    continue
-
-                if sprite.canvas_list[0].z > collision.canvas_list[0].z:
-                    self.sprites.change_layer(sprite, collision._layer+1)
+            # Last overlapping sprite with a lower z
+            below = None
+            for other in grid.query(sprite.rect):
+                if z[index] > z[other] and sprite.rect.colliderect(sprites[other].rect):
+                    if below is None or keys[other] > keys[below]:
+                        below = other
+
+            # Move to the end of the layer above it
+            if below is not None:
+                keys[index] = (keys[below][0] + 1, sequence)
+                sequence += 1
+
+        # Rebuild draw list in the final order
+        order = sorted(range(len(sprites)), key=keys.__getitem__)
+        for index in order:
+            sprites[index].update_layer(keys[index][0])
+        self.sprites.empty()
+        self.sprites.add(*[sprites[index] for index in order])
+
+        # Draw order changed
+        self.invalidate_index()
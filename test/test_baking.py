@@ -0,0 +1,109 @@
+import os
+import random
+
+import numpy as np
+import pygame
+import pytest
+from maplepy.base import baking
+from maplepy.base.baking import BakedLayer, sizeof_chunk
+from maplepy.base.sprite import LayeredSprites
+from maplepy.helper.cache import LRUCache
+from maplepy.info.canvas import Canvas
+from maplepy.info.instance import Instance
+
+CHUNK_SIZE = 64
+
+# Premultiplied compositing rounds differently than drawing one sprite at a time
+TOLERANCE = 4
+
+
+def create_image(rng, w, h, alpha):
+    """
+    Image with a transparent hole, some have a translucent edge like antialiased tiles
+
+    Some images are regions of a larger surface, like sprites packed into an atlas.
+    """
+
+    x, y = rng.choice([(0, 0), (37, 5)])
+    parent = pygame.Surface((w + x, h + y), pygame.SRCALPHA)
+    parent.fill((255, 0, 0, 255))
+    image = parent.subsurface((x, y, w, h)) if x else parent
+
+    image.fill((rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255), alpha))
+    image.fill((0, 0, 0, 0), (w // 4, h // 4, w // 2, h // 2))
+    if rng.random() < 0.5:
+        image.fill(image.get_at((0, 0))[:3] + (alpha // 2,), (0, 0, w, 2))
+    return image
+
+
+def create_layer(seed, count):
+    """ Static and animated sprites on several z levels, crossing chunk boundaries """
+
+    rng = random.Random(seed)
+    layer = LayeredSprites()
+    for _ in range(count):
+        inst = Instance()
+        inst.x, inst.y = rng.randint(-100, 100), rng.randint(-100, 100)
+
+        # Static and animated sprites may be translucent
+        frames = rng.choice([1, 1, 2, 3])
+        w, h = rng.randint(8, 48), rng.randint(8, 48)
+        for _ in range(frames):
+            alpha = rng.choice([64, 128, 255])
+            canvas = Canvas(create_image(rng, w, h, alpha), w, h,
+                            rng.randint(0, w), rng.randint(0, h))
+            canvas.set_delay(rng.choice([30, 60, 120]))
+            inst.add_canvas(canvas)
+
+        inst.update_layer(rng.randint(0, 3))
+        layer.sprites.add(inst)
+
+    return layer
+
+
+@pytest.mark.parametrize('premultiplied', [True, False])
+@pytest.mark.parametrize('seed', range(3))
+def test_baked_layer_matches_sprites(seed, premultiplied, monkeypatch):
+
+    # Without premultiplied alpha, translucent sprites are drawn one at a time
+    if premultiplied and not baking.PREMULTIPLIED:
+        pytest.skip('pygame has no premultiplied alpha')
+    monkeypatch.setattr(baking, 'PREMULTIPLIED', premultiplied)
+    tolerance = TOLERANCE if premultiplied else 0
+
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+
+    # Same sprites, created twice so animations are independent
+    expected = create_layer(seed, 120)
+    baked = create_layer(seed, 120)
+    cache = LRUCache(0, sizeof_chunk)
+    baked.set_baked(BakedLayer(baked.sprites.sprites(), cache, 0, CHUNK_SIZE))
+
+    # Views inside a chunk, on a chunk corner, and over the whole layer
+    views = [
+        pygame.Rect(5, 5, 50, 50),
+        pygame.Rect(CHUNK_SIZE - 30, -30, 60, 60),
+        pygame.Rect(-160, -160, 320, 320),
+    ]
+
+    for frame in range(8):
+        expected.update()
+        baked.update()
+        for view in views:
+            surfaces = []
+            for layer in [expected, baked]:
+                surface = pygame.Surface(view.size)
+                surface.fill((30, 60, 90))
+                layer.blit(surface, view)
+                surfaces.append(np.frombuffer(pygame.image.tobytes(surface, 'RGB'), np.uint8))
+            difference = np.abs(surfaces[0].astype(int) - surfaces[1]).max()
+            assert difference <= tolerance, f'frame {frame} view {view}'
+
+    # Static sprites above animated ones needed more than one level
+    assert len(baked.baked.static) > 1
+
+    # Chunks were rendered and reused
+    stats = cache.stats()
+    assert stats['count'] and stats['hits']
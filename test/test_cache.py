@@ -0,0 +1,86 @@
+import logging
+
+from maplepy.helper.cache import LRUCache
+
+
+def test_lru_eviction():
+
+    cache = LRUCache(10, lambda value: value)
+    cache.put('a', 4)
+    cache.put('b', 4)
+    cache.get('a')
+    cache.put('c', 4)
+
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert 'c' in cache
+    assert cache.size == 8
+    assert cache.stats()['evictions'] == 1
+
+
+def test_lru_pinning():
+
+    cache = LRUCache(10, lambda value: value)
+    cache.pin('a')
+    cache.put('a', 8)
+    cache.put('b', 8)
+
+    assert 'a' in cache
+    assert 'b' not in cache
+
+    cache.unpin_all()
+    cache.put('c', 8)
+
+    assert 'a' not in cache
+    assert 'c' in cache
+
+
+def test_lru_pinned_over_budget(caplog):
+
+    cache = LRUCache(10, lambda value: value)
+    with caplog.at_level(logging.WARNING):
+        for key in 'abc':
+            cache.pin(key)
+            cache.put(key, 6)
+
+        # Only unpinned entries are evicted, the scan stops once none remain
+        for key in 'de':
+            cache.put(key, 1)
+    assert len(cache) == 3
+    assert cache.size == 18
+    assert not cache.unpinned
+    assert cache.stats()['evictions'] == 2
+
+    # Logged once while the pinned entries stay over budget
+    assert len(caplog.records) == 1
+
+    # Unpinned entries are evicted oldest first
+    cache.unpin('b')
+    cache.unpin('a')
+    cache.set_budget(12)
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert 'c' in cache
+
+
+
+
+    cache = LRUCache()
+    cache.put('a', 1)
+    cache.get('a')
+    cache.get('b')
+
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['evictions'] == 0
+
+
+def test_lru_on_evict():
+
+    evicted = []
+    cache = LRUCache(10, lambda value: value, lambda key, value: evicted.append((key, value)))
+    cache.put('a', 6)
+    cache.put('b', 6)
+
+    assert evicted == [('a', 6)]
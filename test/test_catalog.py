@@ -0,0 +1,80 @@
+from types import SimpleNamespace
+
+from maplepy.nx.parser.bundlenx import MapBundle, freeze
+from maplepy.nx.parser.catalognx import MapCatalog
+
+
+def create_bundle(map_id, tS, oS, tm):
+
+    layer = {
+        'info': {'tS': tS},
+        'tile': [{'x': 0, 'y': 0, 'u': 'bsc', 'no': 0}] * 3,
+        'obj': [{'x': 0, 'y': 0, 'oS': oS, 'l0': 'a', 'l1': 'b', 'l2': '0'}],
+    }
+
+    return MapBundle(
+        map_id=map_id,
+        info=freeze({'bgm': f'Bgm00/{map_id}', 'VRLeft': -10, 'VRTop': -20, 'VRRight': 30, 'VRBottom': 40}),
+        layers=freeze([layer] + [None] * 7),
+        portal=freeze([{'pt': 2, 'tm': tm}, {'pt': 0, 'tm': 999999999}]),
+        minimap=freeze({'width': 100, 'height': 50}),
+    )
+
+
+def create_map_nx():
+
+    bundles = {
+        '000010000': create_bundle('000010000', 'grassySoil', 'acc1', 100000000),
+        '100000000': create_bundle('100000000', 'woodMarble', 'acc1', 10000),
+    }
+    return SimpleNamespace(
+        owners={'000010000': 'map.nx', '100000000': 'map001.nx'},
+        get_identity=lambda: 'map.nx:1:2',
+        load_bundle=bundles.get,
+    )
+
+
+def test_catalog_build():
+
+    catalog = MapCatalog.build(create_map_nx())
+
+    assert len(catalog) == 2
+    assert '000010000' in catalog
+    assert catalog.identity == 'map.nx:1:2'
+    assert catalog.get('000010000') == {
+        'file': 'map.nx',
+        'bgm': 'Bgm00/000010000',
+        'vr': [-10, -20, 30, 40],
+        'minimap': [100, 50],
+        'layers': 1,
+        'tiles': 3,
+        'objects': 1,
+        'tilesets': ['grassySoil'],
+        'objectsets': ['acc1'],
+        'portals': ['100000000'],
+    }
+
+
+def test_catalog_save_load(tmp_path):
+
+    path = tmp_path / 'catalog' / 'maps.json'
+    MapCatalog.build(create_map_nx()).save(path)
+
+    # Loaded only for the same map files
+    catalog = MapCatalog.load(path, 'map.nx:1:2')
+    assert catalog.ids() == ['000010000', '100000000']
+    assert catalog.get('100000000')['file'] == 'map001.nx'
+    assert MapCatalog.load(path, 'map.nx:1:3') is None
+    assert MapCatalog.load(tmp_path / 'missing.json', 'map.nx:1:2') is None
+
+
+def test_catalog_query():
+
+    catalog = MapCatalog.build(create_map_nx())
+
+    assert catalog.query() == ['000010000', '100000000']
+    assert catalog.query(tileset='woodMarble') == ['100000000']
+    assert catalog.query(objectset='acc1', file='map.nx') == ['000010000']
+    assert catalog.query(portal='000010000') == ['100000000']
+    assert catalog.query(min_tiles=3) == []
+    assert catalog.query(predicate=lambda map_id, meta: map_id.startswith('1')) == ['100000000']
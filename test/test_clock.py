@@ -0,0 +1,48 @@
+import random
+
+import pygame
+from maplepy.base.clock import AnimationClock
+from maplepy.info.canvas import Canvas
+from maplepy.info.instance import Instance
+
+
+def create_instances(seed, count):
+
+    rng = random.Random(seed)
+    instances = []
+    for _ in range(count):
+        inst = Instance()
+        inst.x, inst.y = rng.randint(-500, 500), rng.randint(-500, 500)
+
+        # Frames with their own images, so alpha is not shared
+        for _ in range(rng.randint(1, 4)):
+            image = pygame.Surface((rng.randint(1, 40), rng.randint(1, 40)), pygame.SRCALPHA)
+            canvas = Canvas(image, *image.get_size())
+            canvas.set_delay(rng.choice([0, 30, 100, 120, 250]))
+            canvas.set_alpha(rng.choice([0, 128, 255]), rng.choice([0, 200, 255]))
+            inst.add_canvas(canvas)
+
+        # Backgrounds
+        inst.type = rng.choice([None, 0, 4, 5, 6, 7])
+        inst.rx, inst.ry = rng.randint(-10, 10), rng.randint(-10, 10)
+        inst.cx, inst.cy = rng.randint(0, 300), rng.randint(0, 300)
+        instances.append(inst)
+
+    return instances
+
+
+def get_state(inst):
+    return (inst.canvas_list_index, inst.rect, inst.image.get_alpha(), inst.dx, inst.dy)
+
+
+def test_animation_clock():
+
+    expected = create_instances(0, 200)
+    instances = create_instances(0, 200)
+    clock = AnimationClock(instances)
+
+    for _ in range(100):
+        for inst in expected:
+            inst.update()
+        clock.tick()
+        assert [get_state(inst) for inst in expected] == [get_state(inst) for inst in instances]
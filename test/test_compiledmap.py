@@ -0,0 +1,116 @@
+from types import SimpleNamespace
+
+from maplepy.nx.parser.bundlenx import MapBundle, freeze
+from maplepy.nx.parser.compiledmapnx import CompiledMap
+
+
+def create_bundle():
+
+    layer = {
+        'info': {'tS': 'grassySoil'},
+        'tile': [
+            {'x': 0, 'y': 10, 'u': 'bsc', 'no': 0, 'zM': 1, 'name': '0'},
+            {'x': 90, 'y': -10, 'u': 'enH0', 'no': 2, 'zM': 1, 'name': '1'},
+        ],
+        'obj': [
+            {'x': -5, 'y': 5, 'z': 3, 'zM': 0, 'f': 1, 'oS': 'acc1',
+             'l0': 'grassySoil', 'l1': 'nature', 'l2': '0', 'name': '0'},
+        ],
+    }
+
+    return SimpleNamespace(
+        map_id='000010000',
+        info={'bgm': 'Bgm00/Sleepywood', 'VRTop': -600},
+        minimap={'centerX': 10, 'centerY': 20, 'width': 100, 'height': 50, 'canvas_image': object()},
+        foothold={'0/0': [{'x1': 0, 'y1': 5, 'x2': 10, 'y2': 5}]},
+        layers=(None, layer) + (None,) * 6,
+        back=[{'bS': 'grassySoil_new', 'no': 0, 'ani': 0, 'type': 3, 'cx': 0, 'rx': -5, 'name': '2'}],
+        portal=[{'pt': 2, 'tm': 100000000, 'pn': 'sp', 'tn': '', 'x': 1, 'y': 2, 'name': '0'}],
+    )
+
+
+def test_compiled_map_roundtrip(tmp_path):
+
+    compiled = CompiledMap.from_bundle(create_bundle(), 'map.nx:1:2')
+    compiled.save(tmp_path / '000010000.map')
+    loaded = CompiledMap.load(tmp_path / '000010000.map')
+
+    assert loaded.map_id == '000010000'
+    assert loaded.identity == 'map.nx:1:2'
+    assert loaded.info['bgm'] == 'Bgm00/Sleepywood'
+    assert 'canvas_image' not in loaded.minimap
+    assert loaded.foothold == {'bounds': [{'x1': 0, 'y1': 5, 'x2': 10, 'y2': 5}]}
+
+    # Tiles
+    assert loaded.get_layer_range(loaded.tile, 0) == (0, 0)
+    assert loaded.get_layer_range(loaded.tile, 1) == (0, 2)
+    assert list(loaded.tile['x']) == [0, 90]
+    assert [loaded.strings[i] for i in loaded.tile['u']] == ['bsc', 'enH0']
+    assert [loaded.strings[i] for i in loaded.tile['no']] == ['0', '2']
+    assert list(loaded.tile['order']) == [0, 1]
+
+    # Objects
+    assert list(loaded.obj['z']) == [3]
+    assert list(loaded.obj['f']) == [1]
+    assert loaded.strings[loaded.obj['l1'][0]] == 'nature'
+
+    # Backgrounds and portals
+    assert list(loaded.back['rx']) == [-5]
+    assert list(loaded.back['order']) == [2]
+    assert loaded.strings[loaded.portal['pS'][0]] == 'default'
+    assert list(loaded.portal['tm']) == [100000000]
+
+
+def test_compiled_map_truncated(tmp_path):
+
+    path = tmp_path / '000010000.map'
+    CompiledMap.from_bundle(create_bundle(), 'map.nx:1:2').save(path)
+    data = path.read_bytes()
+
+    # Cut inside the version, the header length, the header, and the columns
+    for size in [4, 6, 12, len(data) - 1]:
+        path.write_bytes(data[:size])
+        assert CompiledMap.load(path) is None
+
+    # Extra bytes would misalign the columns
+    path.write_bytes(data + b'\0')
+    assert CompiledMap.load(path) is None
+
+
+def get_values(instances, names):
+    return [tuple(getattr(inst, name) for name in names) + (inst._layer,) for inst in instances]
+
+
+def test_compiled_map_instances(tmp_path):
+
+    values = create_bundle()
+    bundle = MapBundle(values.map_id, freeze(values.info), freeze(values.back), freeze(values.layers),
+                       portal=freeze(values.portal))
+    CompiledMap.from_bundle(values, 'map.nx:1:2').save(tmp_path / '000010000.map')
+    compiled = CompiledMap.load(tmp_path / '000010000.map')
+
+    # Instances match the map bundle, numbers that were strings in nx stay strings
+    names = ['x', 'y', 'zM', 'tS', 'u', 'no']
+    assert get_values(compiled.get_tiles(1), names) == [
+        (0, 10, 1, 'grassySoil', 'bsc', '0', 0), (90, -10, 1, 'grassySoil', 'enH0', '2', 1)]
+    assert [(x, y, zM, tS, u, str(no), layer) for x, y, zM, tS, u, no, layer
+            in get_values(bundle.get_tiles(1), names)] == get_values(compiled.get_tiles(1), names)
+    assert compiled.get_tiles(0) == []
+
+    names = ['x', 'y', 'f', 'oS', 'l0', 'l1', 'l2']
+    assert get_values(compiled.get_objects(1), names) == get_values(bundle.get_objects(1), names)
+
+    names = ['bS', 'no', 'rx', 'ani', 'type']
+    assert get_values(compiled.get_backgrounds(), names) == [('grassySoil_new', '0', -5, 0, 3, 2)]
+    assert [(bS, str(no), *rest) for bS, no, *rest in get_values(bundle.get_backgrounds(), names)] == \
+        get_values(compiled.get_backgrounds(), names)
+
+    names = ['pt', 'tm', 'pS', 'pn']
+    assert get_values(compiled.get_portals(), names) == get_values(bundle.get_portals(), names)
+
+    # Keys used to collect links
+    assert compiled.get_tile_keys() == [('grassySoil', 'bsc', '0'), ('grassySoil', 'enH0', '2')]
+    assert compiled.get_object_keys() == bundle.get_object_keys()
+    assert compiled.get_background_keys() == [('grassySoil_new', '0', 0)]
+    assert compiled.get_portal_keys() == bundle.get_portal_keys() == [(2, 'default')]
+    assert compiled.get_portal_targets() == bundle.get_portal_targets() == [100000000]
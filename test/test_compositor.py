@@ -0,0 +1,98 @@
+import pygame
+from maplepy.base.compositor import BackgroundCompositor
+
+
+class CountingSprites:
+    """ Background sprites that fill the surface with one color and count how often they are drawn """
+
+    def __init__(self, color=(200, 100, 50)):
+        self.color = color
+        self.blits = 0
+
+    def blit(self, surface, offset=None):
+        self.blits += 1
+        surface.fill(self.color)
+
+
+def test_render_reuses_frame():
+
+    compositor = BackgroundCompositor(40, 30)
+    sprites = CountingSprites()
+    view = pygame.Rect(0, 0, 80, 60)
+
+    frame = compositor.render(sprites, view, (80, 60))
+    assert sprites.blits == 1
+
+    # Nothing changed, same frame without drawing
+    assert compositor.render(sprites, view.copy(), (80, 60)) is frame
+    assert sprites.blits == 1
+
+
+def test_render_changes():
+
+    compositor = BackgroundCompositor(40, 30)
+    sprites = CountingSprites()
+    view = pygame.Rect(0, 0, 80, 60)
+    compositor.render(sprites, view, (80, 60))
+
+    # A sprite changed
+    compositor.render(sprites, view, (80, 60), changed=True)
+    assert sprites.blits == 2
+
+    # The view moved
+    view = view.move(5, 0)
+    compositor.render(sprites, view, (80, 60))
+    assert sprites.blits == 3
+
+    # Other sprites
+    other = CountingSprites((0, 255, 0))
+    frame = compositor.render(other, view, (80, 60))
+    assert other.blits == 1
+    assert frame.get_at((10, 10))[:3] == (0, 255, 0)
+
+    # The target size changed
+    frame = compositor.render(other, view, (100, 70))
+    assert other.blits == 2
+    assert frame.get_size() == (100, 70)
+
+    # Invalidated, eg. by a new scaling mode
+    compositor.set_scaling('nearest')
+    compositor.render(other, view, (100, 70))
+    assert other.blits == 3
+
+
+def test_integer_scaling():
+
+    compositor = BackgroundCompositor(40, 30, 'integer')
+    sprites = CountingSprites()
+    view = pygame.Rect(0, 0, 130, 100)
+
+    # Largest whole factor is 3, centered with black borders
+    frame = compositor.render(sprites, view, (130, 100))
+    assert compositor.area == pygame.Rect(5, 5, 120, 90)
+    assert frame.get_at((4, 50))[:3] == (0, 0, 0)
+    assert frame.get_at((5, 5))[:3] == sprites.color
+    assert frame.get_at((124, 94))[:3] == sprites.color
+    assert frame.get_at((125, 95))[:3] == (0, 0, 0)
+
+    # Background rects map to the scaled area
+    assert compositor.get_screen_rect(pygame.Rect(10, 10, 5, 5)) == pygame.Rect(34, 34, 18, 18)
+
+
+def test_integer_scaling_fallback():
+
+    compositor = BackgroundCompositor(40, 30, 'integer')
+    sprites = CountingSprites()
+    view = pygame.Rect(0, 0, 30, 20)
+
+    # Target smaller than the background, smooth scaled to fill it
+    frame = compositor.render(sprites, view, (30, 20))
+    assert compositor.area == pygame.Rect(0, 0, 30, 20)
+    expected = pygame.transform.smoothscale(compositor.surface, (30, 20))
+    assert pygame.image.tobytes(frame, 'RGB') == pygame.image.tobytes(expected, 'RGB')
+
+
+def test_invalid_scaling():
+
+    compositor = BackgroundCompositor(40, 30, 'bilinear')
+    assert compositor.scaling == 'smooth'
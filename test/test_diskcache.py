@@ -0,0 +1,84 @@
+import os
+
+from maplepy.helper.diskcache import DiskCache
+
+
+def create_data(w, h, value):
+    return bytes([value]) * (w * h * 4)
+
+
+def test_disk_cache_roundtrip(tmp_path):
+
+    cache = DiskCache(tmp_path, 'map.nx:1:2')
+    cache.put('Tile/a.img/bsc/0', 2, 3, create_data(2, 3, 1))
+    cache.put('Tile/a.img/bsc/1', 1, 1, create_data(1, 1, 2))
+
+    # Incomplete buffers are not stored
+    cache.put('Tile/a.img/bsc/2', 4, 4, create_data(1, 1, 3))
+    assert cache.get('Tile/a.img/bsc/2') is None
+    cache.close()
+
+    # Read back after reopening
+    cache = DiskCache(tmp_path, 'map.nx:1:2')
+    w, h, data = cache.get('Tile/a.img/bsc/0')
+    assert (w, h, bytes(data)) == (2, 3, create_data(2, 3, 1))
+    assert bytes(cache.get('Tile/a.img/bsc/1')[2]) == create_data(1, 1, 2)
+    assert cache.get('Tile/a.img/bsc/3') is None
+    cache.close()
+
+
+def test_disk_cache_identity(tmp_path):
+
+    cache = DiskCache(tmp_path, 'map.nx:1:2')
+    cache.put('Tile/a.img/bsc/0', 1, 1, create_data(1, 1, 1))
+    cache.close()
+
+    # Map files changed, every buffer is discarded
+    cache = DiskCache(tmp_path, 'map.nx:1:3')
+    assert cache.get('Tile/a.img/bsc/0') is None
+    assert os.path.getsize(cache.pack_file) == 0
+    cache.close()
+
+
+def test_disk_cache_missing_pack(tmp_path):
+
+    cache = DiskCache(tmp_path, 'map.nx:1:2')
+    cache.put('Tile/a.img/bsc/0', 1, 1, create_data(1, 1, 1))
+    cache.close()
+    os.remove(cache.pack_file)
+
+    # Index without a pack file is not used
+    cache = DiskCache(tmp_path, 'map.nx:1:2')
+    assert cache.get('Tile/a.img/bsc/0') is None
+    cache.put('Tile/a.img/bsc/0', 1, 1, create_data(1, 1, 4))
+    assert bytes(cache.get('Tile/a.img/bsc/0')[2]) == create_data(1, 1, 4)
+    cache.close()
+
+
+def test_disk_cache_max_size(tmp_path):
+
+    cache = DiskCache(tmp_path, 'map.nx:1:2', max_size=40)
+    cache.put('a', 2, 2, create_data(2, 2, 1))
+    cache.put('b', 2, 2, create_data(2, 2, 2))
+    cache.flush()
+    mapped = cache.get('a')[2]
+
+    # Full, starts over with only the new buffer
+    cache.put('c', 2, 2, create_data(2, 2, 3))
+    assert os.path.getsize(cache.pack_file) == 16
+    assert cache.get('a') is None
+    assert bytes(cache.get('c')[2]) == create_data(2, 2, 3)
+
+    # Buffers mapped before the reset are still readable
+    assert bytes(mapped) == create_data(2, 2, 1)
+
+    # Larger than the whole cache, never stored
+    cache.put('d', 5, 5, create_data(5, 5, 4))
+    assert cache.get('d') is None
+
+    # Exit without flushing, the old index does not point into the new pack file
+    other = DiskCache(tmp_path, 'map.nx:1:2', max_size=40)
+    assert other.get('a') is None
+    assert other.get('b') is None
+    other.close()
+    cache.close()
@@ -0,0 +1,145 @@
+import os
+import random
+
+import numpy as np
+import pygame
+import pytest
+from maplepy.base.display import SpriteDisplay, merge_rects
+from maplepy.base.sprite import BackgroundSprites, LayeredSprites
+from maplepy.info.canvas import Canvas
+from maplepy.info.instance import Instance
+
+WIDTH = 160
+HEIGHT = 120
+
+
+def test_merge_rects():
+
+    # Separate rects are kept, empty rects dropped
+    assert merge_rects([(0, 0, 10, 10), (20, 0, 10, 10), (0, 0, 0, 5)]) == [
+        pygame.Rect(0, 0, 10, 10), pygame.Rect(20, 0, 10, 10)]
+
+    # Touching edges do not overlap
+    assert len(merge_rects([(0, 0, 10, 10), (10, 0, 10, 10)])) == 2
+
+    # Overlapping rects become their union
+    assert merge_rects([(0, 0, 10, 10), (5, 5, 10, 10)]) == [pygame.Rect(0, 0, 15, 15)]
+
+
+def test_merge_rects_chain():
+
+    # The union of two rects overlaps a rect neither overlapped alone
+    rects = [(0, 0, 10, 10), (30, 0, 10, 10), (8, 8, 24, 4)]
+    assert merge_rects(rects) == [pygame.Rect(0, 0, 40, 12)]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_merge_rects_disjoint(seed):
+
+    rng = random.Random(seed)
+    rects = [pygame.Rect(rng.randint(0, 200), rng.randint(0, 200),
+                         rng.randint(0, 40), rng.randint(0, 40)) for _ in range(50)]
+    merged = merge_rects(rects)
+
+    # No two merged rects overlap, every rect is covered
+    for index, rect in enumerate(merged):
+        assert rect.collidelist(merged[index + 1:]) == -1
+    for rect in rects:
+        if rect.width and rect.height:
+            assert any(other.contains(rect) for other in merged)
+
+
+def create_instance(rng, x, y, frames):
+    """ Instance with a few frames of different sizes, fading in some of them """
+
+    inst = Instance()
+    inst.x, inst.y = x, y
+    inst.type, inst.rx, inst.ry, inst.cx, inst.cy = 0, 0, 0, 0, 0
+    for _ in range(frames):
+        w, h = rng.randint(4, 20), rng.randint(4, 20)
+        image = pygame.Surface((w, h), pygame.SRCALPHA)
+        image.fill((rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255), 255))
+        image.fill((0, 0, 0, 0), (w // 4, h // 4, w // 2, h // 2))
+        canvas = Canvas(image, w, h, rng.randint(0, w), rng.randint(0, h))
+        canvas.set_delay(rng.choice([30, 60, 120]))
+        if rng.random() < 0.3:
+            canvas.set_alpha(255, 64)
+        inst.add_canvas(canvas)
+    return inst
+
+
+def create_display(seed, scaling):
+    """ Background, two layers and an overlay, mostly still with a few animations """
+
+    rng = random.Random(seed)
+    display = SpriteDisplay(WIDTH, HEIGHT)
+
+    # Background, drawn at half size and scaled up
+    if scaling:
+        display.set_fixed_background(WIDTH // 2, HEIGHT // 2, scaling)
+    display.background_sprites = BackgroundSprites()
+    sky = create_instance(rng, 0, 0, 1)
+    sky.type, sky.cx, sky.cy = 3, sky.rect.width, sky.rect.height
+    display.background_sprites.sprites.add(sky)
+    for _ in range(3):
+        inst = create_instance(rng, rng.randint(-40, 40), rng.randint(-30, 30), rng.choice([1, 2]))
+        display.background_sprites.sprites.add(inst)
+
+    # Layers in world space
+    for _ in range(2):
+        layer = LayeredSprites()
+        for _ in range(12):
+            inst = create_instance(rng, rng.randint(-40, 240), rng.randint(-40, 180),
+                                   rng.choice([1, 1, 1, 2, 3]))
+            inst.update_layer(rng.randint(0, 3))
+            layer.sprites.add(inst)
+        display.layered_sprites.append(layer)
+
+    # Overlay in screen space
+    display.overlayed_sprites = LayeredSprites()
+    display.overlayed_sprites.sprites.add(create_instance(rng, 20, 20, 2))
+
+    return display
+
+
+def get_pixels(surface):
+    return np.frombuffer(pygame.image.tobytes(surface, 'RGB'), np.uint8)
+
+
+@pytest.mark.parametrize('scaling', [None, 'smooth', 'nearest', 'integer'])
+@pytest.mark.parametrize('seed', range(3))
+def test_dirty_rects_match_redraw(seed, scaling):
+
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+
+    # Same sprites, created twice so animations are independent
+    expected = create_display(seed, scaling)
+    dirty = create_display(seed, scaling)
+    dirty.set_dirty_rects(True)
+
+    expected_surface = pygame.Surface((WIDTH, HEIGHT))
+    dirty_surface = pygame.Surface((WIDTH, HEIGHT))
+
+    partial = 0
+    for frame in range(24):
+
+        # Moving the view draws everything again
+        if frame == 12:
+            expected.move_view(3, 2)
+            dirty.move_view(3, 2)
+
+        expected.update()
+        dirty.update()
+
+        expected_surface.fill((0, 0, 0))
+        expected.blit(expected_surface)
+        if dirty.blit(dirty_surface) is not None:
+            partial += 1
+
+        assert np.array_equal(get_pixels(expected_surface), get_pixels(dirty_surface)), \
+            f'frame {frame}'
+
+    # Most frames only drew the regions that changed
+    assert partial > 12
@@ -0,0 +1,20 @@
+from types import SimpleNamespace
+
+from maplepy.base.drawlist import DrawList
+
+
+def test_drawlist_order():
+
+    sprites = [SimpleNamespace(name=name, _layer=layer)
+               for name, layer in [('a', 2), ('b', 0), ('c', 2), ('d', 1), ('e', 0)]]
+
+    draw_list = DrawList()
+    draw_list.add(*sprites)
+
+    # Sorted by layer, insertion order within a layer
+    assert [sprite.name for sprite in draw_list] == ['b', 'e', 'd', 'a', 'c']
+
+    version = draw_list.version
+    draw_list.remove(sprites[1])
+    assert len(draw_list) == 4
+    assert draw_list.version != version
@@ -0,0 +1,34 @@
+import random
+
+import pygame
+from maplepy.base.grid import SpatialGrid
+
+
+def test_grid_query():
+
+    rng = random.Random(0)
+    rects = [pygame.Rect(rng.randint(-2000, 2000), rng.randint(-2000, 2000),
+                         rng.randint(0, 600), rng.randint(0, 600)) for _ in range(500)]
+
+    grid = SpatialGrid(128)
+    for index, rect in enumerate(rects):
+        grid.insert(index, rect)
+
+    # Every overlapping rect is found
+    for view in [pygame.Rect(0, 0, 1280, 720), pygame.Rect(-5000, -5000, 10000, 10000)]:
+        expected = {index for index, rect in enumerate(rects) if rect.colliderect(view)}
+        assert expected <= grid.query(view)
+
+
+def test_grid_move():
+
+    grid = SpatialGrid(100)
+    grid.insert('a', pygame.Rect(0, 0, 50, 50))
+    grid.move('a', pygame.Rect(500, 500, 50, 50))
+
+    assert grid.query(pygame.Rect(0, 0, 100, 100)) == set()
+    assert grid.query(pygame.Rect(450, 450, 100, 100)) == {'a'}
+
+    grid.remove('a')
+    assert len(grid) == 0
+    assert not grid.cells
@@ -0,0 +1,84 @@
+import os
+import random
+from types import SimpleNamespace
+
+import pygame
+import pytest
+from maplepy.info.instance import Instance
+from maplepy.nx.spritenx import LayeredSpritesNx
+
+
+def fix_overlapping_sprites_reference(group):
+    """ Original pairwise version, every sprite against every sprite """
+
+    for sprite in group:
+        if not sprite.canvas_list[0].z:
+            continue
+        for collision in pygame.sprite.spritecollide(sprite, group, False):
+            if not collision.canvas_list[0].z:
+                continue
+            if sprite.canvas_list[0].z > collision.canvas_list[0].z:
+                group.change_layer(sprite, collision._layer+1)
+
+
+def create_instances(seed, count):
+
+    rng = random.Random(seed)
+    instances = []
+    for _ in range(count):
+        inst = Instance()
+        inst.canvas_list = [SimpleNamespace(z=rng.choice([None, 0, 1, 2, 3, 4, 5]))]
+        inst.rect = pygame.Rect(rng.randint(-800, 800), rng.randint(-400, 400),
+                                rng.randint(0, 200), rng.randint(0, 200))
+        inst.update_layer(rng.randint(0, 3))
+        instances.append(inst)
+    return instances
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_fix_overlapping_sprites(seed):
+
+    expected = pygame.sprite.LayeredUpdates()
+    for inst in create_instances(seed, 300):
+        expected.add(inst)
+
+    # Same instances, created again
+    layered = LayeredSpritesNx()
+    for inst in create_instances(seed, 300):
+        layered.sprites.add(inst)
+
+    fix_overlapping_sprites_reference(expected)
+    layered.fix_overlapping_sprites()
+
+    assert [(sprite.rect, sprite._layer) for sprite in expected.sprites()] == \
+        [(sprite.rect, sprite._layer) for sprite in layered.sprites.sprites()]
+
+
+def test_fix_overlapping_sprites_map():
+
+    pytest.importorskip('nxpy')
+    from maplepy.nx.parser.mapnx import MapNx
+
+    pygame.init()
+    pygame.display.set_mode((800, 600))
+
+    map_nx = MapNx()
+    map_nx.open(os.path.join(os.path.dirname(__file__), 'map.nx'))
+    bundle = map_nx.load_bundle('000010000')
+    if not bundle:
+        pytest.skip('000010000 not found')
+
+    for index in range(8):
+
+        # Load each layer twice, without fixing it
+        expected = LayeredSpritesNx()
+        layered = LayeredSpritesNx()
+        for group in [expected, layered]:
+            group.fix_overlapping_sprites = lambda: None
+            group.load_layer(map_nx, bundle, index)
+
+        fix_overlapping_sprites_reference(expected.sprites)
+        LayeredSpritesNx.fix_overlapping_sprites(layered)
+
+        assert [(sprite.x, sprite.y, sprite._layer) for sprite in expected.sprites.sprites()] == \
+            [(sprite.x, sprite.y, sprite._layer) for sprite in layered.sprites.sprites()]
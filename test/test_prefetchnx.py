@@ -0,0 +1,61 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from maplepy.nx.parser.bundlenx import MapBundle, freeze
+from maplepy.nx.prefetchnx import PrefetcherNx
+from maplepy.nx.spritenx import collect_links
+
+
+class SlowDisplay:
+    """ Display whose bundle loads block until released """
+
+    def __init__(self):
+        self.map_nx = SimpleNamespace(file=None)
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.loaded = []
+
+    def get_bundle(self, map_id):
+        self.started.set()
+        self.release.wait(5)
+        self.loaded.append(map_id)
+        return None
+
+
+def create_bundle():
+    tile = {'u': 'bsc', 'no': 0}
+    layer = {'info': {'tS': 'grassySoil'}, 'tile': [tile] * 3, 'obj': []}
+    return MapBundle('000010000', layers=freeze([layer] + [None] * 7))
+
+
+def test_cancel_does_not_wait():
+
+    display = SlowDisplay()
+    prefetcher = PrefetcherNx(display)
+    prefetcher.set_budget(2, 1.0, 0)
+    prefetcher.start(MapBundle('000010000', portal=freeze([
+        {'tm': 100000000}, {'tm': 100000001}])))
+    assert display.started.wait(5)
+
+    # Returns while the thread is still loading a bundle
+    thread = prefetcher.thread
+    start = time.perf_counter()
+    prefetcher.cancel()
+    assert time.perf_counter() - start < 0.5
+    assert thread.is_alive()
+
+    # Stops after the current bundle
+    display.release.set()
+    thread.join(5)
+    assert display.loaded == ['100000000']
+
+
+def test_collect_links_cancelled():
+
+    cancelled = threading.Event()
+    assert collect_links(SimpleNamespace(file=None), create_bundle(), cancelled) == [
+        'Tile/grassySoil.img/bsc/0']
+
+    cancelled.set()
+    assert collect_links(SimpleNamespace(file=None), create_bundle(), cancelled) == []
@@ -0,0 +1,46 @@
+import json
+
+from maplepy.helper.cache import LRUCache
+from maplepy.helper.profiler import Profiler
+
+
+def test_profiler_disabled():
+
+    profiler = Profiler()
+    start = profiler.start()
+    profiler.count('blits', 3)
+    profiler.stop('render', start)
+    profiler.end_frame()
+
+    assert start == 0
+    assert not profiler.history
+    assert not profiler.events
+
+
+def test_profiler_frames(tmp_path):
+
+    profiler = Profiler()
+    cache = LRUCache()
+    cache.put('a', 1)
+    profiler.add_cache('sprites', cache)
+    profiler.enable()
+
+    for _ in range(2):
+        start = profiler.start()
+        profiler.count('blits', 3)
+        cache.get('a')
+        cache.get('b')
+        profiler.stop('render', start)
+        profiler.end_frame()
+
+    summary = profiler.get_summary()
+    assert summary['timings']['render'] >= 0
+    assert summary['counters']['blits'] == 3
+    assert summary['hit_rates']['sprites'] == 0.5
+
+    # Chrome trace events
+    path = tmp_path / 'trace.json'
+    profiler.save(path)
+    with open(path) as file:
+        events = json.load(file)['traceEvents']
+    assert [event['ph'] for event in events] == ['X', 'C', 'X', 'C']
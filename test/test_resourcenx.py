@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pygame
+import pytest
+from maplepy.helper.tracer import Tracer
+from maplepy.nx.resourcenx import ResourceNx
+
+
+class SlowFile():
+    """ Nx file whose nodes take a while to resolve, counts every resolve """
+
+    def __init__(self, error=False):
+        self.resolved = 0
+        self.error = error
+        self.lock = threading.Lock()
+
+    def resolve(self, key):
+        with self.lock:
+            self.resolved += 1
+        time.sleep(0.05)
+        if self.error:
+            raise ValueError(key)
+        children = [SimpleNamespace(name='delay', value=120)]
+        return SimpleNamespace(get_children=lambda: children)
+
+
+def request_all(fn, count=8):
+
+    results = [None] * count
+    errors = [None] * count
+
+    def request(index):
+        try:
+            results[index] = fn()
+        except Exception as error:
+            errors[index] = error
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_single_flight():
+
+    resources = ResourceNx()
+    file = SlowFile()
+    results, errors = request_all(lambda: resources.get_data(file, 'Obj/a.img/0'))
+
+    # One load, shared by every thread
+    assert file.resolved == 1
+    assert errors == [None] * 8
+    assert all(result is results[0] for result in results)
+    assert results[0] == {'delay': 120}
+    assert not resources.loading
+
+
+def test_single_flight_error():
+
+    resources = ResourceNx()
+    file = SlowFile(error=True)
+    _, errors = request_all(lambda: resources.get_data(file, 'Obj/a.img/0'))
+
+    # Every waiting thread gets the error, the key can be loaded again
+    assert file.resolved == 1
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert not resources.loading
+    with pytest.raises(ValueError):
+        resources.get_data(file, 'Obj/a.img/0')
+    assert file.resolved == 2
+
+
+class AtlasFile():
+    """ Nx file with one set of two groups, each with two 8x8 frames """
+
+    def resolve(self, key):
+        if key == 'Tile/a.img':
+            groups = [SimpleNamespace(name=name, list_children=lambda: ['0', '1'])
+                      for name in ['bsc', 'edU']]
+            return SimpleNamespace(get_children=lambda: groups)
+        image = SimpleNamespace(width=8, height=8, get_data=lambda: bytes(8 * 8 * 4))
+        return SimpleNamespace(get_image=lambda: image)
+
+
+def test_atlas_budget():
+
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+
+    resources = ResourceNx()
+    atlas = resources.get_atlas(AtlasFile(), 'Tile/a.img')
+
+    # Page memory is charged once, to the atlas
+    assert len(resources.sprites) == 4
+    assert resources.sprites.size == 0
+    assert resources.atlases.size == atlas.get_size() > 0
+
+    # Evicting the atlas evicts its sprites
+    resources.set_budget(sprite_budget=1)
+    assert len(resources.atlases) == 0
+    assert len(resources.sprites) == 0
+
+
+def test_budget_split():
+
+    # Caches sharing a budget stay within it together
+    resources = ResourceNx(sprite_budget=1000, data_budget=100)
+    sprite_caches = [resources.sprites, resources.atlases, resources.animations]
+    assert 0 < sum(cache.budget for cache in sprite_caches) <= 1000
+    assert 0 < resources.data.budget + resources.frames.budget <= 100
+    assert all(cache.budget for cache in sprite_caches)
+
+    resources.set_budget(sprite_budget=3, data_budget=0)
+    assert all(cache.budget for cache in sprite_caches)
+    assert resources.data.budget == resources.frames.budget == 0
+
+
+def test_decode_error():
+
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+
+    class BrokenFile(AtlasFile):
+        """ Nx file where one sprite fails to decode """
+
+        def resolve(self, key):
+            if key == 'Tile/a.img/bsc/1':
+                image = SimpleNamespace(width=8, height=8, get_data=lambda: 1 / 0)
+                return SimpleNamespace(get_image=lambda: image)
+            return super().resolve(key)
+
+    # The bad sprite is skipped, every other sprite is loaded
+    resources = ResourceNx()
+    keys = [f'Tile/a.img/bsc/{index}' for index in range(3)]
+    resources.load_sprites(BrokenFile(), keys, workers=4)
+    assert 'Tile/a.img/bsc/0' in resources.sprites
+    assert 'Tile/a.img/bsc/1' not in resources.sprites
+    assert 'Tile/a.img/bsc/2' in resources.sprites
+    assert not resources.loading
+
+
+def test_worker_timings():
+
+    class MissingFile():
+        """ Nx file without nodes, resolving the slow key takes longer """
+
+        def resolve(self, key):
+            time.sleep(0.05 if key == 'slow' else 0.001)
+            return None
+
+    tracer = Tracer()
+    tracer.start('load_map')
+    with patch('maplepy.nx.resourcenx.tracer', tracer):
+        ResourceNx().load_sprites(MissingFile(), ['a', 'slow', 'b'], workers=4)
+    trace = tracer.finish()
+
+    # Keys resolved on worker threads are recorded below the decode span
+    decode = trace.find('decode')[0]
+    assert [span.args['key'] for span in decode.children] == ['a', 'slow', 'b']
+    assert trace.get_slowest(1)[0].args['key'] == 'slow'
@@ -0,0 +1,41 @@
+import threading
+
+from maplepy.helper.tracer import NULL_SPAN, Tracer
+
+
+def test_tracer_tree():
+
+    tracer = Tracer()
+    tracer.start('load_map', map_id='000010000')
+    with tracer.span('layer', index=0):
+        tracer.count('sprite_hits')
+        for key in ['a', 'b']:
+            with tracer.span('decode', key=key):
+                tracer.count('bytes_decoded', 4)
+    trace = tracer.finish()
+
+    assert tracer.last is trace
+    assert [child.name for child in trace.children] == ['layer']
+    assert len(trace.find('decode')) == 2
+    assert trace.get_counters() == {'sprite_hits': 1, 'bytes_decoded': 8}
+    assert {span.args['key'] for span in trace.get_slowest()} == {'a', 'b'}
+    assert 'decode x2' in trace.summary()
+    assert trace.to_dict()['children'][0]['args'] == {'index': 0}
+
+
+def test_tracer_other_threads():
+
+    tracer = Tracer()
+    tracer.start('load_map')
+
+    # Spans of threads without a trace are not recorded
+    spans = []
+    thread = threading.Thread(target=lambda: spans.append(tracer.span('decode')))
+    thread.start()
+    thread.join()
+    tracer.count('sprite_hits')
+
+    trace = tracer.finish()
+    assert spans == [NULL_SPAN]
+    assert not trace.children
+    assert tracer.span('decode') is NULL_SPAN